@@ -0,0 +1,89 @@
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from image import construct_output_filename, get_converter_for_args
+from modes import Modes
+from palette import SCENE_CHANGE_ERROR, ScenePalette, render_indexed_image
+from stats import stage
+from video import ImageSequenceCapture, convert_frame_to_grid, convert_frame_to_text, convert_frames
+
+
+def construct_animation_filename(args: argparse, animation_format: str) -> str:
+    """
+    Constructs output filename of the animation, look construct_output_filename
+
+    :param args: parsed console arguments
+    :param animation_format: gif or png
+    :return: string with correct output file path
+    """
+    return os.path.splitext(construct_output_filename(args))[0] + "." + animation_format
+
+
+def render_indexed_frames(frames: ImageSequenceCapture, args: argparse, animation_format: str) -> list:
+    """
+    Converts every frame into characters and colors in the frame pipeline
+    and renders it straight into the palette image. Frames share the palette
+    until the scene changes, look ScenePalette. GIF frames may have palettes of their own,
+    APNG has one palette, so the palette of the first frame is kept for all of them
+
+    :param frames: ImageSequenceCapture object
+    :param args: parsed console arguments
+    :param animation_format: gif or png
+    :return: list of PIL Image objects in P mode
+    """
+    converter = get_converter_for_args(args)
+    palette = ScenePalette(args.palette, args.palette_colors,
+                           SCENE_CHANGE_ERROR if animation_format == "gif" else None)
+    ascii_frames = []
+    for char_indices, colors in convert_frames(frames, args, convert_frame_to_grid):
+        with stage("rendering"):
+            ascii_frames.append(render_indexed_image(converter.atlas, converter.char_codes[char_indices], colors,
+                                                     palette))
+    return ascii_frames
+
+
+def convert_animation(image: Image, args: argparse, output_filename: str = None) -> int:
+    """
+    Converts every frame of the multi-frame picture. Frames are read lazily
+    and converted in the frame pipeline of the video mode, so they are converted
+    in parallel with more than one worker. Monochrome frames are written to the .txt file
+    one after another, colored frames are written to the animated GIF or PNG,
+    rendered into palette images with the palette option
+
+    :param image: PIL Image object with more than one frame
+    :param args: parsed console arguments
+    :param output_filename: path to the output file, look construct_output_filename by default,
+                            colored animations get the extension of the animation format
+    :return: number of converted frames
+    """
+    frames = ImageSequenceCapture(image)
+    try:
+        if args.mode == Modes.BW.value:
+            output_filename = output_filename or construct_output_filename(args)
+            with open(output_filename, 'w', encoding='utf8', errors='ignore') as file:
+                # frames are separated by the empty line
+                file.write('\n'.join(convert_frames(frames, args, convert_frame_to_text)))
+        else:
+            animation_format = args.animation_format or ("gif" if image.format == "GIF" else "png")
+            if output_filename is None:
+                output_filename = construct_animation_filename(args, animation_format)
+            else:
+                output_filename = os.path.splitext(output_filename)[0] + "." + animation_format
+            if args.palette is not None:
+                ascii_frames = render_indexed_frames(frames, args, animation_format)
+            else:
+                ascii_frames = [Image.fromarray(np.ascontiguousarray(ascii_frame[..., ::-1]), mode="RGB")
+                                for ascii_frame in convert_frames(frames, args)]
+            ascii_frames[0].save(output_filename, format=animation_format.upper(), save_all=True,
+                                 append_images=ascii_frames[1:], duration=frames.durations,
+                                 loop=image.info.get("loop", 0), compress_level=args.png_compression)
+        logging.info(f"animation has converted to ASCII-art: {len(frames.durations)} frames")
+        return len(frames.durations)
+    except FileNotFoundError:
+        logging.error("output file directory is incorrect")
+        sys.exit(3)
@@ -1,4 +1,4 @@
-import os.path
+import os
 import argparse
 import sys
 import logging
@@ -6,9 +6,42 @@ import logging
 import PIL
 from PIL import Image
 
-from modes import Modes
-from image import convert_image_to_ascii
-from video import convert_video_to_ascii
+from batch import convert_batch, is_batch_input
+from cache import restore_from_cache, save_to_cache
+from colortext import COLOR_FORMATS, COLOR_LEVELS
+from dither import DITHERING_METHODS
+from modes import AnsiColors, Backends, Modes, Selections
+from palette import MAX_PALETTE_COLORS, PALETTES
+from image import (TEXT_CHAR_ASPECT, construct_output_filename, convert_image_to_ascii, convert_image_to_ascii_widths,
+                   is_animated)
+from stats import PROFILE_ENVIRONMENT_VARIABLE, PROFILERS, profile, report_stats, stage
+from streaming import convert_image_to_ascii_in_strips
+
+
+def positive_int(value: str) -> int:
+    """
+    Type of console arguments which must be positive integers
+
+    :param value: console argument
+    :return: integer
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def color_levels(value: str) -> int:
+    """
+    Type of the number of color levels, look colortext.quantize_colors
+
+    :param value: console argument
+    :return: integer from 2 to 256
+    """
+    levels = int(value)
+    if not 2 <= levels <= COLOR_LEVELS:
+        raise argparse.ArgumentTypeError(f"number of color levels must be from 2 to {COLOR_LEVELS}")
+    return levels
 
 
 def parse_arguments(args: argparse):
@@ -20,12 +53,87 @@ def parse_arguments(args: argparse):
     """
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("image", help="path to the image")
+    parser.add_argument("image", help="path to the image, directory or glob pattern of images")
     parser.add_argument("-od", "--output_dir", type=str, help="output directory")
     parser.add_argument("-w", "--width", type=int, help="width of ASCII-art file")
-    parser.add_argument("-m", "--mode", type=str, required=True, help="program mode: colored (c), monochrome (bw) or "
-                                                                      "video (v)",
-                        choices=("c", "bw", "v"))
+    parser.add_argument("-m", "--mode", type=str, required=True, help="program mode: colored (c), monochrome (bw), "
+                                                                      "video (v), video in the terminal (t) or real-time "
+                                                                      "video in the preview window (l)",
+                        choices=("c", "bw", "v", "t", "l"))
+    parser.add_argument("-b", "--backend", type=str, default=Backends.NUMPY.value,
+                        help="conversion backend: vectorized numpy (default) or reference python",
+                        choices=tuple(backend.value for backend in Backends))
+    parser.add_argument("-ch", "--charset", type=str, help="characters of ASCII-art from darkest to brightest, "
+                                                            "the order does not matter for density and structure "
+                                                            "selection")
+    parser.add_argument("-sl", "--selection", type=str, default=Selections.LINEAR.value,
+                        help="selection of characters: by brightness intervals (linear, default), "
+                             "by ink of glyphs measured from the font (density) or by the shape "
+                             "of glyphs (structure)",
+                        choices=tuple(selection.value for selection in Selections))
+    parser.add_argument("-di", "--dithering", type=str, choices=DITHERING_METHODS,
+                        help="dithering of linear and density selection")
+    parser.add_argument("-ca", "--char_aspect", type=float, default=TEXT_CHAR_ASPECT,
+                        help="height to width ratio of the character cell the monochrome ASCII-art is viewed with, "
+                             f"{TEXT_CHAR_ASPECT:g} for terminal and editor fonts by default, 1 keeps a row per pixel "
+                             "row")
+    parser.add_argument("-cf", "--color_format", type=str, default="png", choices=COLOR_FORMATS,
+                        help="format of colored ASCII-art: rendered picture (png), text with terminal escape "
+                             "sequences (ansi) or the HTML page (html)")
+    parser.add_argument("-cl", "--color_levels", type=color_levels, default=COLOR_LEVELS,
+                        help="levels of every color channel of ansi and html formats from 2 to 256, "
+                             "fewer levels merge more characters into one escape sequence or <span>")
+    parser.add_argument("-pa", "--palette", type=str, choices=PALETTES,
+                        help="render colored ASCII-art pictures and animations into the palette image: colors "
+                             "of the picture (adaptive) or the 6x6x6 color cube (fixed), RGB by default")
+    parser.add_argument("-pc", "--palette_colors", type=int, default=MAX_PALETTE_COLORS,
+                        help=f"number of colors of the adaptive palette from 1 to {MAX_PALETTE_COLORS}")
+    parser.add_argument("-pl", "--png_compression", type=int, default=6, choices=range(10), metavar="0-9",
+                        help="compression level of .png files, lower levels are written faster")
+    parser.add_argument("-ws", "--widths", type=int, nargs="+",
+                        help="convert the picture into ASCII-art of every of these widths after one decode, "
+                             "the width is added to the name of every output file, e.g. ascii_80.txt")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes in video and batch modes, "
+                                                          "all CPU cores by default")
+    parser.add_argument("-sh", "--strip_height", type=positive_int, help="convert the image in strips of this many rows "
+                                                                "and write every strip as soon as it is ready")
+    parser.add_argument("-mf", "--manifest", action="store_true", help="image is a manifest file "
+                                                                       "with one path to the image per line")
+    parser.add_argument("-dt", "--delta_threshold", type=int, help="video mode converts again only the cells "
+                                                                   "whose colour changed by more than this value")
+    parser.add_argument("-ac", "--ansi_colors", type=str, default=AnsiColors.TRUECOLOR.value,
+                        help="colors of the terminal mode: 24-bit (truecolor) or 256-color palette (256)",
+                        choices=tuple(colors.value for colors in AnsiColors))
+    parser.add_argument("-cd", "--cache_dir", type=str, help="directory of the conversion cache, "
+                                                             "converted pictures are reused from it")
+    parser.add_argument("-cs", "--cache_size", type=int, default=512, help="size limit of the conversion cache "
+                                                                           "in megabytes")
+    parser.add_argument("-st", "--stats", type=str, nargs="?", const="text", choices=("text", "json"),
+                        help="report durations of the conversion stages as a table (text) or as JSON (json)")
+    parser.add_argument("-pr", "--profile", type=str, choices=PROFILERS,
+                        default=os.environ.get(PROFILE_ENVIRONMENT_VARIABLE),
+                        help="profile the conversion, also enabled by the " + PROFILE_ENVIRONMENT_VARIABLE +
+                             " environment variable")
+    parser.add_argument("-af", "--animation_format", type=str, choices=("gif", "png"),
+                        help="format of colored ASCII-art of animated pictures: animated GIF (gif) "
+                             "or APNG (png), the format of the picture by default")
+    parser.add_argument("-ss", "--start", type=float, help="start of the converted clip of the video in seconds")
+    parser.add_argument("-to", "--end", type=float, help="end of the converted clip of the video in seconds")
+    parser.add_argument("-fr", "--fps", type=float, help="frame rate of ASCII-art video, frames of the video "
+                                                         "between the output frames are skipped without decoding. "
+                                                         "Target frame rate in real-time mode")
+    parser.add_argument("-en", "--every_n", type=int, help="convert only every n-th frame of the video")
+    parser.add_argument("-vf", "--video_format", type=str, default="avi", choices=("avi", "raw"),
+                        help="format of ASCII-art video: rendered MJPG video (avi) or characters and colors "
+                             "of the frames (raw), which are played and exported by asciivideo.py")
+    parser.add_argument("-sg", "--segment_length", type=float,
+                        help="write ASCII-art video in segments of this many seconds with a checkpoint after "
+                             "every segment, interrupted conversion resumes from the last segment")
+    parser.add_argument("-sr", "--segment_range", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                        help="convert only the segments from FIRST to LAST, so several processes "
+                             "can convert parts of the same video at once")
+    parser.add_argument("-np", "--no_preview", action="store_true", help="do not show the preview window "
+                                                                         "in video mode")
     return parser.parse_args(args)
 
 
@@ -39,23 +147,93 @@ def initial_checkup(args: argparse):
     :return: string declaring program status
     """
 
+    if args.selection != Selections.LINEAR.value or args.dithering is not None:
+        if args.strip_height or args.delta_threshold is not None or args.mode == Modes.TERMINAL.value:
+            logging.warning("strip, delta and terminal conversion support only linear selection "
+                            "without dithering")
+    if args.palette is not None:
+        if not 1 <= args.palette_colors <= MAX_PALETTE_COLORS:
+            logging.error(f"number of palette colors must be from 1 to {MAX_PALETTE_COLORS}")
+            return
+        if args.strip_height:
+            logging.warning("strips are rendered without the palette")
+
+    # cv2 is imported only by the video modes, it takes longer to load than to convert a small picture
     if args.mode == Modes.VIDEO.value:
+        from video import convert_video_to_ascii
         if convert_video_to_ascii(args):
             logging.info("video has converted to ASCII-art")
         return
 
+    if args.mode == Modes.LIVE.value:
+        from live import play_live
+        play_live(args)
+        return
+
+    if args.mode == Modes.TERMINAL.value:
+        from terminal import play_in_terminal
+        play_in_terminal(args)
+        return
+
+    if is_batch_input(args):
+        convert_batch(args)
+        return
+
+    # the cache keeps one output file for the picture, several widths are converted every time
+    if (args.cache_dir is not None and not args.widths
+            and restore_from_cache(args.image, construct_output_filename(args), args)):
+        logging.info("image has converted to ASCII-art from the cache")
+        return
+
+    strips = args.strip_height and not args.widths
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
     try:
-        image = Image.open(args.image)
+        with stage("decode"):
+            # strips are meant for pictures of any size, look convert_image_to_ascii_in_strips
+            if strips:
+                Image.MAX_IMAGE_PIXELS = None
+            image = Image.open(args.image)
+            # JPEG pictures are decoded at the reduced scale while they are resized, look Converter.resize,
+            # strips decode the picture themselves
+            if image.format != "JPEG" and not strips:
+                image.load()
     except FileNotFoundError:
         logging.error("picture not found or path to the picture is incorrect")
         return
     except PIL.UnidentifiedImageError:
         logging.error("picture file is unsupported or corrupted")
         return
+    except Image.DecompressionBombError:
+        logging.error("picture is too large to convert at once, convert it in strips (-sh)")
+        return
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+    # animations are not cached: the name of their output file is known only after the picture is opened
+    if is_animated(image):
+        from animation import convert_animation
+        convert_animation(image, args)
+        return
+
+    if args.widths:
+        if args.strip_height:
+            logging.warning("several widths are converted without strips")
+        convert_image_to_ascii_widths(image, args)
+        return
+
+    if args.strip_height:
+        convert_image_to_ascii_in_strips(image, args)
+    else:
+        convert_image_to_ascii(image, args)
 
-    return convert_image_to_ascii(image, args)
+    if args.cache_dir is not None:
+        save_to_cache(args.image, construct_output_filename(args), args)
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    initial_checkup(parse_arguments(sys.argv[1:]))
+    arguments = parse_arguments(sys.argv[1:])
+    with profile(arguments.profile):
+        initial_checkup(arguments)
+    if arguments.stats is not None:
+        report_stats(arguments.stats)
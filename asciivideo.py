@@ -0,0 +1,274 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from glyphs import build_glyph_atlas, render_glyphs
+from image import FONT, JPG_CHAR_SAFE_BOX_HEIGHT, JPG_CHAR_SAFE_BOX_WIDTH, build_char_codes
+from modes import AnsiColors
+from terminal import HIDE_CURSOR, RESET_COLOR, SHOW_CURSOR, TerminalScreen
+
+MAGIC = b"ASCIIVID"
+VERSION = 1
+FLAG_COLORS = 1
+# magic, version, flags, columns, rows, fps, number of frames, offset of the frame index, length of the character set
+HEADER = struct.Struct("<8sHHIIdIQH")
+# offset of the frame in the file and its time in seconds
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("timestamp", "<f8")])
+EXPORT_FORMATS = ("terminal", "png", "avi")
+
+
+class AsciiVideoWriter:
+    """
+    Writes ASCII-art video frame by frame: the grid of character indices
+    and optionally the grid of RGB-colors of every frame, followed by the frame index.
+    Frames are appended sequentially, the header is completed when the writer is closed
+    """
+
+    def __init__(self, path: str, columns: int, rows: int, fps: float, chars: str, colors: bool = True):
+        """
+        :param path: path to the output file
+        :param columns: number of characters in a row
+        :param rows: number of rows
+        :param fps: frame rate
+        :param chars: string of ASCII-characters the indices refer to
+        :param colors: store colors of characters
+        """
+        self.file = open(path, 'wb')
+        self.columns, self.rows, self.fps, self.chars = columns, rows, fps, chars
+        self.flags = FLAG_COLORS if colors else 0
+        self.index = []
+        self.write_header(0, 0)
+        self.file.write(chars.encode("ascii"))
+
+    def write_header(self, frame_count: int, index_offset: int):
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.flags, self.columns, self.rows, self.fps, frame_count,
+                                    index_offset, len(self.chars)))
+
+    def write(self, char_indices: np.ndarray, colors: np.ndarray = None, timestamp: float = None):
+        """
+        :param char_indices: array of character indices with shape (rows, columns)
+        :param colors: array of RGB-colors of characters with shape (rows, columns, 3)
+        :param timestamp: time of the frame in seconds, the frame number divided by the frame rate by default
+        """
+        if char_indices.shape != (self.rows, self.columns):
+            raise ValueError(f"frame must have {self.rows} rows and {self.columns} columns")
+        if timestamp is None:
+            timestamp = len(self.index) / self.fps
+        self.index.append((self.file.tell(), timestamp))
+        self.file.write(np.ascontiguousarray(char_indices, dtype=np.uint8).data)
+        if self.flags & FLAG_COLORS:
+            self.file.write(np.ascontiguousarray(colors, dtype=np.uint8).data)
+
+    def close(self):
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        self.file.seek(0)
+        self.write_header(len(self.index), index_offset)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsciiVideoReader:
+    """
+    Reads ASCII-art video written by AsciiVideoWriter through mmap,
+    so any frame is available at once without reading the ones before it.
+    Frames are arrays over the mapped file, they are valid until the reader is closed
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path to the file
+        """
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.columns, self.rows, self.fps, frame_count, index_offset,
+         chars_length) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("file is not an ASCII-art video")
+        self.has_colors = bool(flags & FLAG_COLORS)
+        self.chars = self.map[HEADER.size:HEADER.size + chars_length].decode("ascii")
+
+        cells = self.columns * self.rows
+        self.frame_size = cells * (4 if self.has_colors else 1)
+        if index_offset:
+            self.index = np.frombuffer(self.map, dtype=INDEX_DTYPE, count=frame_count, offset=index_offset)
+        else:
+            # the writer was not closed, complete frames are still readable
+            first_frame = HEADER.size + chars_length
+            frame_count = (len(self.map) - first_frame) // self.frame_size
+            self.index = np.zeros(frame_count, dtype=INDEX_DTYPE)
+            self.index["offset"] = first_frame + np.arange(frame_count) * self.frame_size
+            self.index["timestamp"] = np.arange(frame_count) / self.fps
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def frame(self, frame_index: int) -> tuple:
+        """
+        :param frame_index: number of the frame
+        :return: tuple with the array of character indices with shape (rows, columns)
+                 and the array of RGB-colors with shape (rows, columns, 3) or None
+        """
+        offset = int(self.index["offset"][frame_index])
+        cells = self.columns * self.rows
+        char_indices = np.frombuffer(self.map, dtype=np.uint8, count=cells, offset=offset)
+        char_indices = char_indices.reshape((self.rows, self.columns))
+        if not self.has_colors:
+            return char_indices, None
+        colors = np.frombuffer(self.map, dtype=np.uint8, count=cells * 3, offset=offset + cells)
+        return char_indices, colors.reshape((self.rows, self.columns, 3))
+
+    def close(self):
+        self.index = None
+        try:
+            self.map.close()
+        except BufferError:
+            # frames are still referenced, the mapping is released together with them
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def render_frame(reader: AsciiVideoReader, frame_index: int) -> np.ndarray:
+    """
+    :param reader: opened AsciiVideoReader object
+    :param frame_index: number of the frame
+    :return: array of RGB-pixels of the rendered frame, characters without colors are white
+    """
+    atlas = build_glyph_atlas(reader.chars, FONT, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+    char_indices, colors = reader.frame(frame_index)
+    if colors is None:
+        colors = np.full(char_indices.shape + (3,), 255, dtype=np.uint8)
+    return render_glyphs(atlas, build_char_codes(reader.chars)[char_indices], colors)
+
+
+def export_frames(reader: AsciiVideoReader, output: str, export_format: str, first: int = 0, last: int = None):
+    """
+    Renders the range of frames to the directory of .png files or to the .avi file
+
+    :param reader: opened AsciiVideoReader object
+    :param output: path to the directory or the .avi file
+    :param export_format: png or avi
+    :param first: number of the first frame
+    :param last: number of the frame to stop at, the end of the video by default
+    """
+    frame_range = range(len(reader))[first:last]
+    if export_format == "png":
+        os.makedirs(output, exist_ok=True)
+        for frame_index in frame_range:
+            Image.fromarray(render_frame(reader, frame_index), mode="RGB").save(
+                os.path.join(output, f"ascii_{frame_index:06d}.png"))
+        return
+
+    size = (reader.columns * JPG_CHAR_SAFE_BOX_WIDTH, reader.rows * JPG_CHAR_SAFE_BOX_HEIGHT)
+    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'MJPG'), reader.fps, size)
+    try:
+        for frame_index in frame_range:
+            writer.write(np.ascontiguousarray(render_frame(reader, frame_index)[..., ::-1]))
+    finally:
+        writer.release()
+
+
+def play_frames(reader: AsciiVideoReader, first: int = 0, last: int = None,
+                ansi_colors: str = AnsiColors.TRUECOLOR.value, stream=None):
+    """
+    Plays the range of frames in the terminal at the frame rate of the video
+
+    :param reader: opened AsciiVideoReader object
+    :param first: number of the first frame
+    :param last: number of the frame to stop at, the end of the video by default
+    :param ansi_colors: truecolor or 256
+    :param stream: text stream to write to, sys.stdout by default
+    """
+    if stream is None:
+        stream = sys.stdout
+    screen = TerminalScreen(ansi_colors)
+    char_codes = build_char_codes(reader.chars)
+    white = np.full((reader.rows, reader.columns, 3), 255, dtype=np.uint8)
+
+    stream.write(HIDE_CURSOR)
+    start = time.perf_counter()
+    try:
+        for shown, frame_index in enumerate(range(len(reader))[first:last]):
+            char_indices, colors = reader.frame(frame_index)
+            stream.write(screen.draw(char_codes[char_indices], white if colors is None else colors))
+            stream.flush()
+            delay = start + (shown + 1) / reader.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.write(f"\x1b[{reader.rows + 1};1H" + RESET_COLOR + SHOW_CURSOR)
+        stream.flush()
+
+
+def parse_arguments(args: list):
+    """
+    Parse list of arguments via argparse
+
+    :param args: list of arguments
+    :return: parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="player and exporter of ASCII-art videos written by "
+                                                 "the video mode with -vf raw")
+    parser.add_argument("video", help="path to the ASCII-art video")
+    parser.add_argument("-f", "--format", type=str, default="terminal", choices=EXPORT_FORMATS,
+                        help="play in the terminal (terminal), render to the directory of .png files (png) "
+                             "or to the .avi file (avi)")
+    parser.add_argument("-o", "--output", type=str, help="output directory or .avi file")
+    parser.add_argument("-ff", "--first", type=int, default=0, help="number of the first frame")
+    parser.add_argument("-lf", "--last", type=int, help="number of the frame to stop at")
+    parser.add_argument("-ac", "--ansi_colors", type=str, default=AnsiColors.TRUECOLOR.value,
+                        choices=tuple(colors.value for colors in AnsiColors), help="colors of the terminal")
+    return parser.parse_args(args)
+
+
+def main(args: argparse) -> bool:
+    """
+    :param args: parsed console arguments
+    :return: True if the video was played or exported
+    """
+    try:
+        reader = AsciiVideoReader(args.video)
+    except FileNotFoundError:
+        logging.error("ASCII-art video not found or path to the video is incorrect")
+        return False
+    except (ValueError, struct.error):
+        logging.error("file is not an ASCII-art video or it is corrupted")
+        return False
+
+    with reader:
+        if args.format == "terminal":
+            play_frames(reader, args.first, args.last, args.ansi_colors)
+            return True
+        if args.output is None:
+            logging.error("output path is required for png and avi formats")
+            return False
+        export_frames(reader, args.output, args.format, args.first, args.last)
+    logging.info("ASCII-art video has been exported")
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,102 @@
+import fractions
+import os
+import struct
+
+# sizes and offsets of AVI 1.0 are 32-bit, most players read them as signed
+MAX_AVI_SIZE = 2 ** 31 - 1
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+FRAME_CHUNK_ID = b"00dc"
+# lists which hold frames of the first stream, other lists are skipped
+FRAME_LISTS = (b"AVI ", b"AVIX", b"movi", b"rec ")
+MAIN_HEADER_SIZE = 56
+STREAM_HEADER_SIZE = 56
+BITMAP_INFO_SIZE = 40
+INDEX_ENTRY_SIZE = 16
+
+
+def find_frame_chunks(path: str) -> list:
+    """
+    Finds compressed frames of the first video stream of the AVI file without reading them.
+    OpenDML files of several RIFF parts are supported
+
+    :param path: path to the AVI file
+    :return: list of tuples with the offset and the size of every frame
+    """
+    chunks = []
+    with open(path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        if file.read(4) != b"RIFF" or file.read(8)[4:] != b"AVI ":
+            raise ValueError(f"{path} is not an AVI file")
+        position = 12
+        while position + 8 <= end:
+            file.seek(position)
+            chunk_id, size = struct.unpack("<4sI", file.read(8))
+            if chunk_id in (b"RIFF", b"LIST") and file.read(4) in FRAME_LISTS:
+                # the content of the list follows its type
+                position += 12
+                continue
+            if chunk_id[:2] == FRAME_CHUNK_ID[:2] and chunk_id[2:] in (b"dc", b"db"):
+                if position + 8 + size > end:
+                    raise ValueError(f"{path} is truncated")
+                chunks.append((position + 8, size))
+            position += 8 + size + (size & 1)
+    return chunks
+
+
+def write_avi(path: str, frames: list, fps: float, size: tuple):
+    """
+    Writes MJPG AVI file from frames of other AVI files, frames are copied without decoding,
+    so joined videos keep the quality of every frame
+
+    :param path: path to the output file
+    :param frames: list of tuples with the path to the source file, the offset and the size of every frame,
+                   look find_frame_chunks
+    :param fps: frame rate of the video
+    :param size: width and height of frames
+    """
+    width, height = size
+    sizes = [frame_size for _, _, frame_size in frames]
+    largest = max(sizes, default=0)
+    movi_size = 4 + sum(8 + frame_size + (frame_size & 1) for frame_size in sizes)
+    strl_size = 4 + 8 + STREAM_HEADER_SIZE + 8 + BITMAP_INFO_SIZE
+    hdrl_size = 4 + 8 + MAIN_HEADER_SIZE + 8 + strl_size
+    riff_size = 4 + 8 + hdrl_size + 8 + movi_size + 8 + INDEX_ENTRY_SIZE * len(frames)
+    if 8 + riff_size > MAX_AVI_SIZE:
+        raise ValueError("video is too large for AVI 1.0")
+    rate = fractions.Fraction(fps).limit_denominator(1001)
+
+    with open(path, 'wb') as file:
+        file.write(struct.pack("<4sI4s", b"RIFF", riff_size, b"AVI "))
+        file.write(struct.pack("<4sI4s", b"LIST", hdrl_size, b"hdrl"))
+        file.write(struct.pack("<4sI14I", b"avih", MAIN_HEADER_SIZE, round(1000000 / fps), round(largest * fps), 0,
+                               AVIF_HASINDEX, len(frames), 0, 1, largest, width, height, 0, 0, 0, 0))
+        file.write(struct.pack("<4sI4s", b"LIST", strl_size, b"strl"))
+        file.write(struct.pack("<4sI4s4sIHHIIIIIIIIhhhh", b"strh", STREAM_HEADER_SIZE, b"vids", b"MJPG", 0, 0, 0, 0,
+                               rate.denominator, rate.numerator, 0, len(frames), largest, 0xFFFFFFFF, 0,
+                               0, 0, width, height))
+        file.write(struct.pack("<4sIIiiHH4sIiiII", b"strf", BITMAP_INFO_SIZE, BITMAP_INFO_SIZE, width, height, 1, 24,
+                               b"MJPG", width * height * 3, 0, 0, 0, 0))
+
+        file.write(struct.pack("<4sI4s", b"LIST", movi_size, b"movi"))
+        index, offset, source, source_path = [], 4, None, None
+        try:
+            for frame_path, frame_offset, frame_size in frames:
+                if frame_path != source_path:
+                    if source is not None:
+                        source.close()
+                    source, source_path = open(frame_path, 'rb'), frame_path
+                source.seek(frame_offset)
+                file.write(struct.pack("<4sI", FRAME_CHUNK_ID, frame_size))
+                file.write(source.read(frame_size))
+                if frame_size & 1:
+                    file.write(b"\0")
+                # offsets of the index are counted from the type of the movi list
+                index.append(struct.pack("<4sIII", FRAME_CHUNK_ID, AVIIF_KEYFRAME, offset, frame_size))
+                offset += 8 + frame_size + (frame_size & 1)
+        finally:
+            if source is not None:
+                source.close()
+        file.write(struct.pack("<4sI", b"idx1", INDEX_ENTRY_SIZE * len(frames)))
+        file.write(b"".join(index))
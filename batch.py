@@ -0,0 +1,228 @@
+import argparse
+import collections
+import concurrent.futures
+import glob
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+
+import PIL
+from PIL import Image
+
+from cache import restore_from_cache, save_to_cache
+from image import construct_output_extension, convert_image_to_ascii, get_converter_for_args, is_animated
+from modes import Modes
+from streaming import convert_image_to_ascii_in_strips
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+# pictures are sent to the workers in chunks, several chunks per worker keep the load balanced
+CHUNKS_PER_WORKER = 8
+# added to the name of the picture to name its output file, such files are not collected again
+OUTPUT_SUFFIX = "_ascii"
+
+
+def is_batch_input(args: argparse) -> bool:
+    """
+    Checks whether the input is a directory, a glob pattern or a manifest file
+
+    :param args: parsed console arguments
+    :return: True if several images should be converted
+    """
+    return args.manifest or os.path.isdir(args.image) or glob.has_magic(args.image)
+
+
+def is_generated_file(path: str, args: argparse) -> bool:
+    """
+    :param path: path to the file
+    :param args: parsed console arguments
+    :return: True if the file is an output of the batch: it is named like one or lies in the output directory
+    """
+    if os.path.splitext(os.path.basename(path))[0].endswith(OUTPUT_SUFFIX):
+        return True
+    if args.output_dir is None:
+        return False
+    output_dir = os.path.abspath(args.output_dir)
+    return os.path.commonpath([output_dir, os.path.abspath(path)]) == output_dir
+
+
+def collect_input_files(args: argparse) -> tuple[str, list[str]]:
+    """
+    Collects paths of the images to convert.
+    Directories are searched recursively, manifest file contains
+    one path per line, relative paths are resolved against its directory.
+    Outputs of earlier runs found in directories and by glob patterns are skipped, look is_generated_file
+
+    :param args: parsed console arguments
+    :return: tuple with the root directory of the inputs and the list of image paths
+    """
+    if args.manifest:
+        manifest_dir = os.path.dirname(args.image)
+        with open(args.image, encoding='utf8') as manifest:
+            paths = [os.path.join(manifest_dir, line.strip()) for line in manifest
+                     if line.strip() and not line.startswith('#')]
+    elif os.path.isdir(args.image):
+        paths = [os.path.join(directory, filename)
+                 for directory, _, filenames in os.walk(args.image)
+                 for filename in filenames
+                 if filename.lower().endswith(IMAGE_EXTENSIONS)]
+        return args.image, sorted(path for path in paths if not is_generated_file(path, args))
+    else:
+        paths = [path for path in glob.glob(args.image, recursive=True)
+                 if os.path.isfile(path) and not is_generated_file(path, args)]
+
+    paths = sorted(paths)
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths]) if paths else ""
+    return root, paths
+
+
+def construct_batch_output_filename(path: str, root: str, args: argparse) -> str:
+    """
+    Constructs output filename for one image of the batch.
+    Output file is placed next to the image, or into the directory
+    under -od which mirrors the position of the image relative to the root
+
+    :param path: path to the image
+    :param root: root directory of the inputs
+    :param args: parsed console arguments
+    :return: string with correct output file path
+    """
+    extension = construct_output_extension(args)
+    output_dir = os.path.dirname(path)
+    if args.output_dir is not None:
+        relative_dir = os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(root))
+        output_dir = os.path.normpath(os.path.join(args.output_dir, relative_dir))
+    filename = os.path.splitext(os.path.basename(path))[0] + OUTPUT_SUFFIX + extension
+    return os.path.join(output_dir, filename)
+
+
+def init_worker(args: argparse):
+    """
+    Loads lookup tables and fonts once per worker process
+
+    :param args: parsed console arguments
+    """
+    get_converter_for_args(args)
+
+
+def find_clashing_outputs(paths: list[str], output_filenames: list[str]) -> set[str]:
+    """
+    Finds pictures which would be written to the same output file,
+    e.g. pic.png and pic.jpg in one directory
+
+    :param paths: paths to the images
+    :param output_filenames: paths to their output files
+    :return: set of paths to the images whose output file is shared with another image
+    """
+    owners = collections.defaultdict(list)
+    for path, output_filename in zip(paths, output_filenames):
+        owners[os.path.normcase(os.path.abspath(output_filename))].append(path)
+    return {path for clashing in owners.values() if len(clashing) > 1 for path in clashing}
+
+
+def convert_file(path: str, output_filename: str, args: argparse) -> int:
+    """
+    Converts one image of the batch. Runs in the worker processes.
+    Errors are logged with the path to the image, so one broken picture does not stop the batch
+
+    :param path: path to the image
+    :param output_filename: path to the output file
+    :param args: parsed console arguments
+    :return: number of converted pixels, 0 if the image was not converted
+    """
+    try:
+        return convert_picture(path, output_filename, args)
+    except SystemExit:
+        logging.error(f"picture was not converted: {path}")
+    except Exception as error:
+        logging.error(f"picture was not converted: {path}: {error}")
+    return 0
+
+
+def convert_picture(path: str, output_filename: str, args: argparse) -> int:
+    """
+    :param path: path to the image
+    :param output_filename: path to the output file
+    :param args: parsed console arguments
+    :return: number of converted pixels, 0 if the image was not converted
+    """
+    os.makedirs(os.path.dirname(output_filename) or ".", exist_ok=True)
+    if args.cache_dir is not None and restore_from_cache(path, output_filename, args):
+        with Image.open(path) as image:
+            return image.size[0] * image.size[1]
+
+    try:
+        image = Image.open(path)
+    except FileNotFoundError:
+        logging.error(f"picture not found or path to the picture is incorrect: {path}")
+        return 0
+    except PIL.UnidentifiedImageError:
+        logging.error(f"picture file is unsupported or corrupted: {path}")
+        return 0
+
+    # JPEG pictures are decoded at the reduced size, look Converter.resize
+    width, height = image.size
+    with image:
+        if is_animated(image):
+            # animations are not cached, like in ascii.initial_checkup. The batch already runs
+            # in the process pool, so frames are converted in this worker one after another
+            from animation import convert_animation
+            animation_args = argparse.Namespace(**vars(args))
+            animation_args.workers = 1
+            return width * height * convert_animation(image, animation_args, output_filename)
+        if args.strip_height:
+            convert_image_to_ascii_in_strips(image, args, output_filename=output_filename)
+        else:
+            convert_image_to_ascii(image, args, output_filename=output_filename)
+
+    if args.cache_dir is not None:
+        save_to_cache(path, output_filename, args)
+    return width * height
+
+
+def convert_batch(args: argparse) -> bool:
+    """
+    Converts every image of the batch in the process pool
+    and logs the throughput summary
+
+    :param args: parsed console arguments
+    :return: True if at least one image has been converted
+    """
+    if args.mode not in (Modes.BW.value, Modes.COLOR.value):
+        logging.error("batch mode supports only image modes (-m bw or -m c)")
+        return False
+
+    root, paths = collect_input_files(args)
+    if not paths:
+        logging.error("no pictures found for the batch")
+        return False
+
+    output_filenames = [construct_batch_output_filename(path, root, args) for path in paths]
+    clashing = find_clashing_outputs(paths, output_filenames)
+    for path in sorted(clashing):
+        logging.error(f"picture was not converted, another picture has the same output file name: {path}")
+    jobs = [(path, output_filename) for path, output_filename in zip(paths, output_filenames)
+            if path not in clashing]
+    if not jobs:
+        return False
+
+    workers = args.workers
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    converted, pixels = 0, 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker, initargs=(args,)) as pool:
+        chunksize = max(1, len(jobs) // (workers * CHUNKS_PER_WORKER))
+        for image_pixels in pool.map(convert_file, *zip(*jobs), itertools.repeat(args), chunksize=chunksize):
+            if image_pixels:
+                converted += 1
+                pixels += image_pixels
+    elapsed = time.perf_counter() - start
+
+    logging.info(f"converted {converted} of {len(paths)} pictures in {elapsed:.2f} s: "
+                 f"{converted / elapsed:.1f} pictures/s, {pixels / elapsed / 1e6:.2f} megapixels/s")
+    return converted > 0
@@ -0,0 +1,485 @@
+import argparse
+import datetime
+import html
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import PIL
+from PIL import Image
+
+import ascii
+import colortext
+import dither
+import image
+import palette
+import video
+from glyphs import build_glyph_atlas
+from modes import Backends, Selections
+
+IMAGE_SIZES = {
+    "256": (256, 256),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+VIDEO_SIZE = (640, 360)
+# frames of this size are large enough for pickling to cost more than the conversion
+TRANSPORT_VIDEO_SIZE = (1920, 1080)
+STARTUP_IMAGE_SIZE = (64, 64)
+# levels of color channels of the quantized text outputs
+TEXT_OUTPUT_LEVELS = 8
+
+
+def make_synthetic_image(size: tuple, seed: int = 0) -> Image:
+    """
+    Generates the picture with smooth gradients and noise,
+    so that every character and color is used
+
+    :param size: size of the picture
+    :param seed: seed of the noise
+    :return: PIL Image object
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    pixels = np.stack(np.broadcast_arrays(x, y, (x + y) / 2), axis=2)
+    pixels = pixels + rng.normal(0, 24, (height, width, 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode="RGB")
+
+
+def make_synthetic_video(path: str, size: tuple, frames: int, fps: float = 25.0):
+    """
+    Writes the video of the moving gradient with cv2
+
+    :param path: path to the .avi file
+    :param size: size of the frames
+    :param frames: number of frames
+    :param fps: frame rate
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    base = np.asarray(make_synthetic_image(size))
+    for frame_index in range(frames):
+        writer.write(np.roll(base, frame_index * 4, axis=1))
+    writer.release()
+
+
+def measure(function, repeat: int) -> tuple:
+    """
+    Calls the function several times
+
+    :param function: function without arguments
+    :param repeat: number of calls
+    :return: tuple with the best time in seconds and the result of the last call
+    """
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def record(results: list, name: str, size: str, seconds: float, pixels: int = None, frames: int = None):
+    """
+    Adds the measurement to the results and logs it
+
+    :param results: list of measurements
+    :param name: name of the stage
+    :param size: name of the input size
+    :param seconds: duration of the stage
+    :param pixels: number of processed pixels
+    :param frames: number of processed frames
+    """
+    entry = {"name": name, "size": size, "seconds": seconds}
+    if pixels is not None:
+        entry["pixels"] = pixels
+        entry["pixels_per_second"] = pixels / seconds if seconds else None
+    if frames is not None:
+        entry["frames"] = frames
+        entry["frames_per_second"] = frames / seconds if seconds else None
+    results.append(entry)
+
+    throughput = ""
+    if pixels is not None and seconds:
+        throughput += f" {pixels / seconds / 1e6:10.2f} Mpx/s"
+    if frames is not None and seconds:
+        throughput += f" {frames / seconds:10.2f} frames/s"
+    logging.info(f"{name:<24} {size:>8} {seconds * 1000:10.2f} ms{throughput}")
+
+
+def run_image_benchmarks(sizes: dict, width: int, repeat: int, backend: str) -> list:
+    """
+    Times every stage of the picture conversion separately
+
+    :param sizes: dictionary of picture names and sizes
+    :param width: width of ASCII-art
+    :param repeat: number of runs of every stage, the best one is reported
+    :param backend: conversion backend
+    :return: list of measurements
+    """
+    results = []
+    chars = image.ASCII_CHARS
+    # lookup tables and glyphs are built once per process, they are not a part of the measurements
+    image.build_lookup_table(chars)
+    build_glyph_atlas(chars, image.FONT, image.JPG_CHAR_SAFE_BOX_WIDTH, image.JPG_CHAR_SAFE_BOX_HEIGHT)
+    for name, size in sizes.items():
+        picture = make_synthetic_image(size)
+        source_pixels = size[0] * size[1]
+
+        seconds, resized = measure(lambda: image.resize_image(picture, width, is_video=True), repeat)
+        record(results, "resize", name, seconds, pixels=source_pixels)
+        pixels = np.asarray(resized.convert(mode="RGB"))
+        cells = pixels.shape[0] * pixels.shape[1]
+
+        if backend == Backends.PYTHON.value:
+            pixel_list = list(map(tuple, pixels.reshape(-1, 3).tolist()))
+            seconds, _ = measure(lambda: [image.map_pixel_to_ascii(pixel, chars) for pixel in pixel_list], repeat)
+            record(results, "mapping", name, seconds, pixels=cells)
+            seconds, ascii_art_string = measure(
+                lambda: image.convert_pixels_to_ascii(pixel_list, pixels.shape[1], chars), repeat)
+            record(results, "mapping+assembly", name, seconds, pixels=cells)
+            seconds, _ = measure(
+                lambda: image.draw_colored_image_by_char(ascii_art_string, pixel_list, resized.size), repeat)
+            record(results, "colour rendering", name, seconds, pixels=cells)
+        else:
+            seconds, char_indices = measure(lambda: image.map_frame_to_ascii(pixels, chars), repeat)
+            record(results, "mapping", name, seconds, pixels=cells)
+            seconds, ascii_art_string = measure(lambda: image.assemble_ascii_string(char_indices, chars), repeat)
+            record(results, "string assembly", name, seconds, pixels=cells)
+            seconds, _ = measure(lambda: image.draw_colored_image(ascii_art_string, pixels, resized.size), repeat)
+            record(results, "colour rendering", name, seconds, pixels=cells)
+
+            selections = {
+                "mapping (ordered)": image.Converter(width, dithering=dither.ORDERED),
+                "mapping (floyd-steinberg)": image.Converter(width, selection=Selections.DENSITY.value,
+                                                             dithering=dither.FLOYD_STEINBERG),
+                "mapping (structure)": image.Converter(width, selection=Selections.STRUCTURE.value),
+            }
+            for stage_name, converter in selections.items():
+                sample = np.asarray(converter.resize(picture).convert(mode="RGB"))
+                seconds, _ = measure(lambda: converter.map_pixels(sample), repeat)
+                record(results, stage_name, name, seconds, pixels=cells)
+
+            full_pixels = np.asarray(picture)
+            seconds, _ = measure(lambda: image.map_frame_to_ascii(full_pixels, chars), repeat)
+            record(results, "mapping (full size)", name, seconds, pixels=source_pixels)
+    return results
+
+
+def run_decode_benchmarks(sizes: dict, width: int, repeat: int) -> list:
+    """
+    Times decoding and resizing of JPEG pictures: the full decode with the plain resize
+    against the reduced decode with the pre-shrink of Converter.resize,
+    and measures how much the resized pictures differ
+
+    :param sizes: dictionary of picture names and sizes
+    :param width: width of ASCII-art
+    :param repeat: number of runs of every stage, the best one is reported
+    :return: list of measurements, the reduced path reports the mean difference
+             of channels from the full path on the scale from 0 to 255
+    """
+    results = []
+    converter = image.Converter(width)
+    with tempfile.TemporaryDirectory() as directory:
+        for name, size in sizes.items():
+            path = os.path.join(directory, f"{name}.jpg")
+            make_synthetic_image(size).save(path, quality=90)
+            source_pixels = size[0] * size[1]
+
+            def full():
+                with Image.open(path) as picture:
+                    picture.load()
+                    return image.resize_image(picture, width, is_video=True)
+
+            def reduced():
+                with Image.open(path) as picture:
+                    return converter.resize(picture)
+
+            seconds, expected = measure(full, repeat)
+            record(results, "decode+resize (full)", name, seconds, pixels=source_pixels)
+            seconds, actual = measure(reduced, repeat)
+            record(results, "decode+resize (reduced)", name, seconds, pixels=source_pixels)
+            difference = np.abs(np.asarray(expected, dtype=np.int16) - np.asarray(actual, dtype=np.int16)).mean()
+            results[-1]["mean_difference"] = float(difference)
+            logging.info(f"{'':<24} {name:>8} mean difference from the full decode {difference:.2f}")
+    return results
+
+
+def format_html_per_cell(char_codes: np.ndarray, pixels: np.ndarray) -> str:
+    """
+    Builds the HTML lines with one <span> for every character, the reference for colortext
+
+    :param char_codes: array of character codes with shape (height, width)
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :return: lines of the <pre> element
+    """
+    colors = colortext.pack_truecolor(pixels).tolist()
+    return ''.join(''.join(f'<span style="color:#{color:06x}">{html.escape(chr(char_code), quote=False)}</span>'
+                           for char_code, color in zip(row_codes, row_colors)) + '\n'
+                   for row_codes, row_colors in zip(char_codes.tolist(), colors))
+
+
+def run_text_output_benchmarks(sizes: dict, width: int, repeat: int) -> list:
+    """
+    Times the HTML and ANSI writers of colored ASCII-art against one <span> for every character
+    and reports the size of the output
+
+    :param sizes: dictionary of picture names and sizes
+    :param width: width of ASCII-art
+    :param repeat: number of runs of every stage, the best one is reported
+    :return: list of measurements with the size of the output in bytes
+    """
+    results = []
+    converter = image.Converter(width, mode="c")
+    for name, size in sizes.items():
+        pixels = np.asarray(converter.resize(make_synthetic_image(size)).convert(mode="RGB"))
+        char_codes = converter.map_pixels(pixels)
+        cells = pixels.shape[0] * pixels.shape[1]
+        writers = {
+            "html (per cell)": lambda: format_html_per_cell(char_codes, pixels),
+            "html (runs)": lambda: ''.join(colortext.iter_html_lines(char_codes, pixels)),
+            f"html (runs, {TEXT_OUTPUT_LEVELS} levels)":
+                lambda: ''.join(colortext.iter_html_lines(char_codes, pixels, TEXT_OUTPUT_LEVELS)),
+            "ansi (runs)": lambda: ''.join(colortext.iter_ansi_lines(char_codes, pixels)),
+            f"ansi (runs, {TEXT_OUTPUT_LEVELS} levels)":
+                lambda: ''.join(colortext.iter_ansi_lines(char_codes, pixels, levels=TEXT_OUTPUT_LEVELS)),
+        }
+        for stage_name, write in writers.items():
+            seconds, text = measure(write, repeat)
+            record(results, stage_name, name, seconds, pixels=cells)
+            results[-1]["bytes"] = len(text.encode("utf8"))
+            logging.info(f"{'':<24} {name:>8} {len(text) / 1024:10.1f} KiB")
+    return results
+
+
+def save_png(picture: Image, compress_level: int) -> bytes:
+    """
+    :param picture: PIL Image object
+    :param compress_level: compression level of the .png file
+    :return: contents of the .png file
+    """
+    output = io.BytesIO()
+    picture.save(output, format="PNG", compress_level=compress_level)
+    return output.getvalue()
+
+
+def run_palette_benchmarks(sizes: dict, width: int, repeat: int) -> list:
+    """
+    Times rendering and saving of colored ASCII-art as RGB .png file and as palette .png file
+    and reports the size of the file
+
+    :param sizes: dictionary of picture names and sizes
+    :param width: width of ASCII-art
+    :param repeat: number of runs of every stage, the best one is reported
+    :return: list of measurements with the size of the file in bytes
+    """
+    results = []
+    converter = image.Converter(width, mode="c")
+    for name, size in sizes.items():
+        pixels = np.asarray(converter.resize(make_synthetic_image(size)).convert(mode="RGB"))
+        ascii_art_string = converter.convert_pixels(pixels)
+        cells = pixels.shape[0] * pixels.shape[1]
+        writers = {
+            "png (rgb)": lambda: save_png(Image.fromarray(converter.draw(ascii_art_string, pixels)), 6),
+            "png (rgb, level 1)": lambda: save_png(Image.fromarray(converter.draw(ascii_art_string, pixels)), 1),
+        }
+        for kind in palette.PALETTES:
+            writers[f"png ({kind} palette)"] = lambda kind=kind: save_png(
+                converter.draw_indexed(ascii_art_string, pixels, palette.ScenePalette(kind)), 6)
+        for stage_name, write in writers.items():
+            seconds, data = measure(write, repeat)
+            record(results, stage_name, name, seconds, pixels=cells)
+            results[-1]["bytes"] = len(data)
+            logging.info(f"{'':<24} {name:>8} {len(data) / 1024:10.1f} KiB")
+    return results
+
+
+def run_video_benchmarks(size: tuple, frames: int, width: int, workers: int, backend: str) -> list:
+    """
+    Times decoding, conversion, encoding and the whole video mode on the synthetic video
+
+    :param size: size of the frames
+    :param frames: number of frames
+    :param width: width of ASCII-art
+    :param workers: number of worker processes of the whole video mode
+    :param backend: conversion backend
+    :return: list of measurements
+    """
+    results = []
+    name = f"{size[0]}x{size[1]}"
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.avi")
+        make_synthetic_video(source, size, frames)
+        args = ascii.parse_arguments([source, "-m", "v", "-od", directory, "-w", str(width), "-b", backend,
+                                      "-j", str(workers), "-np"])
+
+        capture = cv2.VideoCapture(source)
+        start = time.perf_counter()
+        decoded = []
+        while True:
+            ret, frame = capture.read()
+            if ret is not True:
+                break
+            decoded.append(frame)
+        capture.release()
+        record(results, "video decode", name, time.perf_counter() - start, frames=len(decoded))
+
+        start = time.perf_counter()
+        converted = [video.convert_frame(frame, args) for frame in decoded]
+        record(results, "video conversion", name, time.perf_counter() - start, frames=len(converted))
+
+        output_size = (converted[0].shape[1], converted[0].shape[0])
+        writer = cv2.VideoWriter(os.path.join(directory, "encoded.avi"), cv2.VideoWriter_fourcc(*'MJPG'),
+                                 25.0, output_size)
+        start = time.perf_counter()
+        for frame in converted:
+            writer.write(frame)
+        writer.release()
+        record(results, "video encode", name, time.perf_counter() - start, frames=len(converted))
+
+        start = time.perf_counter()
+        video.render_ascii_video(cv2.VideoCapture(source), args)
+        record(results, f"video mode ({workers} workers)", name, time.perf_counter() - start, frames=len(decoded))
+    return results
+
+
+def run_transport_benchmarks(size: tuple, frames: int, width: int, workers: int) -> list:
+    """
+    Times the process pool of the video mode with frames pickled between processes
+    against frames passed through the ring in shared memory
+
+    :param size: size of the frames
+    :param frames: number of frames
+    :param width: width of ASCII-art
+    :param workers: number of worker processes
+    :return: list of measurements
+    """
+    results = []
+    name = f"{size[0]}x{size[1]}"
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.avi")
+        make_synthetic_video(source, size, frames)
+        args = ascii.parse_arguments([source, "-m", "v", "-w", str(width), "-j", str(workers), "-np"])
+        pipelines = {
+            f"pickled frames ({workers} workers)": lambda capture: video.convert_frames_in_pool(capture, args, workers),
+            f"shared memory ({workers} workers)":
+                lambda capture: video.convert_frames_in_shared_memory(capture, args, workers),
+        }
+        for stage_name, pipeline in pipelines.items():
+            capture = cv2.VideoCapture(source)
+            start = time.perf_counter()
+            converted = sum(1 for _ in pipeline(capture))
+            record(results, stage_name, name, time.perf_counter() - start, frames=converted)
+            capture.release()
+    return results
+
+
+def run_startup_benchmarks(repeat: int) -> list:
+    """
+    Times the start of the fresh interpreter with the CLI: imports alone
+    and the whole conversion of the small picture in the image modes
+
+    :param repeat: number of runs of every command, the best one is reported
+    :return: list of measurements
+    """
+    results = []
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as output_dir:
+        source = os.path.join(output_dir, "small.png")
+        make_synthetic_image(STARTUP_IMAGE_SIZE).save(source)
+        commands = {
+            "startup: import ascii": ["-c", "import ascii"],
+            "startup: import cv2": ["-c", "import cv2"],
+            "startup: bw picture": ["ascii.py", source, "-m", "bw", "-od", output_dir],
+            "startup: colour picture": ["ascii.py", source, "-m", "c", "-od", output_dir],
+        }
+        for name, command in commands.items():
+            seconds, _ = measure(lambda: subprocess.run([sys.executable] + command, cwd=directory, check=True,
+                                                        capture_output=True), repeat)
+            record(results, name, f"{STARTUP_IMAGE_SIZE[0]}x{STARTUP_IMAGE_SIZE[1]}", seconds)
+    return results
+
+
+def collect_metadata() -> dict:
+    """
+    :return: dictionary describing the environment and the commit
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def parse_arguments(args: list):
+    """
+    Parse list of arguments via argparse
+
+    :param args: list of arguments
+    :return: parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="benchmark of the picture, colour and video paths")
+    parser.add_argument("-o", "--output", type=str, help="path to the JSON file with results")
+    parser.add_argument("-s", "--sizes", nargs="+", default=list(IMAGE_SIZES), choices=list(IMAGE_SIZES),
+                        help="synthetic picture sizes")
+    parser.add_argument("-w", "--width", type=int, default=320, help="width of ASCII-art")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs of every stage, the best one is reported")
+    parser.add_argument("-f", "--frames", type=int, default=60, help="number of frames of the synthetic video")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes of the video mode")
+    parser.add_argument("-b", "--backend", type=str, default=Backends.NUMPY.value,
+                        choices=tuple(backend.value for backend in Backends), help="conversion backend")
+    parser.add_argument("--skip_video", action="store_true", help="do not run the video benchmarks")
+    parser.add_argument("--skip_startup", action="store_true", help="do not run the startup benchmarks")
+    return parser.parse_args(args)
+
+
+def main(args: argparse) -> dict:
+    """
+    Runs the benchmarks and writes results to JSON
+
+    :param args: parsed console arguments
+    :return: dictionary with metadata and results
+    """
+    sizes = {name: IMAGE_SIZES[name] for name in args.sizes}
+    report = {"metadata": collect_metadata(), "settings": vars(args), "results": []}
+    report["results"] += run_image_benchmarks(sizes, args.width, args.repeat, args.backend)
+    report["results"] += run_decode_benchmarks(sizes, args.width, args.repeat)
+    report["results"] += run_text_output_benchmarks(sizes, args.width, args.repeat)
+    report["results"] += run_palette_benchmarks(sizes, args.width, args.repeat)
+    if not args.skip_video:
+        report["results"] += run_video_benchmarks(VIDEO_SIZE, args.frames, args.width // 4, args.workers,
+                                                  args.backend)
+        report["results"] += run_transport_benchmarks(TRANSPORT_VIDEO_SIZE, args.frames, args.width,
+                                                      max(args.workers, 2))
+    if not args.skip_startup:
+        report["results"] += run_startup_benchmarks(args.repeat)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(parse_arguments(sys.argv[1:]))
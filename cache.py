@@ -0,0 +1,251 @@
+import argparse
+import collections
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from image import ASCII_CHARS, FONT
+
+# console arguments which change the output, they are a part of the cache key
+CACHE_KEY_ARGUMENTS = ("width", "mode", "strip_height", "charset", "selection", "dithering", "char_aspect",
+                       "color_format", "color_levels", "ansi_colors", "palette", "palette_colors", "png_compression")
+DEFAULT_MEMORY_LIMIT = 64 * 2 ** 20
+HASH_CHUNK_SIZE = 2 ** 20
+EVICTION_LOCK_NAME = "evict.lock"
+# seconds after which the lock of the process which has not released it is taken over
+EVICTION_LOCK_TIMEOUT = 10.0
+EVICTION_LOCK_POLL_INTERVAL = 0.01
+
+
+class ConversionCache:
+    """
+    Content-addressed cache of converted outputs.
+    Small in-memory LRU cache stands in front of the on-disk LRU cache,
+    both are limited by the total size of stored outputs. The directory
+    may be shared by several processes: entries are looked up on disk
+    and the directory is scanned again before entries are evicted
+    """
+
+    def __init__(self, directory: str = None, disk_limit: int = 0, memory_limit: int = DEFAULT_MEMORY_LIMIT):
+        self.directory = directory
+        self.disk_limit = disk_limit
+        self.memory_limit = memory_limit
+        self.memory = collections.OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def load_disk_index(self) -> list:
+        """
+        Restores the order of entries on disk from their modification times,
+        entries written or read by other processes are included
+
+        :return: list of tuples with the key and the size of every entry, least recently used first
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if len(entry.name) != 64:
+                continue
+            try:
+                status = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime_ns, entry.name, status.st_size))
+        return [(key, size) for _, key, size in sorted(entries)]
+
+    def get(self, key: str):
+        """
+        :param key: cache key, look make_cache_key
+        :return: stored output or None
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            if self.directory is None:
+                return None
+            path = os.path.join(self.directory, key)
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+                # modification time keeps the LRU order between runs and processes
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            self.store_in_memory(key, data)
+            return data
+
+    def put(self, key: str, data: bytes):
+        """
+        :param key: cache key, look make_cache_key
+        :param data: converted output
+        """
+        with self.lock:
+            self.store_in_memory(key, data)
+            if self.directory is None or len(data) > self.disk_limit:
+                return
+            # written under the temporary name, so that other processes never read a partial file
+            descriptor, temporary_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(descriptor, 'wb') as file:
+                    file.write(data)
+                os.replace(temporary_path, os.path.join(self.directory, key))
+            finally:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+            self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits into the disk limit.
+        Entries of all processes are counted, one process at a time evicts them
+        """
+        with eviction_lock(self.directory):
+            entries = self.load_disk_index()
+            disk_size = sum(size for _, size in entries)
+            for evicted, size in entries:
+                if disk_size <= self.disk_limit:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, evicted))
+                except FileNotFoundError:
+                    pass
+                disk_size -= size
+
+    def store_in_memory(self, key: str, data: bytes):
+        """
+        Must be called with the lock held
+
+        :param key: cache key, look make_cache_key
+        :param data: converted output
+        """
+        if len(data) > self.memory_limit:
+            return
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_limit:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+
+@contextlib.contextmanager
+def eviction_lock(directory: str):
+    """
+    Lock file which lets one process at a time evict entries of the cache directory.
+    The lock left by the crashed process is taken over after EVICTION_LOCK_TIMEOUT
+
+    :param directory: cache directory
+    """
+    path = os.path.join(directory, EVICTION_LOCK_NAME)
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(path).st_mtime > EVICTION_LOCK_TIMEOUT:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            time.sleep(EVICTION_LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        os.remove(path)
+
+
+@functools.lru_cache(maxsize=1024)
+def hash_file(path: str, modification_time: float = None, size: int = None) -> str:
+    """
+    Calculates SHA-256 of the file contents. Modification time and size
+    are a part of the memoization key, so that changed files are hashed again
+
+    :param path: path to the file
+    :param modification_time: modification time of the file
+    :param size: size of the file
+    :return: hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(path: str, args: argparse) -> str:
+    """
+    Builds the cache key from the contents of the input file, the font,
+    the character set and the console arguments which change the output
+
+    :param path: path to the input file
+    :param args: parsed console arguments
+    :return: hex digest which identifies the output
+    """
+    settings = {name: getattr(args, name, None) for name in CACHE_KEY_ARGUMENTS}
+    settings["chars"] = ASCII_CHARS
+    for name, file_path in (("input", path), ("font", FONT)):
+        status = os.stat(file_path)
+        settings[name] = hash_file(file_path, status.st_mtime, status.st_size)
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_cache(directory: str, disk_limit: int) -> ConversionCache:
+    """
+    Opens the cache once per process
+
+    :param directory: cache directory
+    :param disk_limit: limit of the cache size on disk in bytes
+    :return: ConversionCache object
+    """
+    return ConversionCache(directory, disk_limit)
+
+
+def restore_from_cache(path: str, output_filename: str, args: argparse) -> bool:
+    """
+    Writes cached output of the input file, skipping decoding, resizing and rendering
+
+    :param path: path to the input file
+    :param output_filename: path to the output file
+    :param args: parsed console arguments
+    :return: True if the output was found in the cache
+    """
+    try:
+        data = get_cache(args.cache_dir, args.cache_size * 2 ** 20).get(make_cache_key(path, args))
+    except FileNotFoundError:
+        return False
+    if data is None:
+        return False
+
+    try:
+        with open(output_filename, 'wb') as file:
+            file.write(data)
+    except FileNotFoundError:
+        logging.error("output file directory is incorrect")
+        return False
+    return True
+
+
+def save_to_cache(path: str, output_filename: str, args: argparse):
+    """
+    Stores the written output of the input file in the cache
+
+    :param path: path to the input file
+    :param output_filename: path to the output file
+    :param args: parsed console arguments
+    """
+    try:
+        with open(output_filename, 'rb') as file:
+            data = file.read()
+        get_cache(args.cache_dir, args.cache_size * 2 ** 20).put(make_cache_key(path, args), data)
+    except FileNotFoundError:
+        logging.warning("output file was not found, it was not cached")
@@ -0,0 +1,181 @@
+import html
+
+import numpy as np
+
+from modes import AnsiColors
+
+ANSI_TRUECOLOR = AnsiColors.TRUECOLOR.value
+ANSI_256 = AnsiColors.PALETTE_256.value
+RESET_COLOR = "\x1b[0m"
+ANSI_256_ESCAPES = tuple(f"\x1b[38;5;{index}m" for index in range(256))
+COLOR_FORMATS = ("png", "ansi", "html")
+# levels of every color channel, all of them are kept by default
+COLOR_LEVELS = 256
+
+HTML_HEADER = ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>ASCII-art</title>\n</head>\n'
+               '<body style="background-color:#000">\n<pre style="font-family:monospace;line-height:1">\n')
+HTML_FOOTER = "</pre>\n</body>\n</html>\n"
+# length of every character after escaping, runs are cut from the escaped line by these offsets
+HTML_ESCAPED_LENGTHS = np.array([len(html.escape(chr(code), quote=False)) for code in range(256)])
+
+
+def quantize_to_ansi256(pixels: np.ndarray) -> np.ndarray:
+    """
+    Matches every pixel with the nearest color of the 6x6x6 cube of the 256-color palette
+
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :return: array of palette indices with shape (height, width)
+    """
+    levels = (pixels.astype(np.uint16) * 5 + 127) // 255
+    return (16 + 36 * levels[..., 0] + 6 * levels[..., 1] + levels[..., 2]).astype(np.uint8)
+
+
+def pack_truecolor(pixels: np.ndarray) -> np.ndarray:
+    """
+    Packs RGB-pixels into integers, so that colors can be compared at once
+
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :return: array of 0xRRGGBB integers with shape (height, width)
+    """
+    pixels = pixels.astype(np.uint32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+def quantize_colors(pixels: np.ndarray, levels: int = COLOR_LEVELS) -> np.ndarray:
+    """
+    Rounds every channel to the nearest of the levels spread evenly from 0 to 255.
+    Fewer levels make longer runs of the same color
+
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param levels: number of levels of every channel, from 2 to 256
+    :return: array of RGB-pixels with the same shape
+    """
+    if not 2 <= levels <= 256:
+        raise ValueError("number of color levels must be from 2 to 256")
+    if levels == 256:
+        return pixels
+    steps = levels - 1
+    return (((pixels.astype(np.uint16) * steps + 127) // 255 * 255 + steps // 2) // steps).astype(np.uint8)
+
+
+def convert_to_ansi_colors(pixels: np.ndarray, ansi_colors: str = ANSI_TRUECOLOR) -> np.ndarray:
+    """
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param ansi_colors: truecolor or 256
+    :return: array of palette indices or 0xRRGGBB integers with shape (height, width)
+    """
+    if ansi_colors == ANSI_256:
+        return quantize_to_ansi256(pixels)
+    return pack_truecolor(pixels)
+
+
+def color_escape(color: int, ansi_colors: str = ANSI_TRUECOLOR) -> str:
+    """
+    :param color: palette index or 0xRRGGBB integer
+    :param ansi_colors: truecolor or 256
+    :return: escape sequence which sets the foreground color
+    """
+    if ansi_colors == ANSI_256:
+        return ANSI_256_ESCAPES[color]
+    return f"\x1b[38;2;{color >> 16};{(color >> 8) & 255};{color & 255}m"
+
+
+def iter_runs(char_codes: np.ndarray, colors: np.ndarray):
+    """
+    Splits every line into runs of characters of the same color
+
+    :param char_codes: array of character codes with shape (height, width)
+    :param colors: array of colors with shape (height, width), look convert_to_ansi_colors
+    :return: generator of tuples with the text of the line, the list of positions where runs start
+             followed by the length of the line and the list of colors of runs
+    """
+    changes = colors[:, 1:] != colors[:, :-1]
+    for row_codes, row_colors, row_changes in zip(char_codes, colors, changes):
+        starts = np.flatnonzero(row_changes) + 1
+        bounds = [0] + starts.tolist() + [len(row_colors)]
+        yield row_codes.tobytes().decode("ascii"), bounds, [int(row_colors[0])] + row_colors[starts].tolist()
+
+
+def iter_ansi_lines(char_codes: np.ndarray, pixels: np.ndarray, ansi_colors: str = ANSI_TRUECOLOR,
+                    levels: int = COLOR_LEVELS):
+    """
+    Builds colored ASCII-art line by line. Color is set once
+    for every run of characters of the same color
+
+    :param char_codes: array of character codes with shape (height, width)
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param ansi_colors: truecolor or 256
+    :param levels: number of levels of every color channel, look quantize_colors
+    :return: generator of lines with escape sequences
+    """
+    colors = convert_to_ansi_colors(quantize_colors(pixels, levels), ansi_colors)
+    for text, bounds, run_colors in iter_runs(char_codes, colors):
+        parts = [color_escape(color, ansi_colors) + text[start:end]
+                 for color, start, end in zip(run_colors, bounds, bounds[1:])]
+        parts.append(RESET_COLOR + '\n')
+        yield ''.join(parts)
+
+
+def iter_html_lines(char_codes: np.ndarray, pixels: np.ndarray, levels: int = COLOR_LEVELS):
+    """
+    Builds colored ASCII-art line by line, every run of characters
+    of the same color is one <span>
+
+    :param char_codes: array of character codes with shape (height, width)
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param levels: number of levels of every color channel, look quantize_colors
+    :return: generator of lines of the <pre> element
+    """
+    colors = pack_truecolor(quantize_colors(pixels, levels))
+    offsets = np.zeros(char_codes.shape[1] + 1, dtype=np.int64)
+    for row_codes, (text, bounds, run_colors) in zip(char_codes, iter_runs(char_codes, colors)):
+        np.cumsum(HTML_ESCAPED_LENGTHS[row_codes], out=offsets[1:])
+        text = html.escape(text, quote=False)
+        bounds = offsets[bounds].tolist()
+        parts = [f'<span style="color:#{color:06x}">{text[start:end]}</span>'
+                 for color, start, end in zip(run_colors, bounds, bounds[1:])]
+        parts.append('\n')
+        yield ''.join(parts)
+
+
+def format_ansi(char_codes: np.ndarray, pixels: np.ndarray, ansi_colors: str = ANSI_TRUECOLOR) -> str:
+    """
+    Builds colored ASCII-art text which can be printed to the terminal or saved to the file.
+    Color is set again only when it differs from the previous character of the line
+
+    :param char_codes: array of character codes with shape (height, width)
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param ansi_colors: truecolor or 256
+    :return: ANSI-art string
+    """
+    return ''.join(iter_ansi_lines(char_codes, pixels, ansi_colors))
+
+
+def write_ansi(file, char_codes: np.ndarray, pixels: np.ndarray, ansi_colors: str = ANSI_TRUECOLOR,
+               levels: int = COLOR_LEVELS):
+    """
+    Writes colored ASCII-art to the text file line by line, look iter_ansi_lines
+
+    :param file: text file opened for writing
+    :param char_codes: array of character codes with shape (height, width)
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param ansi_colors: truecolor or 256
+    :param levels: number of levels of every color channel
+    """
+    for line in iter_ansi_lines(char_codes, pixels, ansi_colors, levels):
+        file.write(line)
+
+
+def write_html(file, char_codes: np.ndarray, pixels: np.ndarray, levels: int = COLOR_LEVELS):
+    """
+    Writes colored ASCII-art to the HTML page line by line, look iter_html_lines
+
+    :param file: text file opened for writing
+    :param char_codes: array of character codes with shape (height, width)
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param levels: number of levels of every color channel
+    """
+    file.write(HTML_HEADER)
+    for line in iter_html_lines(char_codes, pixels, levels):
+        file.write(line)
+    file.write(HTML_FOOTER)
@@ -0,0 +1,92 @@
+import numpy as np
+
+FLOYD_STEINBERG = "floyd-steinberg"
+ORDERED = "ordered"
+DITHERING_METHODS = (FLOYD_STEINBERG, ORDERED)
+
+BAYER_MATRIX = np.array([[0, 8, 2, 10],
+                         [12, 4, 14, 6],
+                         [3, 11, 1, 9],
+                         [15, 7, 13, 5]])
+# thresholds between two neighbouring levels, from 0 to 1
+BAYER_THRESHOLDS = (BAYER_MATRIX + 0.5) / BAYER_MATRIX.size
+
+
+def quantize_to_levels(values: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    """
+    Matches every value with the nearest level
+
+    :param values: array of brightness values
+    :param levels: ascending array of brightness of the characters
+    :return: array of level indices of the same shape
+    """
+    midpoints = (levels[1:] + levels[:-1]) / 2
+    return np.searchsorted(midpoints, values).astype(np.uint8)
+
+
+def ordered_dither(brightness: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    """
+    Chooses between the two levels around every pixel by the threshold
+    of the tiled Bayer matrix, so that areas between levels become patterns
+
+    :param brightness: array of brightness values with shape (height, width)
+    :param levels: ascending array of brightness of the characters
+    :return: array of level indices with shape (height, width)
+    """
+    height, width = brightness.shape
+    lower = np.clip(np.searchsorted(levels, brightness, side="right") - 1, 0, len(levels) - 1)
+    upper = np.minimum(lower + 1, len(levels) - 1)
+    spacing = levels[upper] - levels[lower]
+    fraction = np.divide(brightness - levels[lower], spacing, out=np.zeros(brightness.shape), where=spacing > 0)
+    thresholds = np.tile(BAYER_THRESHOLDS, (height // 4 + 1, width // 4 + 1))[:height, :width]
+    return np.where(fraction > thresholds, upper, lower).astype(np.uint8)
+
+
+def floyd_steinberg_dither(brightness: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    """
+    Diffuses the quantization error of every pixel to its unprocessed neighbours.
+    A pixel depends on the pixels to the left and on the three pixels above,
+    so all pixels with the same column + 2 * row are independent
+    and every such anti-diagonal is processed at once
+
+    :param brightness: array of brightness values with shape (height, width)
+    :param levels: ascending array of brightness of the characters
+    :return: array of level indices with shape (height, width)
+    """
+    height, width = brightness.shape
+    # one column of padding on both sides and one row below take the error that leaves the frame
+    values = np.zeros((height + 1, width + 2), dtype=np.float32)
+    values[:height, 1:width + 1] = brightness
+    indices = np.empty((height, width), dtype=np.uint8)
+    levels = levels.astype(np.float32)
+    rows = np.arange(height)
+
+    for diagonal in range(width + 2 * (height - 1)):
+        columns = diagonal - 2 * rows
+        inside = (columns >= 0) & (columns < width)
+        y, x = rows[inside], columns[inside]
+        old = values[y, x + 1]
+        index = quantize_to_levels(old, levels)
+        indices[y, x] = index
+        error = old - levels[index]
+        # the pixel gets the error from the row above before the error from the left as in the scalar
+        # algorithm, so float32 sums are the same bit for bit
+        values[y + 1, x] += error * (3 / 16)
+        values[y, x + 2] += error * (7 / 16)
+        values[y + 1, x + 1] += error * (5 / 16)
+        values[y + 1, x + 2] += error * (1 / 16)
+    return indices
+
+
+def dither(brightness: np.ndarray, levels: np.ndarray, method: str) -> np.ndarray:
+    """
+    :param brightness: array of brightness values with shape (height, width)
+    :param levels: ascending array of brightness of the characters
+    :param method: floyd-steinberg or ordered
+    :return: array of level indices with shape (height, width)
+    """
+    if method == FLOYD_STEINBERG:
+        return floyd_steinberg_dither(brightness, levels)
+    if method == ORDERED:
+        return ordered_dither(brightness, levels)
+    raise ValueError(f"unknown dithering method {method}, choose one of: " + ", ".join(DITHERING_METHODS))
@@ -0,0 +1,69 @@
+import functools
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class FrameRing:
+    """
+    Preallocated slots for frames in shared memory. Every slot holds one decoded frame
+    and one rendered ASCII-art frame, so processes pass frames by slot index
+    instead of pickling them. The process which creates the ring owns the memory,
+    worker processes attach to it by names, look attach_frame_ring
+    """
+
+    def __init__(self, slots: int, frame_shape: tuple, output_shape: tuple, names: tuple = None):
+        """
+        :param slots: number of slots
+        :param frame_shape: shape of decoded BGR-frames
+        :param output_shape: shape of rendered ASCII-art frames
+        :param names: names of the shared memory blocks of frames and outputs to attach to,
+                      new blocks are created by default
+        """
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self.output_shape = tuple(output_shape)
+        self.owner = names is None
+        if self.owner:
+            self.frames_memory = shared_memory.SharedMemory(create=True, size=slots * int(np.prod(frame_shape)))
+            self.outputs_memory = shared_memory.SharedMemory(create=True, size=slots * int(np.prod(output_shape)))
+        else:
+            self.frames_memory = shared_memory.SharedMemory(names[0])
+            self.outputs_memory = shared_memory.SharedMemory(names[1])
+        self.frames = np.ndarray((slots,) + self.frame_shape, dtype=np.uint8, buffer=self.frames_memory.buf)
+        self.outputs = np.ndarray((slots,) + self.output_shape, dtype=np.uint8, buffer=self.outputs_memory.buf)
+
+    @property
+    def spec(self) -> tuple:
+        """
+        :return: arguments of attach_frame_ring, they are small enough to be sent with every task
+        """
+        return self.slots, self.frame_shape, self.output_shape, (self.frames_memory.name, self.outputs_memory.name)
+
+    def close(self):
+        """
+        Detaches from the shared memory, the owner also frees it
+        """
+        self.frames, self.outputs = None, None
+        for memory in (self.frames_memory, self.outputs_memory):
+            try:
+                memory.close()
+            except BufferError:
+                # frames are still referenced, the mapping is released together with them
+                pass
+            if self.owner:
+                memory.unlink()
+
+
+@functools.lru_cache(maxsize=None)
+def attach_frame_ring(slots: int, frame_shape: tuple, output_shape: tuple, names: tuple) -> FrameRing:
+    """
+    Attaches to the ring once per worker process
+
+    :param slots: number of slots
+    :param frame_shape: shape of decoded BGR-frames
+    :param output_shape: shape of rendered ASCII-art frames
+    :param names: names of the shared memory blocks, look FrameRing.spec
+    :return: FrameRing object
+    """
+    return FrameRing(slots, frame_shape, output_shape, names)
@@ -0,0 +1,273 @@
+import functools
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# number of character rows rendered at once, bounds the size of temporary arrays
+RENDER_BAND_HEIGHT = 64
+# structure index holds 2 ** STRUCTURE_INDEX_BITS patterns of sub-block brightness
+STRUCTURE_INDEX_BITS = 12
+
+
+class GlyphAtlas:
+    """
+    Alpha masks of rasterized characters split into character cells.
+
+    Glyphs of the font are usually larger than a cell, so every mask
+    covers a block of cells around the cell the character is drawn in:
+    masks[code, row, :, column, :] is the part of the glyph that falls
+    into the cell shifted by (first_row + row, first_column + column)
+    """
+
+    def __init__(self, masks: np.ndarray, first_row: int, first_column: int):
+        self.masks = masks
+        self.first_row = first_row
+        self.first_column = first_column
+        _, self.rows, self.cell_height, self.columns, self.cell_width = masks.shape
+        # contiguous per-cell masks, so that gathering them by character code is cheap
+        self.cell_masks = [[np.ascontiguousarray(masks[:, row, :, column, :]) for column in range(self.columns)]
+                           for row in range(self.rows)]
+        # pixels a glyph takes over when it is drawn with the palette index, look render_glyph_indices
+        self.cell_coverage = [[mask >= 128 for mask in row_masks] for row_masks in self.cell_masks]
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(font_path: str) -> ImageFont.FreeTypeFont:
+    """
+    Loads the font once per process
+
+    :param font_path: path to the .ttf file
+    :return: PIL font object
+    """
+    return ImageFont.truetype(font_path)
+
+
+@functools.lru_cache(maxsize=None)
+def build_glyph_atlas(chars: str, font_path: str, cell_width: int, cell_height: int) -> GlyphAtlas:
+    """
+    Rasterizes every character once into the atlas of alpha masks.
+    Masks are indexed by the character code, so the atlas
+    does not depend on the order of characters
+
+    :param chars: string of characters to rasterize
+    :param font_path: path to the .ttf file
+    :param cell_width: width of the character cell in pixels
+    :param cell_height: height of the character cell in pixels
+    :return: GlyphAtlas object
+    """
+    font = load_font(font_path)
+    boxes = [font.getbbox(char) for char in chars]
+    first_column = min(0, math.floor(min(box[0] for box in boxes) / cell_width))
+    first_row = min(0, math.floor(min(box[1] for box in boxes) / cell_height))
+    last_column = max(1, math.ceil(max(box[2] for box in boxes) / cell_width))
+    last_row = max(1, math.ceil(max(box[3] for box in boxes) / cell_height))
+    rows, columns = last_row - first_row, last_column - first_column
+
+    masks = np.zeros((256, rows * cell_height, columns * cell_width), dtype=np.uint8)
+    origin = (-first_column * cell_width, -first_row * cell_height)
+    for char in set(chars):
+        canvas = Image.new(mode="L", size=(columns * cell_width, rows * cell_height))
+        ImageDraw.Draw(canvas).text(origin, text=char, fill=255, font=font)
+        masks[ord(char)] = np.asarray(canvas)
+
+    masks = masks.reshape((256, rows, cell_height, columns, cell_width))
+    masks.flags.writeable = False
+    return GlyphAtlas(masks, first_row, first_column)
+
+
+@functools.lru_cache(maxsize=None)
+def measure_glyph_coverage(chars: str, font_path: str, cell_width: int, cell_height: int) -> np.ndarray:
+    """
+    Measures how much ink every character puts on the canvas
+
+    :param chars: string of characters
+    :param font_path: path to the .ttf file
+    :param cell_width: width of the character cell in pixels
+    :param cell_height: height of the character cell in pixels
+    :return: read-only array of fractions of the glyph block covered by every character
+    """
+    atlas = build_glyph_atlas(chars, font_path, cell_width, cell_height)
+    codes = np.frombuffer(chars.encode("ascii"), dtype=np.uint8)
+    coverage = atlas.masks[codes].sum(axis=(1, 2, 3, 4)) / (255 * atlas.masks[0].size)
+    coverage.flags.writeable = False
+    return coverage
+
+
+def measure_glyph_shapes(atlas: GlyphAtlas, chars: str) -> np.ndarray:
+    """
+    Measures the ink of every character in every cell of its glyph block,
+    so that glyphs can be compared with the brightness of sub-blocks of the picture
+
+    :param atlas: GlyphAtlas object
+    :param chars: string of characters
+    :return: array of ink fractions with shape (characters, rows * columns)
+    """
+    codes = np.frombuffer(chars.encode("ascii"), dtype=np.uint8)
+    cell_area = 255 * atlas.cell_height * atlas.cell_width
+    return atlas.masks[codes].sum(axis=(2, 4)).reshape((len(chars), -1)) / cell_area
+
+
+@functools.lru_cache(maxsize=None)
+def build_structure_index(chars: str, font_path: str, cell_width: int, cell_height: int,
+                          invert: bool = False) -> tuple[np.ndarray, int]:
+    """
+    Precomputes the best matching character for every pattern of quantized
+    sub-block brightness. Sub-blocks are the cells of the glyph block,
+    look GlyphAtlas, so a pattern describes the shape a character has to draw
+
+    :param chars: string of characters
+    :param font_path: path to the .ttf file
+    :param cell_width: width of the character cell in pixels
+    :param cell_height: height of the character cell in pixels
+    :param invert: dark sub-blocks need more ink, used on the black canvas of colour mode
+    :return: tuple with the read-only array of character indices for every pattern
+             and the number of brightness levels of a sub-block
+    """
+    atlas = build_glyph_atlas(chars, font_path, cell_width, cell_height)
+    shapes = measure_glyph_shapes(atlas, chars)
+    # the densest sub-block of all glyphs stands for the full brightness
+    shapes = shapes / max(shapes.max(), 1e-9)
+    blocks = shapes.shape[1]
+    levels = 2 ** max(1, STRUCTURE_INDEX_BITS // blocks)
+
+    # digit j of the pattern number is the level of sub-block j
+    patterns = np.arange(levels ** blocks)[:, np.newaxis] // levels ** np.arange(blocks) % levels
+    ink = patterns / (levels - 1)
+    if invert:
+        ink = 1 - ink
+    distances = (ink ** 2).sum(axis=1)[:, np.newaxis] - 2 * ink @ shapes.T + (shapes ** 2).sum(axis=1)
+    index = distances.argmin(axis=1).astype(np.uint8)
+    index.flags.writeable = False
+    return index, levels
+
+
+def render_glyphs(atlas: GlyphAtlas, char_codes: np.ndarray, colors: np.ndarray,
+                  start: int = 0, stop: int = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    Composites tinted glyph masks into the RGB image.
+    Glyphs are blended in the same order and with the same integer
+    arithmetic as ImageDraw.text, one whole-frame array operation
+    per neighbouring cell a glyph can reach
+
+    :param atlas: GlyphAtlas object
+    :param char_codes: array of character codes with shape (height, width)
+    :param colors: array of RGB-colors of characters with shape (height, width, 3)
+    :param start: first character row to render
+    :param stop: character row to stop rendering at, the last one by default
+    :param out: contiguous array of the result to render into, a new one by default
+    :return: array of RGB-pixels with shape ((stop - start) * cell_height, width * cell_width, 3)
+    """
+    height, width = char_codes.shape
+    if stop is None:
+        stop = height
+    shape = ((stop - start) * atlas.cell_height, width * atlas.cell_width, 3)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    elif out.shape != shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+        raise ValueError(f"output buffer must be a contiguous uint8 array with shape {shape}")
+    # view of the result split into character cells
+    output = out.reshape((stop - start, atlas.cell_height, width, atlas.cell_width, 3))
+
+    for band_start in range(start, stop, RENDER_BAND_HEIGHT):
+        band_end = min(band_start + RENDER_BAND_HEIGHT, stop)
+        band = np.zeros((band_end - band_start, width, atlas.cell_height, atlas.cell_width, 3), dtype=np.uint16)
+
+        # glyphs drawn earlier come from the rows above and the columns to the left
+        for row in reversed(range(atlas.rows)):
+            row_shift = atlas.first_row + row
+            source_rows = slice(max(band_start - row_shift, 0), min(band_end - row_shift, height))
+            if source_rows.start >= source_rows.stop:
+                continue
+            target_rows = slice(source_rows.start + row_shift - band_start, source_rows.stop + row_shift - band_start)
+
+            for column in reversed(range(atlas.columns)):
+                column_shift = atlas.first_column + column
+                source_columns = slice(max(-column_shift, 0), min(width - column_shift, width))
+                if source_columns.start >= source_columns.stop:
+                    continue
+                target_columns = slice(source_columns.start + column_shift, source_columns.stop + column_shift)
+
+                mask = atlas.cell_masks[row][column][char_codes[source_rows, source_columns]][..., np.newaxis]
+                ink = colors[source_rows, source_columns][:, :, np.newaxis, np.newaxis, :]
+                target = band[target_rows, target_columns]
+                # same rounding as BLEND and DIV255 in Pillow, the sum never exceeds 255 * 255 + 128
+                blended = target * (255 - mask) + ink * mask.astype(np.uint16) + 128
+                target[...] = ((blended >> 8) + blended) >> 8
+
+        output[band_start - start:band_end - start] = band.transpose((0, 2, 1, 3, 4))
+
+    return out
+
+
+def render_glyph_indices(atlas: GlyphAtlas, char_codes: np.ndarray, color_indices: np.ndarray) -> np.ndarray:
+    """
+    Draws glyphs with palette indices instead of blending colors.
+    Every pixel takes the index of the last glyph drawn over it, 0 where there is no glyph.
+    Glyphs of the bundled font have no partially covered pixels, so the result
+    is the same as render_glyphs with the colors of the palette. Antialiased edges
+    of other fonts belong to the glyph where it covers at least half of the pixel
+
+    :param atlas: GlyphAtlas object
+    :param char_codes: array of character codes with shape (height, width)
+    :param color_indices: array of palette indices of characters with shape (height, width)
+    :return: array of palette indices with shape (height * cell_height, width * cell_width)
+    """
+    height, width = char_codes.shape
+    cells = np.zeros((height, width, atlas.cell_height, atlas.cell_width), dtype=np.uint8)
+
+    # glyphs drawn earlier come from the rows above and the columns to the left
+    for row in reversed(range(atlas.rows)):
+        row_shift = atlas.first_row + row
+        source_rows = slice(max(-row_shift, 0), min(height - row_shift, height))
+        if source_rows.start >= source_rows.stop:
+            continue
+        target_rows = slice(source_rows.start + row_shift, source_rows.stop + row_shift)
+
+        for column in reversed(range(atlas.columns)):
+            column_shift = atlas.first_column + column
+            source_columns = slice(max(-column_shift, 0), min(width - column_shift, width))
+            if source_columns.start >= source_columns.stop:
+                continue
+            target_columns = slice(source_columns.start + column_shift, source_columns.stop + column_shift)
+
+            covered = atlas.cell_coverage[row][column][char_codes[source_rows, source_columns]]
+            indices = color_indices[source_rows, source_columns][:, :, np.newaxis, np.newaxis]
+            np.copyto(cells[target_rows, target_columns], indices, where=covered)
+
+    return cells.transpose((0, 2, 1, 3)).reshape((height * atlas.cell_height, width * atlas.cell_width))
+
+
+def render_glyph_cells(atlas: GlyphAtlas, char_codes: np.ndarray, colors: np.ndarray,
+                       rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    """
+    Composites tinted glyph masks into the selected character cells only.
+    Gives the same pixels as render_glyphs for these cells
+
+    :param atlas: GlyphAtlas object
+    :param char_codes: array of character codes with shape (height, width)
+    :param colors: array of RGB-colors of characters with shape (height, width, 3)
+    :param rows: array of character rows of the cells to render
+    :param columns: array of character columns of the cells to render
+    :return: array of RGB-pixels of the cells with shape (cells, cell_height, cell_width, 3)
+    """
+    height, width = char_codes.shape
+    cells = np.zeros((len(rows), atlas.cell_height, atlas.cell_width, 3), dtype=np.uint16)
+
+    # glyphs drawn earlier come from the rows above and the columns to the left
+    for row in reversed(range(atlas.rows)):
+        source_rows = rows - (atlas.first_row + row)
+        for column in reversed(range(atlas.columns)):
+            source_columns = columns - (atlas.first_column + column)
+            drawn = (source_rows >= 0) & (source_rows < height) & (source_columns >= 0) & (source_columns < width)
+            if not drawn.any():
+                continue
+
+            codes = char_codes[source_rows[drawn], source_columns[drawn]]
+            mask = atlas.cell_masks[row][column][codes][..., np.newaxis]
+            ink = colors[source_rows[drawn], source_columns[drawn]][:, np.newaxis, np.newaxis, :]
+            # same rounding as BLEND and DIV255 in Pillow, the sum never exceeds 255 * 255 + 128
+            blended = cells[drawn] * (255 - mask) + ink * mask.astype(np.uint16) + 128
+            cells[drawn] = ((blended >> 8) + blended) >> 8
+
+    return cells.astype(np.uint8)
@@ -1,12 +1,20 @@
 import argparse
+import copy
+import functools
 import logging
 import os
 import sys
 
+import numpy as np
 import PIL
 from PIL import Image, ImageFont, ImageDraw
 
-from modes import Modes
+from colortext import write_ansi, write_html
+from dither import DITHERING_METHODS, dither, quantize_to_levels
+from glyphs import build_glyph_atlas, build_structure_index, measure_glyph_coverage, render_glyphs
+from modes import Backends, Modes, Selections
+from palette import ScenePalette, render_indexed_image
+from stats import stage
 
 RED_COEFF = 0.2126
 GREEN_COEFF = 0.7152
@@ -14,6 +22,14 @@ BLUE_COEFF = 0.0722
 JPG_CHAR_SAFE_BOX_WIDTH = 4
 JPG_CHAR_SAFE_BOX_HEIGHT = 4
 FONT = "Anonymous_Pro.ttf"
+# height to width ratio of the character cell of terminal and editor fonts,
+# monochrome ASCII-art text is corrected for it unless another ratio is selected
+TEXT_CHAR_ASPECT = 2.0
+# colored text is written line by line through the buffer of this size
+WRITE_BUFFER_SIZE = 1 << 20
+# resize first shrinks the picture by an integer factor with box averaging while it stays
+# at least this many times larger than the result, look PIL.Image.resize
+REDUCING_GAP = 3.0
 ASCII_CHARS = r"`.-':_,^=;><+!rc*/z?sLTv)J7(|Fi{C}fI31tlu[neoZ5Yxjya]2ESwqkP6h9d4VpOGbUAKXHm8RD#$Bg0MNWQ%&@"
 
 
@@ -29,13 +45,31 @@ def construct_output_filename(args: argparse) -> str:
     output_file = args.output_dir
     if output_file is None:
         output_file = os.path.dirname(args.image)
-    if args.mode == Modes.BW.value:
-        output_file += os.sep + "ascii.txt"
-    elif args.mode == Modes.COLOR.value:
-        output_file += os.sep + "ascii.png"
+    if args.mode in (Modes.BW.value, Modes.COLOR.value):
+        output_file += os.sep + "ascii" + construct_output_extension(args)
     return output_file
 
 
+def construct_output_extension(args: argparse) -> str:
+    """
+    :param args: parsed console arguments
+    :return: extension of the output file of the picture modes: .txt for monochrome ASCII-art,
+             .png, .ansi or .html for colored ASCII-art depending on the selected format
+    """
+    if args.mode == Modes.COLOR.value:
+        return "." + args.color_format
+    return ".txt"
+
+
+def is_animated(image: Image) -> bool:
+    """
+    :param image: PIL Image object
+    :return: True if the picture has more than one frame,
+             MPO photos keep their second image as a frame, but they are not animated
+    """
+    return getattr(image, "n_frames", 1) > 1 and image.format != "MPO"
+
+
 def write_to_file(output_filename: str, ascii_art_image: str, args: argparse):
     """
     Writes ASCII-art string to file
@@ -59,7 +93,7 @@ def write_to_file(output_filename: str, ascii_art_image: str, args: argparse):
             sys.exit(4)
     elif args.mode == Modes.COLOR.value:
         try:
-            ascii_art_image.save(construct_output_filename(args))
+            ascii_art_image.save(output_filename, compress_level=args.png_compression)
             logging.info("image has converted to ASCII-art")
         except FileNotFoundError:
             logging.error("output file directory is incorrect")
@@ -69,6 +103,30 @@ def write_to_file(output_filename: str, ascii_art_image: str, args: argparse):
             sys.exit(4)
 
 
+def write_colored_text(output_filename: str, char_codes: np.ndarray, colors: np.ndarray, args: argparse):
+    """
+    Writes colored ASCII-art as ANSI-art or as the HTML page, look colortext
+
+    :param output_filename: path to the output file
+    :param char_codes: array of character codes with shape (height, width)
+    :param colors: array of RGB-colors of characters with shape (height, width, 3)
+    :param args: parsed console arguments
+    """
+    try:
+        with open(output_filename, 'w', encoding='utf8', buffering=WRITE_BUFFER_SIZE) as file:
+            if args.color_format == "html":
+                write_html(file, char_codes, colors, args.color_levels)
+            else:
+                write_ansi(file, char_codes, colors, args.ansi_colors, args.color_levels)
+        logging.info("image has converted to ASCII-art")
+    except FileNotFoundError:
+        logging.error("output file directory is incorrect")
+        sys.exit(3)
+    except Exception:
+        logging.error("unexpected error occurred while writing to file")
+        sys.exit(4)
+
+
 def resize_image(image: Image, new_width: int, is_video: bool = False) -> PIL.Image:
     """
     Resizes the image depending on selected width
@@ -78,34 +136,48 @@ def resize_image(image: Image, new_width: int, is_video: bool = False) -> PIL.Im
     :param new_width: positive integer with new width
     :return: resized PIL Image object
     """
+    return image.resize(compute_resized_size(image, new_width, is_video))
+
+
+def compute_resized_size(image: Image, new_width: int, is_video: bool = False,
+                         char_aspect: float = 1.0) -> tuple[int, int]:
+    """
+    Calculates the size of the resized image depending on selected width
+
+    :param is_video: bool variable that indicates whether the image is a frame from a video
+    :param image: PIL Image object
+    :param new_width: positive integer with new width
+    :param char_aspect: height to width ratio of the character cell, taller cells need fewer rows
+    :return: tuple with new width and height
+    """
     new_height = None
 
     if new_width is None:
         if not is_video:
             logging.info("custom width was not defined. " +
                          "ASCII-art will be the same size as the picture")
-        new_height = image.size[1]
+        new_height = int(image.size[1] / char_aspect)
         new_width = image.size[0]
     elif new_width == 0:
         if not is_video:
             logging.warning("user has entered zero width. " +
                             "ASCII-art will be the same size as the picture")
-        new_height = image.size[1]
+        new_height = int(image.size[1] / char_aspect)
         new_width = image.size[0]
     elif new_width < 0:
         if not is_video:
             logging.warning("user has entered width below zero. " +
                             "ASCII-art will be the same size as the picture")
-        new_height = image.size[1]
+        new_height = int(image.size[1] / char_aspect)
         new_width = image.size[0]
     elif new_width > 0:
         width, height = image.size
         ratio = height / width
-        new_height = int(new_width * ratio)
+        new_height = int(new_width * ratio / char_aspect)
     else:
         raise NotImplementedError("unexpected error occurred while resizing image")
 
-    return image.resize((new_width, new_height))
+    return new_width, new_height
 
 
 def get_pixel_brightness(pixel: tuple) -> int:
@@ -120,76 +192,530 @@ def get_pixel_brightness(pixel: tuple) -> int:
     return int((RED_COEFF * r) + (GREEN_COEFF * g) + (BLUE_COEFF * b))
 
 
-def map_pixel_to_ascii(pixel: tuple):
+def map_pixel_to_ascii(pixel: tuple, chars: str = None):
     """
     Matches pixel with ASCII-character depending on it's brightness
 
     :param pixel: RGB-tuple
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
     :return: ASCII-character which represents the pixel
     """
+    if chars is None:
+        chars = ASCII_CHARS
 
     grayscale_value = get_pixel_brightness(pixel)
-    num_chars = len(ASCII_CHARS)
+    num_chars = len(chars)
     interval_size = 256 / num_chars
-    return ASCII_CHARS[int(grayscale_value / interval_size)]
+    return chars[int(grayscale_value / interval_size)]
+
+
+@functools.lru_cache(maxsize=None)
+def build_lookup_table(chars: str) -> np.ndarray:
+    """
+    Precomputes the index of the ASCII-character for every
+    possible brightness value, so that the whole frame can be
+    mapped with a single array lookup
+
+    :param chars: string of ASCII-characters from darkest to brightest
+    :return: read-only array of 256 character indices
+    """
+    interval_size = 256 / len(chars)
+    table = np.array([int(brightness / interval_size) for brightness in range(256)], dtype=np.uint8)
+    table.flags.writeable = False
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def build_char_codes(chars: str) -> np.ndarray:
+    """
+    Converts string of ASCII-characters into the array of their codes,
+    so that character indices can be turned into characters with a single lookup
+
+    :param chars: string of ASCII-characters
+    :return: read-only array of character codes
+    """
+    char_codes = np.frombuffer(chars.encode("ascii"), dtype=np.uint8)
+    char_codes.flags.writeable = False
+    return char_codes
+
+
+def get_frame_brightness(pixels: np.ndarray) -> np.ndarray:
+    """
+    Calculates the brightness of every pixel of the frame at once.
+    Uses the same formula as get_pixel_brightness
+
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :return: array of brightness values with shape (height, width)
+    """
+    red, green, blue = (pixels[..., channel].astype(np.float64) for channel in range(3))
+    # formula of pixel brightness
+    return ((RED_COEFF * red) + (GREEN_COEFF * green) + (BLUE_COEFF * blue)).astype(np.uint8)
+
+
+def map_frame_to_ascii(pixels: np.ndarray, chars: str = None) -> np.ndarray:
+    """
+    Matches every pixel of the frame with ASCII-character
+    depending on it's brightness
+
+    :param pixels: array of RGB-pixels with shape (height, width, 3)
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
+    :return: array of character indices with shape (height, width)
+    """
+    if chars is None:
+        chars = ASCII_CHARS
+    return build_lookup_table(chars)[get_frame_brightness(pixels)]
+
+
+def assemble_ascii_string(char_indices: np.ndarray, chars: str = None) -> str:
+    """
+    Builds ASCII-art string from the array of character indices,
+    every row of the array becomes one line of the string
+
+    :param char_indices: array of character indices with shape (height, width)
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
+    :return: ASCII-art string
+    """
+    if chars is None:
+        chars = ASCII_CHARS
+    height = char_indices.shape[0]
+    rows = np.empty((height, char_indices.shape[1] + 1), dtype=np.uint8)
+    rows[:, :-1] = build_char_codes(chars)[char_indices]
+    rows[:, -1] = ord('\n')
+    return rows.tobytes().decode("ascii")
+
+
+@functools.lru_cache(maxsize=None)
+def build_density_levels(chars: str, font: str, invert: bool = False) -> tuple[str, np.ndarray]:
+    """
+    Orders characters by the ink they put on the canvas, measured from the font,
+    and spreads their coverage over the range of brightness
+
+    :param chars: string of ASCII-characters in any order
+    :param font: path to the .ttf file
+    :param invert: dense characters stand for dark pixels, used on the black canvas of colour mode
+    :return: tuple with the string of characters and the read-only ascending array of their brightness
+    """
+    coverage = measure_glyph_coverage(chars, font, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+    spread = coverage.max() - coverage.min()
+    levels = (coverage - coverage.min()) * (255 / spread) if spread > 0 else np.zeros(len(chars))
+    if invert:
+        levels = 255 - levels
+    order = np.argsort(levels, kind="stable")
+    levels = levels[order]
+    levels.flags.writeable = False
+    return ''.join(chars[index] for index in order), levels
+
+
+@functools.lru_cache(maxsize=None)
+def build_level_lookup_table(levels: bytes) -> np.ndarray:
+    """
+    Precomputes the index of the character with the nearest brightness for every
+    possible brightness value, look build_lookup_table
+
+    :param levels: ascending float64 array of brightness of characters as bytes
+    :return: read-only array of 256 character indices
+    """
+    table = quantize_to_levels(np.arange(256), np.frombuffer(levels))
+    table.flags.writeable = False
+    return table
+
+
+def convert_pixels_to_ascii(pixels: list, width: int, chars: str = None) -> str:
+    """
+    Reference backend: converts list of pixels into ASCII-art string
+    pixel by pixel with map_pixel_to_ascii
+
+    :param pixels: list of RGB-tuples representing an image
+    :param width: width of the image
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
+    :return: ASCII-art string
+    """
+    ascii_characters = [map_pixel_to_ascii(pixel, chars) for pixel in pixels]
+    ascii_characters = ''.join(ascii_characters)
+
+    ascii_art_image = list()
+    for i in range(0, len(ascii_characters), width):
+        line_end = i + width
+        ascii_art_image.append(ascii_characters[i:line_end])
+        ascii_art_image.append('\n')
 
+    return ''.join(ascii_art_image)
 
-def convert_image_to_ascii(image: Image, args: argparse, is_video: bool = False):
+
+class Converter:
+    """
+    Converts pictures into ASCII-art with the settings selected once.
+    Lookup tables and glyphs are built at construction and never change
+    afterwards, so one converter can be shared between threads.
+    Converter returns results and never touches the filesystem
+    """
+
+    def __init__(self, width: int = None, mode: str = Modes.BW.value, chars: str = ASCII_CHARS,
+                 font: str = FONT, backend: str = Backends.NUMPY.value, selection: str = Selections.LINEAR.value,
+                 dithering: str = None, char_aspect: float = 1.0):
+        """
+        :param width: width of ASCII-art, the width of the picture if None or not positive
+        :param mode: program mode, look Modes
+        :param chars: string of ASCII-characters from darkest to brightest,
+                      the order does not matter for density and structure selection
+        :param font: path to the .ttf file used for colored ASCII-art
+        :param backend: conversion backend, look Backends. The reference backend
+                        supports only linear selection without dithering
+        :param selection: how characters are selected, look Selections
+        :param dithering: dithering method, look dither.DITHERING_METHODS, no dithering by default.
+                          Structure selection is not dithered
+        :param char_aspect: height to width ratio of the character cell ASCII-art text is viewed with,
+                            about 2 for terminal and editor fonts. Colored ASCII-art is rendered
+                            in square cells, so it is used only in monochrome mode
+        """
+        if not chars or len(chars) > 256 or not chars.isascii():
+            raise ValueError("character set must contain from 1 to 256 ASCII-characters")
+        if selection not in tuple(selection.value for selection in Selections):
+            raise ValueError(f"unknown selection {selection}")
+        if dithering is not None and dithering not in DITHERING_METHODS:
+            raise ValueError(f"unknown dithering method {dithering}")
+        if char_aspect <= 0:
+            raise ValueError("character aspect ratio must be positive")
+        self.width = width
+        self.mode = mode
+        self.font = font
+        self.backend = backend
+        self.selection = selection
+        self.dithering = dithering
+        self.char_aspect = char_aspect if mode == Modes.BW.value else 1.0
+        # bright characters on the black background in colour mode
+        invert = mode == Modes.COLOR.value
+
+        if selection == Selections.LINEAR.value:
+            self.chars = chars[::-1] if invert else chars
+            self.lookup_table = build_lookup_table(self.chars)
+            # every character stands for the middle of its brightness interval
+            self.levels = (np.arange(len(self.chars)) + 0.5) * 256 / len(self.chars)
+        else:
+            self.chars, self.levels = build_density_levels(chars, font, invert)
+            self.lookup_table = build_level_lookup_table(self.levels.tobytes())
+        self.char_codes = build_char_codes(self.chars)
+
+        self.subcells = (1, 1)
+        self.structure_index = None
+        if selection == Selections.STRUCTURE.value:
+            self.structure_index, self.structure_levels = build_structure_index(
+                self.chars, font, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT, invert)
+            atlas = build_glyph_atlas(self.chars, font, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+            self.subcells = (atlas.rows, atlas.columns)
+            self.structure_weights = self.structure_levels ** np.arange(atlas.rows * atlas.columns)
+
+        self.atlas = None
+        if mode in (Modes.COLOR.value, Modes.VIDEO.value):
+            self.atlas = build_glyph_atlas(self.chars, font, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+
+    def scale_size(self, size: tuple) -> tuple[int, int]:
+        """
+        :param size: size of ASCII-art in characters
+        :return: size of the picture which is sampled for this size, look subcells
+        """
+        return size[0] * self.subcells[1], size[1] * self.subcells[0]
+
+    def resize(self, image: Image, is_video: bool = True) -> PIL.Image:
+        """
+        JPEG pictures which are not loaded yet are decoded at the reduced scale:
+        the decoder shrinks DCT blocks by 2, 4 or 8 while the picture stays
+        not smaller than the result. The rest is shrunk by box averaging
+        before the final resample, look REDUCING_GAP
+
+        :param image: PIL Image object
+        :param is_video: bool variable that indicates whether the image is a frame from a video,
+                         sizes of frames are not logged
+        :return: PIL Image object resized to the width of ASCII-art
+        """
+        size = self.scale_size(compute_resized_size(image, self.width, is_video, self.char_aspect))
+        box = None
+        if image.format == "JPEG" and size[0] > 0 and size[1] > 0:
+            # the box of the picture in the reduced coordinates keeps the aspect ratio exact
+            reduced = image.draft(image.mode, size)
+            if reduced is not None:
+                box = reduced[1]
+        return image.resize(size, box=box, reducing_gap=REDUCING_GAP)
+
+    def map_to_indices(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        :param pixels: array of RGB-pixels of the resized picture, look resize
+        :return: array of character indices with shape (rows, columns)
+        """
+        brightness = get_frame_brightness(pixels)
+        if self.structure_index is not None:
+            rows, columns = self.subcells
+            height, width = brightness.shape[0] // rows, brightness.shape[1] // columns
+            blocks = brightness[:height * rows, :width * columns].reshape((height, rows, width, columns))
+            levels = (blocks.transpose((0, 2, 1, 3)).astype(np.uint16) * self.structure_levels) >> 8
+            patterns = (levels.reshape((height, width, -1)) * self.structure_weights).sum(axis=2)
+            return self.structure_index[patterns]
+        if self.dithering is not None:
+            return dither(brightness, self.levels, self.dithering)
+        return self.lookup_table[brightness]
+
+    def map_pixels(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        :param pixels: array of RGB-pixels of the resized picture, look resize
+        :return: array of character codes with shape (rows, columns)
+        """
+        return self.char_codes[self.map_to_indices(pixels)]
+
+    def cell_colors(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        :param pixels: array of RGB-pixels of the resized picture, look resize
+        :return: array of average RGB-colors of character cells with shape (rows, columns, 3)
+        """
+        rows, columns = self.subcells
+        if rows == columns == 1:
+            return pixels
+        height, width = pixels.shape[0] // rows, pixels.shape[1] // columns
+        blocks = pixels[:height * rows, :width * columns].reshape((height, rows, width, columns, 3))
+        return ((blocks.sum(axis=(1, 3), dtype=np.uint32) + rows * columns // 2) // (rows * columns)).astype(np.uint8)
+
+    def convert_pixels(self, pixels: np.ndarray) -> str:
+        """
+        :param pixels: array of RGB-pixels of the resized picture, look resize
+        :return: ASCII-art string
+        """
+        if (self.backend == Backends.PYTHON.value and self.selection == Selections.LINEAR.value
+                and self.dithering is None):
+            pixel_list = list(map(tuple, pixels.reshape(-1, 3).tolist()))
+            return convert_pixels_to_ascii(pixel_list, pixels.shape[1], self.chars)
+        return assemble_ascii_string(self.map_to_indices(pixels), self.chars)
+
+    def draw(self, ascii_art_string: str, pixels: np.ndarray) -> np.ndarray:
+        """
+        Draws ASCII-art string colored by the pixels
+
+        :param ascii_art_string: ASCII-art string, look convert_pixels
+        :param pixels: array of RGB-pixels of the resized picture, look resize
+        :return: array of rendered RGB-pixels
+        """
+        colors = np.asarray(self.cell_colors(pixels), dtype=np.uint8)
+        height, width = colors.shape[:2]
+        if self.backend == Backends.PYTHON.value:
+            pixel_list = list(map(tuple, colors.reshape(-1, 3).tolist()))
+            return np.asarray(draw_colored_image_by_char(ascii_art_string, pixel_list, (width, height), self.font))
+        atlas = self.atlas
+        if atlas is None:
+            atlas = build_glyph_atlas(self.chars, self.font, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+        char_codes = np.frombuffer(ascii_art_string.replace('\n', '').encode("ascii"), dtype=np.uint8)
+        return render_glyphs(atlas, char_codes.reshape((height, width)), colors)
+
+    def draw_indexed(self, ascii_art_string: str, pixels: np.ndarray, palette: ScenePalette) -> PIL.Image:
+        """
+        Draws ASCII-art string colored by the nearest colors of the palette
+        straight into the palette image, look palette.render_indexed_image
+
+        :param ascii_art_string: ASCII-art string, look convert_pixels
+        :param pixels: array of RGB-pixels of the resized picture, look resize
+        :param palette: ScenePalette object
+        :return: PIL Image object in P mode
+        """
+        colors = np.asarray(self.cell_colors(pixels), dtype=np.uint8)
+        atlas = self.atlas
+        if atlas is None:
+            atlas = build_glyph_atlas(self.chars, self.font, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+        char_codes = np.frombuffer(ascii_art_string.replace('\n', '').encode("ascii"), dtype=np.uint8)
+        return render_indexed_image(atlas, char_codes.reshape(colors.shape[:2]), colors, palette)
+
+    def to_text(self, image: Image) -> str:
+        """
+        :param image: PIL Image object
+        :return: ASCII-art string
+        """
+        return self.convert_pixels(np.asarray(self.resize(image).convert(mode="RGB")))
+
+    def to_array(self, image: Image) -> np.ndarray:
+        """
+        :param image: PIL Image object
+        :return: array of RGB-pixels of colored ASCII-art
+        """
+        pixels = np.asarray(self.resize(image).convert(mode="RGB"))
+        return self.draw(self.convert_pixels(pixels), pixels)
+
+    def to_image(self, image: Image) -> PIL.Image:
+        """
+        :param image: PIL Image object
+        :return: PIL Image object with colored ASCII-art
+        """
+        return Image.fromarray(self.to_array(image), mode="RGB")
+
+
+@functools.lru_cache(maxsize=None)
+def get_converter(width: int = None, mode: str = Modes.BW.value, backend: str = Backends.NUMPY.value,
+                  chars: str = ASCII_CHARS, selection: str = Selections.LINEAR.value,
+                  dithering: str = None, char_aspect: float = 1.0) -> Converter:
+    """
+    Creates the converter once per process for the console arguments, look Converter
+
+    :param width: width of ASCII-art
+    :param mode: program mode
+    :param backend: conversion backend
+    :param chars: string of ASCII-characters
+    :param selection: how characters are selected
+    :param dithering: dithering method
+    :param char_aspect: height to width ratio of the character cell
+    :return: Converter object
+    """
+    return Converter(width, mode, chars, backend=backend, selection=selection, dithering=dithering,
+                     char_aspect=char_aspect)
+
+
+def get_converter_for_args(args: argparse) -> Converter:
+    """
+    :param args: parsed console arguments
+    :return: Converter object, look get_converter
+    """
+    return get_converter(args.width, args.mode, args.backend, args.charset or ASCII_CHARS, args.selection,
+                         args.dithering, args.char_aspect)
+
+
+def convert_image_to_ascii(image: Image, args: argparse, is_video: bool = False, output_filename: str = None):
     """
     Converts image into ASCII-art string which is written to the .txt file
 
     :param image: PIL Image object
     :param args: parsed console arguments
+    :param is_video: bool variable that indicates whether the image is a frame from a video
+    :param output_filename: path to the output file, look construct_output_filename by default
     :return: string declaring program status
     """
+    converter = get_converter_for_args(args)
     try:
-        image = resize_image(image, args.width, is_video)
+        with stage("resize"):
+            image = converter.resize(image, is_video)
     except NotImplementedError:
         logging.error("unexpected error occurred while resizing image")
         sys.exit(3)
+    return convert_resized_image(image, converter, args, is_video, output_filename)
 
-    if args.mode == Modes.COLOR.value:
-        global ASCII_CHARS
-        ASCII_CHARS = ASCII_CHARS[::-1]
 
-    pixels = list(image.convert(mode="RGB").getdata())
-    ascii_characters = [map_pixel_to_ascii(pixel) for pixel in pixels]
+def convert_resized_image(image: Image, converter: Converter, args: argparse, is_video: bool = False,
+                          output_filename: str = None):
+    """
+    Converts image which is already resized by the converter, look convert_image_to_ascii
 
-    width, height = image.size
-    ascii_characters = ''.join(ascii_characters)
+    :param image: PIL Image object, look Converter.resize
+    :param converter: Converter object for the console arguments
+    :param args: parsed console arguments
+    :param is_video: bool variable that indicates whether the image is a frame from a video
+    :param output_filename: path to the output file, look construct_output_filename by default
+    :return: string declaring program status
+    """
+    with stage("mapping"):
+        pixels = np.asarray(image.convert(mode="RGB"))
+        ascii_art_image_str = converter.convert_pixels(pixels)
 
-    ascii_art_image = list()
-    for i in range(0, len(ascii_characters), width):
-        line_end = i + width
-        ascii_art_image.append(ascii_characters[i:line_end])
-        ascii_art_image.append('\n')
+    if is_video:
+        with stage("rendering"):
+            return Image.fromarray(converter.draw(ascii_art_image_str, pixels), mode="RGB")
+
+    if output_filename is None:
+        output_filename = construct_output_filename(args)
+
+    if args.mode == Modes.COLOR.value and args.color_format != "png":
+        char_codes = np.frombuffer(ascii_art_image_str.replace('\n', '').encode("ascii"), dtype=np.uint8)
+        colors = converter.cell_colors(pixels)
+        with stage("writing"):
+            write_colored_text(output_filename, char_codes.reshape(colors.shape[:2]), colors, args)
+    elif args.mode == Modes.COLOR.value and args.palette is not None:
+        with stage("rendering"):
+            output_image = converter.draw_indexed(ascii_art_image_str, pixels,
+                                                  ScenePalette(args.palette, args.palette_colors))
+        with stage("writing"):
+            write_to_file(output_filename, output_image, args)
+    elif args.mode == Modes.COLOR.value:
+        with stage("rendering"):
+            output_image = Image.fromarray(converter.draw(ascii_art_image_str, pixels), mode="RGB")
+        with stage("writing"):
+            write_to_file(output_filename, output_image, args)
+    elif args.mode == Modes.BW.value:
+        with stage("writing"):
+            write_to_file(output_filename, ascii_art_image_str, args)
 
-    ascii_art_image_str = ''.join(ascii_art_image)
 
-    if is_video:
-        return draw_colored_image(ascii_art_image_str, pixels, image.size)
+def construct_width_filename(output_filename: str, width: int) -> str:
+    """
+    :param output_filename: path to the output file, look construct_output_filename
+    :param width: width of ASCII-art
+    :return: path to the output file with the width before the extension, e.g. ascii_80.txt
+    """
+    root, extension = os.path.splitext(output_filename)
+    return f"{root}_{width}{extension}"
 
-    if args.mode == Modes.COLOR.value:
-        output_image = draw_colored_image(ascii_art_image_str, pixels, image.size)
-        write_to_file(construct_output_filename(args), output_image, args)
-    elif args.mode == Modes.BW.value:
-        write_to_file(construct_output_filename(args), ascii_art_image_str)
+
+def convert_image_to_ascii_widths(image: Image, args: argparse):
+    """
+    Converts image into ASCII-art of every width from args.widths after one decode.
+    Levels are built from the widest one down and every level is resized
+    from the previous one instead of the full-size picture. Sizes of levels are computed
+    from the size of the picture, so they match the ASCII-art of every width converted alone
+
+    :param image: PIL Image object
+    :param args: parsed console arguments
+    """
+    if min(args.widths) <= 0:
+        logging.error("every width must be positive")
+        sys.exit(3)
+    output_filename = construct_output_filename(args)
+
+    levels = []
+    for width in sorted(set(args.widths), reverse=True):
+        level_args = copy.copy(args)
+        level_args.width = width
+        converter = get_converter_for_args(level_args)
+        # sizes are computed before the reduced decode of JPEG pictures changes the size
+        size = converter.scale_size(compute_resized_size(image, width, True, converter.char_aspect))
+        levels.append((level_args, converter, size))
+
+    level = None
+    for level_args, converter, size in levels:
+        with stage("resize"):
+            if level is None:
+                level = converter.resize(image).convert(mode="RGB")
+            else:
+                level = level.resize(size, reducing_gap=REDUCING_GAP)
+        convert_resized_image(level, converter, level_args,
+                              output_filename=construct_width_filename(output_filename, level_args.width))
+
+
+def draw_colored_image(ascii_art_string: str, pixels, size: tuple) -> PIL.Image:
+    """
+    Draws ASCII-art string into the PIL image by compositing
+    glyphs from the cached glyph atlas
+
+    :param ascii_art_string: string representation of
+                             image (look convert_image_to_ascii)
+    :param pixels: list of RGB-tuples or array of RGB-pixels representing an image
+    :param size: image size
+    :return: PIL Image object
+    """
+    width, height = size
+    atlas = build_glyph_atlas(ASCII_CHARS, FONT, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+    char_codes = np.frombuffer(ascii_art_string.replace('\n', '').encode("ascii"), dtype=np.uint8)
+    colors = np.asarray(pixels, dtype=np.uint8).reshape((height, width, 3))
+    output = render_glyphs(atlas, char_codes.reshape((height, width)), colors)
+    return Image.fromarray(output, mode="RGB")
 
 
-def draw_colored_image(ascii_art_string: str, pixels: list, size: tuple) -> PIL.Image:
+def draw_colored_image_by_char(ascii_art_string: str, pixels: list, size: tuple, font: str = FONT) -> PIL.Image:
     """
-        Draws ASCII-art strinng into the PIL image and saves it
+        Reference backend: draws ASCII-art string into the PIL image
+        character by character with ImageDraw.text
 
         :param ascii_art_string: string representation of
                                  image (look convert_image_to_ascii)
         :param pixels: list of RGB-tuples representing an image
         :param size: image size
-        :param output_file: output filename
+        :param font: path to the .ttf file
+        :return: PIL Image object
         """
     width, height = size[0] * JPG_CHAR_SAFE_BOX_WIDTH, size[1] * JPG_CHAR_SAFE_BOX_HEIGHT
 
     output_image = Image.new(mode="RGB", size=(width, height), color="black")
-    font = ImageFont.truetype(FONT)
+    font = ImageFont.truetype(font)
     draw = ImageDraw.Draw(output_image)
 
     x, y = 0, 0
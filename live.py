@@ -0,0 +1,219 @@
+import argparse
+import copy
+import logging
+import threading
+import time
+
+import cv2
+
+from modes import Modes
+from stats import STATS, Stats
+from terminal import DEFAULT_FPS, open_source
+from video import compute_frame_size, convert_frame, show_frame
+
+# the width is multiplied by this factor when frames exceed the budget and divided when they fit it easily
+WIDTH_STEP = 0.8
+MIN_LIVE_WIDTH = 16
+# frames in a row over the budget before the width is lowered
+SHRINK_AFTER_FRAMES = 3
+# frames in a row well under the budget before the width is raised, it grows slower than it shrinks
+GROW_AFTER_FRAMES = 30
+# part of the budget a frame has to fit in to count as well under the budget
+GROW_BELOW_BUDGET = 0.6
+
+
+class LatestFrameReader:
+    """
+    Reads the capture in the background thread and keeps only the most recent frame.
+    A frame which was not taken before the next one arrived is stale and dropped,
+    so the capture buffer never fills up and the newest frame is always converted.
+    Video files are read at the given pace, the way a live source produces frames
+    """
+
+    def __init__(self, video: cv2.VideoCapture, pace: float = None):
+        """
+        :param video: opened cv2.VideoCapture object
+        :param pace: frame rate to read the video at, as fast as possible by default
+        """
+        self.video = video
+        self.pace = pace
+        self.condition = threading.Condition()
+        self.frame = None
+        self.captured = None
+        self.finished = False
+        self.stopped = threading.Event()
+        self.error = None
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        start = time.perf_counter()
+        frame_index = 0
+        try:
+            while not self.stopped.is_set():
+                if self.pace:
+                    delay = start + frame_index / self.pace - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                ret, frame = self.video.read()
+                frame_index += 1
+                with self.condition:
+                    if ret is not True:
+                        return
+                    if self.frame is not None:
+                        self.dropped += 1
+                    self.frame, self.captured = frame, time.perf_counter()
+                    self.condition.notify()
+        except Exception as error:
+            # the error is raised again by the consumer, look run_live
+            self.error = error
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify()
+            # the capture is released by the thread which reads it, never in the middle of video.read()
+            self.video.release()
+
+    def read(self) -> tuple:
+        """
+        Waits for a frame newer than the last taken one
+
+        :return: tuple with array of BGR-pixels of the frame and the time it was captured,
+                 (None, None) after the end of the source or the error of the capture, look error
+        """
+        with self.condition:
+            while self.frame is None and not self.finished:
+                self.condition.wait()
+            frame, captured = self.frame, self.captured
+            self.frame = None
+            return frame, captured
+
+    def stop(self):
+        """
+        Stops reading, the capture is released by the reader thread after its last read.
+        The reader blocked by the stalled source is not waited for longer than a second
+        """
+        self.stopped.set()
+        self.thread.join(timeout=1)
+
+
+class AdaptiveWidth:
+    """
+    Lowers the width of ASCII-art while frames take longer than the budget
+    and raises it back up to the selected width when they fit in the budget again
+    """
+
+    def __init__(self, width: int, budget: float, min_width: int = MIN_LIVE_WIDTH):
+        """
+        :param width: selected width of ASCII-art, the width is never raised above it
+        :param budget: time for one frame in seconds
+        :param min_width: the width is never lowered below it
+        """
+        self.max_width = width
+        self.width = width
+        self.budget = budget
+        self.min_width = min(min_width, width)
+        self.over_budget = 0
+        self.under_budget = 0
+
+    def update(self, seconds: float) -> int:
+        """
+        :param seconds: time the last frame took
+        :return: width for the next frame
+        """
+        if seconds > self.budget:
+            self.over_budget, self.under_budget = self.over_budget + 1, 0
+        elif seconds < self.budget * GROW_BELOW_BUDGET:
+            self.over_budget, self.under_budget = 0, self.under_budget + 1
+        else:
+            self.over_budget, self.under_budget = 0, 0
+
+        if self.over_budget >= SHRINK_AFTER_FRAMES and self.width > self.min_width:
+            self.width = max(self.min_width, int(self.width * WIDTH_STEP))
+            self.over_budget = 0
+        elif self.under_budget >= GROW_AFTER_FRAMES and self.width < self.max_width:
+            self.width = min(self.max_width, max(self.width + 1, int(self.width / WIDTH_STEP)))
+            self.under_budget = 0
+        return self.width
+
+
+def run_live(video: cv2.VideoCapture, args: argparse, pace: float = None, show=show_frame) -> dict:
+    """
+    Converts the most recent frame of the source within the frame budget
+    of the target frame rate, look LatestFrameReader and AdaptiveWidth
+
+    :param video: opened cv2.VideoCapture object, it is released by LatestFrameReader
+    :param args: parsed console arguments, fps is the target frame rate
+    :param pace: frame rate to read the video file at, None for live sources
+    :param show: function which shows the rendered frame and returns True to stop, look video.show_frame
+    :return: dictionary with the number of shown and dropped frames, achieved frame rate,
+             latency percentiles from capture to display in seconds and the final width
+    """
+    budget = 1 / (args.fps or video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS)
+    # frames are converted with the settings of video mode, only the width changes
+    frame_args = copy.copy(args)
+    frame_args.mode = Modes.VIDEO.value
+    latency = Stats()
+    adaptive_width = None
+    shown = 0
+
+    reader = LatestFrameReader(video, pace)
+    start = time.perf_counter()
+    try:
+        while True:
+            frame, captured = reader.read()
+            if frame is None:
+                if reader.error is not None:
+                    raise reader.error
+                break
+            began = time.perf_counter()
+            if adaptive_width is None:
+                adaptive_width = AdaptiveWidth(compute_frame_size(frame.shape[1], frame.shape[0], args.width)[0],
+                                               budget)
+            frame_args.width = adaptive_width.width
+            stop = show(convert_frame(frame, frame_args))
+            finished = time.perf_counter()
+            latency.record("latency", finished - captured)
+            STATS.record("latency", finished - captured)
+            shown += 1
+            if stop:
+                break
+            adaptive_width.update(finished - began)
+            # faster frames wait for the target frame rate
+            delay = began + budget - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    finally:
+        elapsed = time.perf_counter() - start
+        reader.stop()
+
+    summary = latency.summary().get("latency", {})
+    return {"shown": shown, "dropped": reader.dropped, "fps": shown / elapsed if elapsed else 0.0,
+            "p50": summary.get("p50", 0.0), "p90": summary.get("p90", 0.0),
+            "width": adaptive_width.width if adaptive_width is not None else args.width}
+
+
+def play_live(args: argparse) -> bool:
+    """
+    Shows capture device or video file as ASCII-art in real time in the preview window.
+    Digits are treated as the device index, files are played at their nominal frame rate
+
+    :param args: parsed console arguments
+    :return: True if the source was played
+    """
+    video = open_source(args.image)
+    if not video.isOpened():
+        logging.error("file was not opened: it may not exist or " +
+                      "be corrupted")
+        return False
+
+    pace = None if args.image.isdigit() else video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    try:
+        result = run_live(video, args, pace)
+    finally:
+        cv2.destroyAllWindows()
+    logging.info(f"{result['shown']} frames shown at {result['fps']:.1f} fps, "
+                 f"{result['dropped']} stale frames dropped, latency p50 {result['p50'] * 1000:.1f} ms, "
+                 f"p90 {result['p90'] * 1000:.1f} ms, final width {result['width']}")
+    return True
@@ -8,3 +8,30 @@ class Modes(enum.Enum):
     BW = "bw"
     COLOR = "c"
     VIDEO = "v"
+    TERMINAL = "t"
+    LIVE = "l"
+
+
+class Backends(enum.Enum):
+    """
+    Enum class for conversion backends
+    """
+    NUMPY = "numpy"
+    PYTHON = "python"
+
+
+class AnsiColors(enum.Enum):
+    """
+    Enum class for colors of the terminal output
+    """
+    TRUECOLOR = "truecolor"
+    PALETTE_256 = "256"
+
+
+class Selections(enum.Enum):
+    """
+    Enum class for the ways characters are selected for pixels
+    """
+    LINEAR = "linear"
+    DENSITY = "density"
+    STRUCTURE = "structure"
@@ -0,0 +1,120 @@
+import numpy as np
+from PIL import Image
+
+from glyphs import GlyphAtlas, render_glyph_indices
+
+ADAPTIVE = "adaptive"
+FIXED = "fixed"
+PALETTES = (ADAPTIVE, FIXED)
+# index 0 is the black background, the rest of the 256 entries are colors of characters
+MAX_PALETTE_COLORS = 255
+# levels of every channel of the fixed palette, the 6x6x6 cube of the 256-color terminal palette
+FIXED_PALETTE_LEVELS = 6
+# the adaptive palette is built again when the average error of cell colors grows by this much,
+# which happens on the cut to another scene
+SCENE_CHANGE_ERROR = 12.0
+
+
+def build_fixed_palette() -> np.ndarray:
+    """
+    :return: array of RGB-colors of the fixed palette with shape (216, 3)
+    """
+    steps = np.arange(FIXED_PALETTE_LEVELS) * (255 // (FIXED_PALETTE_LEVELS - 1))
+    red, green, blue = np.meshgrid(steps, steps, steps, indexing="ij")
+    return np.stack((red.ravel(), green.ravel(), blue.ravel()), axis=1).astype(np.uint8)
+
+
+class ScenePalette:
+    """
+    Palette of character colors which is built once and reused for every picture
+    it is matched with. The adaptive palette is built from the colors of the first picture
+    and, when the scene change error is given, again for the first picture of every new scene.
+    The fixed palette never changes, matching with it needs no search
+    """
+
+    def __init__(self, kind: str = ADAPTIVE, colors: int = MAX_PALETTE_COLORS, scene_change: float = None):
+        """
+        :param kind: adaptive or fixed
+        :param colors: number of colors of the adaptive palette, from 1 to 255
+        :param scene_change: growth of the average error which starts a new scene,
+                             the adaptive palette is built only once by default
+        """
+        if kind not in PALETTES:
+            raise ValueError(f"unknown palette {kind}")
+        if not 1 <= colors <= MAX_PALETTE_COLORS:
+            raise ValueError(f"number of palette colors must be from 1 to {MAX_PALETTE_COLORS}")
+        self.kind = kind
+        self.colors = colors
+        self.scene_change = scene_change
+        self.image = None
+        self.error = None
+        self.scenes = 0
+        self.palette = build_fixed_palette() if kind == FIXED else None
+
+    def build(self, colors: np.ndarray) -> np.ndarray:
+        """
+        Builds the adaptive palette from the colors with median cut
+
+        :param colors: array of RGB-colors with shape (height, width, 3)
+        :return: array of palette indices with shape (height, width)
+        """
+        self.image = Image.fromarray(np.ascontiguousarray(colors), mode="RGB").quantize(self.colors)
+        self.palette = np.array(self.image.getpalette()[:3 * self.colors], dtype=np.uint8).reshape((-1, 3))
+        self.scenes += 1
+        return np.asarray(self.image)
+
+    def match(self, colors: np.ndarray) -> np.ndarray:
+        """
+        :param colors: array of RGB-colors of character cells with shape (height, width, 3)
+        :return: array of indices of the nearest colors in the output palette with shape (height, width),
+                 look rgb
+        """
+        if self.kind == FIXED:
+            levels = (colors.astype(np.uint16) * (FIXED_PALETTE_LEVELS - 1) + 127) // 255
+            indices = (levels[..., 0] * FIXED_PALETTE_LEVELS + levels[..., 1]) * FIXED_PALETTE_LEVELS + levels[..., 2]
+            return (indices + 1).astype(np.uint8)
+
+        if self.image is None:
+            indices = self.build(colors)
+            self.error = self.measure_error(colors, indices)
+        else:
+            indices = np.asarray(Image.fromarray(np.ascontiguousarray(colors), mode="RGB").quantize(
+                palette=self.image, dither=Image.Dither.NONE))
+            if self.scene_change is not None:
+                error = self.measure_error(colors, indices)
+                if error > self.error + self.scene_change:
+                    indices = self.build(colors)
+                    self.error = self.measure_error(colors, indices)
+        return (indices + 1).astype(np.uint8)
+
+    def measure_error(self, colors: np.ndarray, indices: np.ndarray) -> float:
+        """
+        :param colors: array of RGB-colors with shape (height, width, 3)
+        :param indices: array of indices of the palette built by build
+        :return: average difference of channels of the colors and the matched palette colors
+        """
+        return float(np.abs(colors.astype(np.int16) - self.palette[indices]).mean())
+
+    @property
+    def rgb(self) -> bytes:
+        """
+        :return: RGB-colors of the output palette: black followed by the colors of the palette
+        """
+        return bytes(3) + self.palette.tobytes()
+
+
+def render_indexed_image(atlas: GlyphAtlas, char_codes: np.ndarray, colors: np.ndarray,
+                         palette: ScenePalette) -> Image:
+    """
+    Renders colored ASCII-art straight into the palette image,
+    one byte per pixel instead of three, look glyphs.render_glyph_indices
+
+    :param atlas: GlyphAtlas object
+    :param char_codes: array of character codes with shape (height, width)
+    :param colors: array of RGB-colors of characters with shape (height, width, 3)
+    :param palette: ScenePalette object, it may be shared by frames of the animation
+    :return: PIL Image object in P mode
+    """
+    output = Image.fromarray(render_glyph_indices(atlas, char_codes, palette.match(colors)), mode="P")
+    output.putpalette(palette.rgb)
+    return output
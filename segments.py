@@ -0,0 +1,354 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+
+import cv2
+
+from avi import find_frame_chunks, write_avi
+from cache import CACHE_KEY_ARGUMENTS
+from stats import stage
+from video import construct_output_filename, convert_frames, show_frame
+
+MANIFEST_NAME = "manifest.json"
+CONCATENATION_LOCK_NAME = "concatenate.lock"
+# console arguments which change the frames of segments besides the cache key arguments
+SEGMENT_ARGUMENTS = CACHE_KEY_ARGUMENTS + ("backend", "delta_threshold")
+
+
+class LimitedCapture:
+    """
+    Reads at most the given number of frames of the video
+    and remembers whether the video itself has ended
+    """
+
+    def __init__(self, video: cv2.VideoCapture, frames: int = None):
+        """
+        :param video: opened cv2.VideoCapture object
+        :param frames: number of frames to read, all of them by default
+        """
+        self.video = video
+        self.remaining = frames
+        self.exhausted = False
+
+    def read(self) -> tuple:
+        if self.remaining is not None and self.remaining <= 0:
+            return False, None
+        ret, frame = self.video.read()
+        if ret is not True:
+            self.exhausted = True
+            return False, None
+        if self.remaining is not None:
+            self.remaining -= 1
+        return ret, frame
+
+    def get(self, prop: int) -> float:
+        return self.video.get(prop)
+
+    def isOpened(self) -> bool:
+        return self.video.isOpened()
+
+    def release(self):
+        self.video.release()
+
+
+def construct_segment_dir(output_filename: str) -> str:
+    """
+    :param output_filename: path to the output .avi file
+    :return: path to the directory of segments and checkpoints next to the output file
+    """
+    return output_filename + ".segments"
+
+
+def segment_filename(directory: str, index: int) -> str:
+    return os.path.join(directory, f"segment_{index:05d}.avi")
+
+
+def checkpoint_filename(directory: str, index: int) -> str:
+    return os.path.join(directory, f"segment_{index:05d}.json")
+
+
+def write_json_atomically(path: str, data: dict):
+    """
+    Writes JSON to the temporary file which replaces the old one,
+    so an interrupted conversion never leaves a half-written file
+
+    :param path: path to the file
+    :param data: dictionary to write
+    """
+    temporary = path + ".tmp"
+    with open(temporary, 'w', encoding='utf8') as file:
+        json.dump(data, file, indent=2)
+    os.replace(temporary, path)
+
+
+def make_manifest(args: argparse, fps: float, size: tuple, segment_frames: int) -> dict:
+    """
+    :param args: parsed console arguments
+    :param fps: frame rate of the video
+    :param size: size of ASCII-art frames
+    :param segment_frames: number of frames in one segment
+    :return: dictionary which describes the conversion, segments are resumed only by the same conversion
+    """
+    source = os.stat(args.image)
+    return {
+        "source": os.path.abspath(args.image),
+        "source_size": source.st_size,
+        "source_modification_time": source.st_mtime,
+        "settings": {name: getattr(args, name, None) for name in SEGMENT_ARGUMENTS},
+        "fps": fps,
+        "size": list(size),
+        "segment_frames": segment_frames,
+    }
+
+
+def load_checkpoints(directory: str) -> dict:
+    """
+    :param directory: directory of segments
+    :return: dictionary of completed segments and their checkpoints
+    """
+    checkpoints = {}
+    for name in os.listdir(directory):
+        if name.startswith("segment_") and name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding='utf8') as file:
+                checkpoint = json.load(file)
+            checkpoints[checkpoint["segment"]] = checkpoint
+    return checkpoints
+
+
+def find_missing_segments(checkpoints: dict, first: int = 0, last: int = None) -> tuple:
+    """
+    :param checkpoints: dictionary of completed segments, look load_checkpoints
+    :param first: first segment of the range
+    :param last: last segment of the range, up to the end of the video by default
+    :return: tuple with the first missing segment and the completed segment after it or None,
+             None if there are no missing segments in the range
+    """
+    index = first
+    while index in checkpoints:
+        if checkpoints[index]["last"]:
+            return None
+        index += 1
+    if last is not None and index > last:
+        return None
+    following = [segment for segment in checkpoints if segment > index]
+    stop = min(following) if following else None
+    if last is not None and (stop is None or stop > last + 1):
+        stop = last + 1
+    return index, stop
+
+
+def seek_frame(video: cv2.VideoCapture, frame_index: int):
+    """
+    Moves the video to the frame, frames are grabbed one by one
+    when the video can not be sought
+
+    :param video: opened cv2.VideoCapture object
+    :param frame_index: index of the frame
+    """
+    if frame_index <= 0 or video.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+        return
+    for _ in range(frame_index):
+        if not video.grab():
+            break
+
+
+def finish_segment(directory: str, index: int, segment_frames: int, frames: int, fps: float, last: bool):
+    """
+    Moves the written segment into place and records its checkpoint
+
+    :param directory: directory of segments
+    :param index: index of the segment
+    :param segment_frames: number of frames in one segment
+    :param frames: number of frames written to the segment
+    :param fps: frame rate of the video
+    :param last: the video ends in this segment
+    """
+    if frames:
+        os.replace(segment_filename(directory, index)[:-len(".avi")] + ".part.avi", segment_filename(directory, index))
+    first_frame = index * segment_frames
+    write_json_atomically(checkpoint_filename(directory, index), {
+        "segment": index,
+        "first_frame": first_frame,
+        "frames": frames,
+        "last_frame": first_frame + frames - 1,
+        "position_ms": (first_frame + frames) / fps * 1000,
+        "last": last,
+    })
+
+
+def write_segments(video: cv2.VideoCapture, args: argparse, directory: str, first: int, stop: int,
+                   segment_frames: int, fps: float, size: tuple) -> bool:
+    """
+    Converts the segments from first up to stop and writes every one of them to its own file.
+    The segment is recorded only when it is complete, the unfinished one is converted again on restart
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :param directory: directory of segments
+    :param first: index of the first segment
+    :param stop: index of the segment to stop at, the end of the video by default
+    :param segment_frames: number of frames in one segment
+    :param fps: frame rate of the video
+    :param size: size of ASCII-art frames
+    :return: False if user has stopped the conversion
+    """
+    with stage("seek"):
+        seek_frame(video, first * segment_frames)
+    capture = LimitedCapture(video, None if stop is None else (stop - first) * segment_frames)
+    ascii_frames = convert_frames(capture, args)
+    index, written, output = first, 0, None
+    try:
+        for ascii_frame in ascii_frames:
+            if output is None:
+                output = cv2.VideoWriter(segment_filename(directory, index)[:-len(".avi")] + ".part.avi",
+                                         cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+            with stage("frame encode"):
+                output.write(ascii_frame)
+            written += 1
+            if written == segment_frames:
+                output.release()
+                output = None
+                finish_segment(directory, index, segment_frames, written, fps, last=False)
+                logging.info(f"segment {index} has converted to ASCII-art")
+                index, written = index + 1, 0
+            if not args.no_preview:
+                with stage("preview"):
+                    if show_frame(ascii_frame):
+                        return False
+    finally:
+        ascii_frames.close()
+        if output is not None:
+            output.release()
+        if not args.no_preview:
+            cv2.destroyAllWindows()
+
+    if capture.exhausted:
+        # the empty segment marks the end only when the video ends right after the previous segment,
+        # the range which starts after the end of the video reads no frames and records nothing
+        if written or index == 0 or os.path.exists(checkpoint_filename(directory, index - 1)):
+            finish_segment(directory, index, segment_frames, written, fps, last=True)
+            logging.info(f"segment {index} has converted to ASCII-art, it is the last one")
+        else:
+            logging.info(f"segment {index} has no frames, the video ends before it")
+    return True
+
+
+def reencode_segments(paths: list, output_filename: str, fps: float, size: tuple):
+    """
+    Joins segments by decoding and encoding their frames again,
+    look concatenate_segments
+
+    :param paths: paths to the segments
+    :param output_filename: path to the output .avi file
+    :param fps: frame rate of the video
+    :param size: size of ASCII-art frames
+    """
+    output = cv2.VideoWriter(output_filename, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    try:
+        for path in paths:
+            segment = cv2.VideoCapture(path)
+            while True:
+                ret, frame = segment.read()
+                if ret is not True:
+                    break
+                output.write(frame)
+            segment.release()
+    finally:
+        output.release()
+
+
+def concatenate_segments(directory: str, output_filename: str, fps: float, size: tuple) -> bool:
+    """
+    Joins segments into the output file when all of them are complete and removes them.
+    JPEG frames of segments are copied into the output file without decoding, look avi.write_avi.
+    Videos too large for AVI 1.0 are decoded and encoded again by cv2
+
+    :param directory: directory of segments
+    :param output_filename: path to the output .avi file
+    :param fps: frame rate of the video
+    :param size: size of ASCII-art frames
+    :return: True if segments were joined
+    """
+    checkpoints = load_checkpoints(directory)
+    last = min((index for index, checkpoint in checkpoints.items() if checkpoint["last"]), default=None)
+    if last is None or any(index not in checkpoints for index in range(last)):
+        return False
+    try:
+        # several processes may complete the last segments at once, only one of them joins them
+        lock = os.open(os.path.join(directory, CONCATENATION_LOCK_NAME), os.O_CREAT | os.O_EXCL)
+    except FileExistsError:
+        return False
+    os.close(lock)
+
+    paths = [segment_filename(directory, index) for index in range(last + 1) if checkpoints[index]["frames"]]
+    with stage("concatenation"):
+        try:
+            write_avi(output_filename, [(path, *chunk) for path in paths for chunk in find_frame_chunks(path)],
+                      fps, size)
+        except ValueError as error:
+            logging.warning(f"segments are encoded again: {error}")
+            reencode_segments(paths, output_filename, fps, size)
+    shutil.rmtree(directory)
+    return True
+
+
+def render_segments(video: cv2.VideoCapture, args: argparse, fps: float, size: tuple) -> bool:
+    """
+    Converts the video in segments of fixed length with a checkpoint after every segment.
+    Conversion of the same video with the same settings resumes from the first missing segment,
+    several processes may convert different ranges of segments at once, look args.segment_range.
+    Segments are joined into the output file when all of them are complete
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :param fps: frame rate of the video
+    :param size: size of ASCII-art frames
+    :return: True if the segments were converted, False if user has stopped the conversion or it has failed
+    """
+    output_filename = construct_output_filename(args)
+    directory = construct_segment_dir(output_filename)
+    segment_frames = max(1, round(args.segment_length * fps))
+    manifest = make_manifest(args, fps, size, segment_frames)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        logging.error("output file directory is incorrect")
+        video.release()
+        return False
+
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf8') as file:
+            if json.load(file) != manifest:
+                logging.error(f"segments of another conversion are in {directory}, remove it to start again")
+                video.release()
+                return False
+    else:
+        write_json_atomically(manifest_path, manifest)
+
+    first, last = args.segment_range or (0, None)
+    try:
+        while True:
+            checkpoints = load_checkpoints(directory)
+            missing = find_missing_segments(checkpoints, first, last)
+            if missing is None:
+                break
+            if missing[0] > 0:
+                logging.info(f"conversion resumes from segment {missing[0]}")
+            if not write_segments(video, args, directory, *missing, segment_frames, fps, size):
+                missing = find_missing_segments(load_checkpoints(directory), missing[0], last)
+                logging.warning("conversion has been stopped by user" +
+                                ("" if missing is None else f", it resumes from segment {missing[0]}"))
+                return False
+            if load_checkpoints(directory).keys() == checkpoints.keys():
+                # no frames were left in the range
+                break
+            first = missing[0]
+    finally:
+        video.release()
+
+    if concatenate_segments(directory, output_filename, fps, size):
+        logging.info("segments have been joined into the ASCII-art video")
+    return True
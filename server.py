@@ -0,0 +1,400 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import urllib.parse
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from cache import ConversionCache
+from colortext import ANSI_256, ANSI_TRUECOLOR, format_ansi
+from image import get_converter
+from modes import Modes
+from stats import Stats
+
+# output formats and the program modes which produce them
+OUTPUT_FORMATS = {
+    "text": Modes.BW.value,
+    "png": Modes.COLOR.value,
+    "ansi": Modes.TERMINAL.value,
+}
+CONTENT_TYPES = {
+    "text": "text/plain; charset=utf-8",
+    "png": "image/png",
+    "ansi": "text/plain; charset=utf-8",
+    "json": "application/json",
+}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           415: "Unsupported Media Type", 500: "Internal Server Error", 503: "Service Unavailable"}
+MAX_BODY_SIZE = 32 * 2 ** 20
+# ASCII-art is this wide when the request does not select the width, wider requests are rejected
+DEFAULT_WIDTH = 100
+MAX_WIDTH = 1000
+MAX_HEADER_LINES = 100
+# requests are collected into one batch until it holds this many bytes of uploads
+BATCH_BYTES_LIMIT = 2 ** 20
+
+
+class ConversionError(Exception):
+    """
+    Request could not be converted, carries HTTP status of the response
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def init_worker():
+    """
+    Loads lookup tables and fonts once per worker process,
+    converters of every request reuse them
+    """
+    for mode in OUTPUT_FORMATS.values():
+        get_converter(DEFAULT_WIDTH, mode)
+
+
+def convert_upload(data: bytes, output_format: str, width: int = DEFAULT_WIDTH,
+                   ansi_colors: str = ANSI_TRUECOLOR) -> bytes:
+    """
+    Converts uploaded picture into ASCII-art of the selected format
+
+    :param data: contents of the picture file
+    :param output_format: text, png or ansi
+    :param width: width of ASCII-art
+    :param ansi_colors: colors of the ansi format: truecolor or 256
+    :return: contents of the response
+    """
+    converter = get_converter(width, OUTPUT_FORMATS[output_format])
+    try:
+        # the picture is resized once, JPEG pictures are decoded at the reduced scale, look Converter.resize
+        pixels = np.asarray(converter.resize(Image.open(io.BytesIO(data))).convert(mode="RGB"))
+    except (PIL.UnidentifiedImageError, OSError):
+        raise ConversionError(415, "picture file is unsupported or corrupted")
+
+    if output_format == "text":
+        return converter.convert_pixels(pixels).encode("utf8")
+    if output_format == "png":
+        output = io.BytesIO()
+        ascii_art_image = Image.fromarray(converter.draw(converter.convert_pixels(pixels), pixels), mode="RGB")
+        ascii_art_image.save(output, format="PNG")
+        return output.getvalue()
+    return format_ansi(converter.map_pixels(pixels), pixels, ansi_colors).encode("utf8")
+
+
+def convert_uploads(requests: list) -> list:
+    """
+    Converts the batch of uploads in one call to the worker process.
+    Runs in the worker processes
+
+    :param requests: list of argument tuples of convert_upload
+    :return: list of tuples with HTTP status and contents of the response
+    """
+    results = []
+    for request in requests:
+        try:
+            results.append((200, convert_upload(*request)))
+        except ConversionError as error:
+            results.append((error.status, str(error).encode("utf8")))
+        except Exception:
+            logging.exception("unexpected error occurred while converting the picture")
+            results.append((500, b"unexpected error occurred while converting the picture"))
+    return results
+
+
+class ConversionServer:
+    """
+    HTTP server which converts uploaded pictures in the pool of worker processes.
+    Small requests which arrive together are sent to the pool as one batch.
+    Requests wait in the bounded queue, when it is full new requests
+    are rejected with 503, so that the server is never overloaded
+    """
+
+    def __init__(self, workers: int = None, queue_size: int = 64, batch_size: int = 8, batch_window: float = 0.005,
+                 cache_size: int = 64 * 2 ** 20):
+        """
+        :param workers: number of worker processes, all CPU cores by default
+        :param queue_size: number of requests waiting for conversion
+        :param batch_size: maximal number of requests in one batch
+        :param batch_window: seconds to wait for more requests of the batch
+        :param cache_size: limit of the in-memory cache of responses in bytes
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.cache = ConversionCache(memory_limit=cache_size)
+        self.stats = Stats()
+        self.counters = collections.Counter()
+        self.pool = None
+        self.queue = None
+        self.slots = None
+        self.server = None
+        self.dispatcher = None
+        self.batches = set()
+        self.started = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000):
+        """
+        Starts worker processes and begins to accept connections
+
+        :param host: address to listen on
+        :param port: port to listen on, 0 selects a free port
+        """
+        self.pool = self.create_pool()
+        self.queue = asyncio.Queue(self.queue_size)
+        # two batches per worker keep the pool busy while the results are sent
+        self.slots = asyncio.Semaphore(self.workers * 2)
+        self.dispatcher = asyncio.create_task(self.dispatch())
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        self.started = time.perf_counter()
+
+    def create_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                      initializer=init_worker)
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.dispatcher.cancel()
+        if self.batches:
+            await asyncio.wait(self.batches)
+        self.pool.shutdown()
+
+    async def dispatch(self):
+        """
+        Collects queued requests into batches and sends them to the pool
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            batch_bytes = len(batch[0][0][0])
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size and batch_bytes < BATCH_BYTES_LIMIT:
+                try:
+                    job = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        job = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                batch.append(job)
+                batch_bytes += len(job[0][0])
+
+            await self.slots.acquire()
+            task = asyncio.create_task(self.convert_batch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def convert_batch(self, batch: list):
+        """
+        :param batch: list of tuples with arguments of convert_upload and the future of the response
+        """
+        self.counters["batches"] += 1
+        self.counters["converted"] += len(batch)
+        pool = self.pool
+        try:
+            with self.stats.stage("batch"):
+                results = await asyncio.get_running_loop().run_in_executor(
+                    pool, convert_uploads, [request for request, _ in batch])
+        except concurrent.futures.process.BrokenProcessPool:
+            logging.exception("worker process failed, workers are restarted")
+            results = [(500, b"worker process failed")] * len(batch)
+            # batches which ran in the broken pool fail together, the pool is replaced once
+            if self.pool is pool:
+                self.counters["pool restarts"] += 1
+                pool.shutdown(wait=False)
+                self.pool = self.create_pool()
+        except Exception:
+            logging.exception("worker process failed")
+            results = [(500, b"worker process failed")] * len(batch)
+        finally:
+            self.slots.release()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def convert(self, request: tuple) -> tuple:
+        """
+        :param request: tuple with arguments of convert_upload
+        :return: tuple with HTTP status and contents of the response
+        """
+        key = hashlib.sha256(request[0] + json.dumps(request[1:]).encode("utf8")).hexdigest()
+        data = self.cache.get(key)
+        if data is not None:
+            self.counters["cache hits"] += 1
+            return 200, data
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((request, future))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            return 503, b"server is busy, try again later"
+        status, data = await future
+        if status == 200:
+            self.cache.put(key, data)
+        return status, data
+
+    async def handle_request(self, method: str, target: str, body: bytes) -> tuple:
+        """
+        :param method: HTTP method
+        :param target: path with the query string
+        :param body: contents of the request
+        :return: tuple with HTTP status, content type and contents of the response
+        """
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/stats":
+            return 200, CONTENT_TYPES["json"], json.dumps(self.report(), indent=2).encode("utf8")
+        if url.path != "/convert":
+            return 404, CONTENT_TYPES["text"], b"unknown path, use /convert or /stats"
+        if method != "POST":
+            return 405, CONTENT_TYPES["text"], b"upload the picture with POST"
+
+        output_format = query.get("format", "text")
+        ansi_colors = query.get("colors", ANSI_TRUECOLOR)
+        if output_format not in OUTPUT_FORMATS or ansi_colors not in (ANSI_TRUECOLOR, ANSI_256):
+            return 400, CONTENT_TYPES["text"], b"format must be text, png or ansi, colors must be truecolor or 256"
+        try:
+            width = int(query.get("width", DEFAULT_WIDTH))
+        except ValueError:
+            width = 0
+        if not 0 < width <= MAX_WIDTH:
+            return 400, CONTENT_TYPES["text"], f"width must be an integer from 1 to {MAX_WIDTH}".encode("utf8")
+
+        status, data = await self.convert((body, output_format, width, ansi_colors))
+        return status, CONTENT_TYPES[output_format if status == 200 else "text"], data
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves HTTP/1.1 requests of one connection, connection is kept alive
+        until the client closes it or asks to close it
+        """
+        try:
+            while True:
+                try:
+                    # too long lines raise ValueError as well as malformed ones
+                    request_line = await reader.readline()
+                    if not request_line.strip():
+                        break
+                    start = time.perf_counter()
+                    self.counters["requests"] += 1
+                    method, target, _ = request_line.decode("latin-1").split()
+                    headers = {}
+                    for _ in range(MAX_HEADER_LINES):
+                        line = (await reader.readline()).decode("latin-1").strip()
+                        if not line:
+                            break
+                        name, _, value = line.partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError("negative content length")
+                except ValueError:
+                    await self.respond(writer, 400, CONTENT_TYPES["text"], b"malformed request", close=True)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.respond(writer, 413, CONTENT_TYPES["text"], b"picture is too large", close=True)
+                    break
+
+                body = await reader.readexactly(length)
+                self.counters["bytes received"] += length
+                status, content_type, data = await self.handle_request(method, target, body)
+                close = headers.get("connection", "").lower() == "close"
+                await self.respond(writer, status, content_type, data, close)
+                self.stats.record("request", time.perf_counter() - start)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, content_type: str, data: bytes,
+                      close: bool = False):
+        self.counters[f"responses {status}"] += 1
+        self.counters["bytes sent"] += len(data)
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: {'close' if close else 'keep-alive'}\r\n")
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await writer.drain()
+
+    def report(self) -> dict:
+        """
+        :return: dictionary with counters, throughput and latency of the server
+        """
+        uptime = time.perf_counter() - self.started
+        return {
+            "uptime": uptime,
+            "counters": dict(self.counters),
+            "requests_per_second": self.counters["requests"] / uptime if uptime else None,
+            "queued": self.queue.qsize(),
+            "latency": self.stats.summary(),
+        }
+
+
+async def serve(args: argparse):
+    """
+    Runs the server until it is interrupted
+
+    :param args: parsed console arguments
+    """
+    server = ConversionServer(args.workers, args.queue_size, args.batch_size, args.batch_window / 1000,
+                              args.cache_size * 2 ** 20)
+    await server.start(args.host, args.port)
+    logging.info(f"serving on http://{args.host}:{server.port}, POST pictures to /convert, counters are at /stats")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def parse_arguments(args: list):
+    """
+    Parse list of arguments via argparse
+
+    :param args: list of arguments
+    :return: parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="HTTP service which converts uploaded pictures into ASCII-art: "
+                                                 "POST /convert?format=text|png|ansi&width=N")
+    parser.add_argument("-H", "--host", type=str, default="127.0.0.1", help="address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes, all CPU cores by default")
+    parser.add_argument("-qs", "--queue_size", type=int, default=64, help="number of requests waiting for "
+                                                                          "conversion, others are rejected")
+    parser.add_argument("-bs", "--batch_size", type=int, default=8, help="maximal number of requests in one batch")
+    parser.add_argument("-bw", "--batch_window", type=float, default=5, help="milliseconds to wait for more "
+                                                                             "requests of the batch")
+    parser.add_argument("-cs", "--cache_size", type=int, default=64, help="size limit of the in-memory cache "
+                                                                          "of responses in megabytes")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(parse_arguments(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
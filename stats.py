@@ -0,0 +1,179 @@
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_ENVIRONMENT_VARIABLE = "ASCII_ART_PROFILE"
+PROFILERS = ("cprofile", "pyinstrument")
+PERCENTILES = (50, 90, 99)
+# number of functions shown in the cProfile report
+PROFILE_REPORT_LINES = 30
+
+
+class Stats:
+    """
+    Collects durations of the conversion stages
+    """
+
+    def __init__(self):
+        self.durations = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Measures the duration of the code inside the with statement
+
+        :param name: name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        """
+        :param name: name of the stage
+        :param seconds: duration of the stage
+        """
+        with self.lock:
+            self.durations[name].append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+
+    def take(self) -> dict:
+        """
+        :return: dictionary with lists of durations of every stage, they are removed from the statistics
+        """
+        with self.lock:
+            durations, self.durations = self.durations, collections.defaultdict(list)
+        return dict(durations)
+
+    def merge(self, durations: dict):
+        """
+        :param durations: dictionary with lists of durations of every stage, look take
+        """
+        with self.lock:
+            for name, values in durations.items():
+                self.durations[name].extend(values)
+
+    def summary(self) -> dict:
+        """
+        :return: dictionary with count, total, mean, percentiles
+                 and maximum of the durations of every stage in seconds
+        """
+        with self.lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+        summary = {}
+        for name, values in durations.items():
+            stage = {"count": len(values), "total": sum(values), "mean": sum(values) / len(values)}
+            for percentile in PERCENTILES:
+                stage[f"p{percentile}"] = values[min(len(values) - 1, len(values) * percentile // 100)]
+            stage["max"] = values[-1]
+            summary[name] = stage
+        return summary
+
+    def format_text(self) -> str:
+        """
+        :return: human-readable table of the summary
+        """
+        lines = [f"{'stage':<16} {'count':>7} {'total, s':>10} {'mean, ms':>10} "
+                 + ' '.join(f"{'p' + str(percentile) + ', ms':>10}" for percentile in PERCENTILES)
+                 + f" {'max, ms':>10}"]
+        for name, stage in self.summary().items():
+            lines.append(f"{name:<16} {stage['count']:>7} {stage['total']:>10.3f} {stage['mean'] * 1000:>10.2f} "
+                         + ' '.join(f"{stage['p' + str(percentile)] * 1000:>10.2f}" for percentile in PERCENTILES)
+                         + f" {stage['max'] * 1000:>10.2f}")
+        return '\n'.join(lines)
+
+
+# stages of the whole process are collected here, like log records by the root logger
+STATS = Stats()
+
+
+def stage(name: str):
+    """
+    Measures the duration of the stage in the process-wide statistics
+
+    :param name: name of the stage
+    :return: context manager
+    """
+    return STATS.stage(name)
+
+
+def run_with_stats(function, *arguments) -> tuple:
+    """
+    Runs the function in the worker process and takes the stages it has recorded,
+    so that they are merged into the statistics of the main process
+
+    :param function: function to run
+    :param arguments: arguments of the function
+    :return: tuple with the result of the function and the durations of the stages, look Stats.merge
+    """
+    result = function(*arguments)
+    return result, STATS.take()
+
+
+def report_stats(stats_format: str):
+    """
+    Logs the table of the process-wide statistics or prints them as JSON
+
+    :param stats_format: text or json
+    """
+    if stats_format == "json":
+        print(json.dumps(STATS.summary(), indent=2))
+    else:
+        logging.info("conversion statistics:\n" + STATS.format_text())
+
+
+@contextlib.contextmanager
+def profile(profiler: str = None):
+    """
+    Profiles the code inside the with statement and prints the report to stderr.
+    Does nothing when profiler is not selected
+
+    :param profiler: cprofile, pyinstrument or None
+    """
+    if profiler is None:
+        yield
+        return
+
+    if profiler == "pyinstrument":
+        try:
+            import pyinstrument
+        except ImportError:
+            logging.error("pyinstrument is not installed, profiling is disabled")
+            yield
+            return
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            sys.stderr.write(profiler.output_text(unicode=True, color=False))
+        return
+
+    if profiler != "cprofile":
+        logging.error(f"unknown profiler {profiler}, choose one of: " + ", ".join(PROFILERS))
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        sys.stderr.write(report.getvalue())
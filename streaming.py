@@ -0,0 +1,312 @@
+import argparse
+import logging
+import math
+import struct
+import sys
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from colortext import HTML_FOOTER, HTML_HEADER, iter_ansi_lines, iter_html_lines
+from glyphs import build_glyph_atlas, render_glyphs
+from image import (ASCII_CHARS, FONT, JPG_CHAR_SAFE_BOX_HEIGHT, JPG_CHAR_SAFE_BOX_WIDTH, WRITE_BUFFER_SIZE,
+                   assemble_ascii_string, build_char_codes, compute_resized_size, construct_output_filename,
+                   get_converter, map_frame_to_ascii)
+from modes import Modes
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# uncompressed pictures of these modes are read band by band, look find_raw_rows
+RAW_BAND_MODES = ("L", "LA", "RGB", "RGBA")
+# rows of uncompressed pictures are read in chunks of this size
+RAW_CHUNK_SIZE = 16 * 2 ** 20
+
+
+class PngStripWriter:
+    """
+    Writes RGB PNG file row by row, so that the whole image
+    never has to be held in memory
+    """
+
+    def __init__(self, file, width: int, height: int, compress_level: int = 6):
+        self.file = file
+        self.width = width
+        self.compressor = zlib.compressobj(compress_level)
+        self.file.write(PNG_SIGNATURE)
+        # 8 bits per channel, RGB, default compression, filtering and no interlace
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def write_chunk(self, chunk_type: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+    def write_rows(self, pixels: np.ndarray):
+        """
+        :param pixels: array of RGB-pixels with shape (rows, width, 3)
+        """
+        scanlines = np.zeros((pixels.shape[0], self.width * 3 + 1), dtype=np.uint8)
+        scanlines[:, 1:] = pixels.reshape((pixels.shape[0], -1))
+        data = self.compressor.compress(scanlines.tobytes())
+        if data:
+            self.write_chunk(b"IDAT", data)
+
+    def close(self):
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+
+
+def find_raw_rows(image: Image) -> list:
+    """
+    Finds rows of the uncompressed picture in its file, such as PPM, BMP
+    or uncompressed TIFF, so that any band of rows is read without decoding the rest
+
+    :param image: PIL Image object which is not loaded yet
+    :return: list of tuples with the first and the last row of every tile, its offset in the file,
+             raw mode, bytes per row and orientation, None if the picture is compressed
+    """
+    # loaded pictures have no tiles left
+    if (not getattr(image, "tile", None) or not getattr(image, "filename", None)
+            or image.mode not in RAW_BAND_MODES):
+        return None
+    tiles = []
+    for tile in image.tile:
+        codec_name, (x0, y0, x1, y1), offset, args = tile
+        if codec_name != "raw" or (x0, x1) != (0, image.size[0]):
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        # bytes per row and orientation are optional, rows are packed and stored from the top by default
+        rawmode, stride, orientation = tuple(args) + (0, 1)[len(args) - 1:]
+        if not stride:
+            try:
+                stride = len(Image.new(image.mode, (image.size[0], 1)).tobytes("raw", rawmode))
+            except (ValueError, OSError):
+                return None
+        tiles.append((y0, y1, offset, rawmode, stride, orientation))
+    return tiles
+
+
+def read_raw_band(image: Image, tiles: list, top: int, bottom: int) -> Image:
+    """
+    Reads the band of rows of the uncompressed picture, look find_raw_rows
+
+    :param image: PIL Image object
+    :param tiles: rows of the picture in its file
+    :param top: first row of the band
+    :param bottom: row after the last row of the band
+    :return: PIL Image object with the rows of the band
+    """
+    band = Image.new(image.mode, (image.size[0], bottom - top))
+    with open(image.filename, 'rb') as file:
+        for y0, y1, offset, rawmode, stride, orientation in tiles:
+            first, last = max(y0, top), min(y1, bottom)
+            if first >= last:
+                continue
+            # rows of bottom-up tiles are stored from the last one
+            file.seek(offset + stride * (first - y0 if orientation > 0 else y1 - last))
+            rows = Image.frombytes(image.mode, (image.size[0], last - first), file.read(stride * (last - first)),
+                                   "raw", rawmode, stride, orientation)
+            band.paste(rows, (0, first - top))
+    return band
+
+
+def read_narrow_band(image: Image, tiles: list, top: int, bottom: int, width: int) -> Image:
+    """
+    Reads the band of rows of the uncompressed picture in chunks of RAW_CHUNK_SIZE bytes
+    and resizes every chunk to the width at once, the way the first pass of Image.resize does,
+    so that the band is never held at the full width
+
+    :param image: PIL Image object
+    :param tiles: rows of the picture in its file, look find_raw_rows
+    :param top: first row of the band
+    :param bottom: row after the last row of the band
+    :param width: width of the result
+    :return: PIL Image object with the rows of the band resized to the width
+    """
+    band = Image.new(image.mode, (width, bottom - top))
+    chunk_rows = max(1, RAW_CHUNK_SIZE // max(tile[4] for tile in tiles))
+    for chunk_top in range(top, bottom, chunk_rows):
+        chunk_bottom = min(chunk_top + chunk_rows, bottom)
+        chunk = read_raw_band(image, tiles, chunk_top, chunk_bottom)
+        band.paste(chunk.resize((width, chunk_bottom - chunk_top)), (0, chunk_top - top))
+    return band
+
+
+def iter_resized_strips(image: Image, size: tuple, strip_height: int, box: tuple = None):
+    """
+    Resizes the image strip by strip. Every strip is resampled
+    from the matching band of the source image, so strips match
+    the resize of the whole image up to rounding. Bands of uncompressed
+    pictures are read from the file one by one, look find_raw_rows,
+    the rest of the pictures are decoded whole
+
+    :param image: PIL Image object
+    :param size: size of the resized image
+    :param strip_height: number of rows of the resized image in one strip
+    :param box: box of the source image to resize, the whole image by default
+    :return: generator of arrays of RGB-pixels with shape (rows, width, 3)
+    """
+    width, height = size
+    left, top, right, bottom = box or (0, 0, *image.size)
+    scale = (bottom - top) / height
+    tiles = find_raw_rows(image) if box is None else None
+    # the bicubic filter reaches two source rows beyond the box for every row of the result
+    margin = math.ceil(2 * max(scale, 1)) + 1
+    for strip_start in range(0, height, strip_height):
+        strip_end = min(strip_start + strip_height, height)
+        box = (left, top + strip_start * scale, right, top + strip_end * scale)
+        if tiles is None:
+            strip = image.resize((width, strip_end - strip_start), box=box)
+        else:
+            band_top = max(0, math.floor(box[1]) - margin)
+            band_bottom = min(image.size[1], math.ceil(box[3]) + margin)
+            band = read_narrow_band(image, tiles, band_top, band_bottom, width)
+            strip = band.resize((width, strip_end - strip_start), box=(0, box[1] - band_top, width, box[3] - band_top))
+        yield np.asarray(strip.convert(mode="RGB"))
+
+
+def iter_ascii_strips(image: Image, size: tuple, strip_height: int, chars: str = None):
+    """
+    Converts the image into ASCII-art strip by strip. JPEG pictures which
+    are not loaded yet are decoded at the reduced scale, look Converter.resize
+
+    :param image: PIL Image object
+    :param size: size of ASCII-art in characters, look compute_resized_size
+    :param strip_height: number of rows of ASCII-art in one strip
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
+    :return: generator of tuples with the array of character indices
+             and the array of RGB-pixels of every strip
+    """
+    box = None
+    if image.format == "JPEG":
+        reduced = image.draft(image.mode, size)
+        if reduced is not None:
+            box = reduced[1]
+    for pixels in iter_resized_strips(image, size, strip_height, box):
+        yield map_frame_to_ascii(pixels, chars), pixels
+
+
+def iter_ascii_text(image: Image, size: tuple, strip_height: int, chars: str = None):
+    """
+    Converts the image into ASCII-art string strip by strip
+
+    :param image: PIL Image object
+    :param size: size of ASCII-art in characters, look compute_resized_size
+    :param strip_height: number of rows of ASCII-art in one strip
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
+    :return: generator of ASCII-art lines of every strip
+    """
+    for char_indices, _ in iter_ascii_strips(image, size, strip_height, chars):
+        yield assemble_ascii_string(char_indices, chars)
+
+
+def iter_colored_text(image: Image, size: tuple, strip_height: int, args: argparse, chars: str = None):
+    """
+    Converts the image into ANSI-art or the HTML page strip by strip, look colortext
+
+    :param image: PIL Image object
+    :param size: size of ASCII-art in characters, look compute_resized_size
+    :param strip_height: number of rows of ASCII-art in one strip
+    :param args: parsed console arguments with the color format, levels and ANSI colors
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
+    :return: generator of lines of the output file
+    """
+    if chars is None:
+        chars = ASCII_CHARS
+    is_html = args.color_format == "html"
+    if is_html:
+        yield HTML_HEADER
+    for char_indices, pixels in iter_ascii_strips(image, size, strip_height, chars):
+        char_codes = build_char_codes(chars)[char_indices]
+        if is_html:
+            yield from iter_html_lines(char_codes, pixels, args.color_levels)
+        else:
+            yield from iter_ansi_lines(char_codes, pixels, args.ansi_colors, args.color_levels)
+    if is_html:
+        yield HTML_FOOTER
+
+
+def iter_colored_strips(image: Image, size: tuple, strip_height: int, chars: str = None):
+    """
+    Converts the image into colored ASCII-art strip by strip.
+    Glyphs reach into the neighbouring rows, so a few rows of characters
+    are kept between strips and a row is rendered only when every
+    glyph that covers it is known
+
+    :param image: PIL Image object
+    :param size: size of ASCII-art in characters, look compute_resized_size
+    :param strip_height: number of rows of ASCII-art in one strip
+    :param chars: string of ASCII-characters, ASCII_CHARS by default
+    :return: generator of arrays of rendered RGB-pixels
+    """
+    if chars is None:
+        chars = ASCII_CHARS
+    atlas = build_glyph_atlas(chars, FONT, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+    rows_above = atlas.first_row + atlas.rows - 1
+    rows_below = -atlas.first_row
+    height = size[1]
+
+    window_codes, window_colors = None, None
+    window_start, rendered = 0, 0
+    for char_indices, pixels in iter_ascii_strips(image, size, strip_height, chars):
+        char_codes = build_char_codes(chars)[char_indices]
+        if window_codes is None:
+            window_codes, window_colors = char_codes, pixels
+        else:
+            window_codes = np.concatenate((window_codes, char_codes))
+            window_colors = np.concatenate((window_colors, pixels))
+
+        available = window_start + len(window_codes)
+        ready = height if available == height else available - rows_below
+        if ready > rendered:
+            yield render_glyphs(atlas, window_codes, window_colors, rendered - window_start, ready - window_start)
+            rendered = ready
+
+        keep_from = max(rendered - rows_above, window_start)
+        window_codes = window_codes[keep_from - window_start:]
+        window_colors = window_colors[keep_from - window_start:]
+        window_start = keep_from
+
+
+def convert_image_to_ascii_in_strips(image: Image, args: argparse, output_filename: str = None):
+    """
+    Converts image into ASCII-art strip by strip and writes every strip
+    to the output file as soon as it is ready, so that the memory of ASCII-art
+    and of the rendered picture depends on the strip height and not on the image size.
+    Uncompressed pictures are read band by band as well, the rest of them are decoded whole,
+    JPEG pictures at the reduced scale
+
+    :param image: PIL Image object
+    :param args: parsed console arguments
+    :param output_filename: path to the output file, look construct_output_filename by default
+    """
+    if output_filename is None:
+        output_filename = construct_output_filename(args)
+    # strips are converted with linear selection, look Selections
+    converter = get_converter(args.width, args.mode, args.backend, args.charset or ASCII_CHARS,
+                              char_aspect=args.char_aspect)
+    chars = converter.chars
+    size = compute_resized_size(image, args.width, char_aspect=converter.char_aspect)
+
+    try:
+        if args.mode == Modes.COLOR.value and args.color_format != "png":
+            with open(output_filename, 'w', encoding='utf8', buffering=WRITE_BUFFER_SIZE) as file:
+                for line in iter_colored_text(image, size, args.strip_height, args, chars):
+                    file.write(line)
+        elif args.mode == Modes.COLOR.value:
+            with open(output_filename, 'wb') as file:
+                writer = PngStripWriter(file, size[0] * JPG_CHAR_SAFE_BOX_WIDTH, size[1] * JPG_CHAR_SAFE_BOX_HEIGHT,
+                                        args.png_compression)
+                for pixels in iter_colored_strips(image, size, args.strip_height, chars):
+                    writer.write_rows(pixels)
+                writer.close()
+        elif args.mode == Modes.BW.value:
+            with open(output_filename, 'w', encoding='utf8', errors='ignore') as file:
+                for text in iter_ascii_text(image, size, args.strip_height, chars):
+                    file.write(text)
+        logging.info("image has converted to ASCII-art")
+    except FileNotFoundError:
+        logging.error("output file directory is incorrect")
+        sys.exit(3)
@@ -0,0 +1,164 @@
+import argparse
+import logging
+import shutil
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from colortext import ANSI_TRUECOLOR, RESET_COLOR, color_escape, convert_to_ansi_colors
+from image import ASCII_CHARS, build_char_codes, get_converter, map_frame_to_ascii
+
+# terminal characters are about twice as tall as they are wide
+TERMINAL_CELL_ASPECT = 2
+# frame rate used when the source does not report one, e.g. some webcams
+DEFAULT_FPS = 30.0
+
+CLEAR_SCREEN = "\x1b[2J"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+
+
+class TerminalScreen:
+    """
+    Keeps characters and colors shown in the terminal and builds
+    escape sequences that redraw only the cells changed since the last frame
+    """
+
+    def __init__(self, ansi_colors: str = ANSI_TRUECOLOR):
+        self.ansi_colors = ansi_colors
+        self.char_codes = None
+        self.colors = None
+
+    def color_escape(self, color: int) -> str:
+        """
+        :param color: palette index or 0xRRGGBB integer
+        :return: escape sequence which sets the foreground color
+        """
+        return color_escape(color, self.ansi_colors)
+
+    def draw(self, char_codes: np.ndarray, pixels: np.ndarray) -> str:
+        """
+        Builds escape sequences which turn the previous frame into the new one
+
+        :param char_codes: array of character codes with shape (height, width)
+        :param pixels: array of RGB-pixels with shape (height, width, 3)
+        :return: string to write to the terminal
+        """
+        colors = convert_to_ansi_colors(pixels, self.ansi_colors)
+
+        parts = []
+        if self.char_codes is None or self.char_codes.shape != char_codes.shape:
+            parts.append(CLEAR_SCREEN)
+            changed = np.ones(char_codes.shape, dtype=bool)
+        else:
+            changed = (char_codes != self.char_codes) | (colors != self.colors)
+        self.char_codes, self.colors = char_codes, colors
+
+        rows, columns = np.nonzero(changed)
+        last_row, last_column, last_color = -1, -1, None
+        for row, column, char_code, color in zip(rows.tolist(), columns.tolist(),
+                                                 char_codes[rows, columns].tolist(), colors[rows, columns].tolist()):
+            # cursor moves by itself while changed cells follow each other in a row
+            if row != last_row or column != last_column + 1:
+                parts.append(f"\x1b[{row + 1};{column + 1}H")
+            if color != last_color:
+                parts.append(self.color_escape(color))
+            parts.append(chr(char_code))
+            last_row, last_column, last_color = row, column, color
+        return ''.join(parts)
+
+
+def open_source(source: str) -> cv2.VideoCapture:
+    """
+    Opens video file or capture device, digits are treated as the device index
+
+    :param source: path to the video or device index
+    :return: cv2.VideoCapture object
+    """
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    return cv2.VideoCapture(source)
+
+
+def compute_terminal_size(width: int, height: int, new_width: int) -> tuple[int, int]:
+    """
+    Calculates the size of ASCII-art in the terminal. By default it fits the terminal width
+
+    :param width: width of the video
+    :param height: height of the video
+    :param new_width: width selected by user
+    :return: tuple with number of columns and rows
+    """
+    if new_width is None or new_width <= 0:
+        new_width = shutil.get_terminal_size().columns
+    return new_width, max(1, int(new_width * height / width / TERMINAL_CELL_ASPECT))
+
+
+def play_in_terminal(args: argparse, stream=None) -> bool:
+    """
+    Plays video or capture device in the terminal as colored ASCII-art.
+    Frames are paced by the frame rate of the source, when conversion
+    falls behind the late frames are grabbed without decoding and dropped
+
+    :param args: parsed console arguments
+    :param stream: text stream to write to, sys.stdout by default
+    :return: True if the source was played
+    """
+    if stream is None:
+        stream = sys.stdout
+    video = open_source(args.image)
+    if not video.isOpened():
+        logging.error("file was not opened: it may not exist or " +
+                      "be corrupted")
+        return False
+
+    fps = video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    frame_interval = 1 / fps
+    # dense characters for bright pixels on the dark terminal background, cells are converted
+    # with linear selection, look Selections
+    chars = get_converter(args.width, args.mode, args.backend, args.charset or ASCII_CHARS).chars
+    screen = TerminalScreen(args.ansi_colors)
+    size = None
+    shown, dropped = 0, 0
+
+    stream.write(HIDE_CURSOR)
+    start = time.perf_counter()
+    frame_index = 0
+    try:
+        while True:
+            ret, frame = video.read()
+            if ret is not True:
+                break
+            if size is None:
+                size = compute_terminal_size(frame.shape[1], frame.shape[0], args.width)
+
+            pixels = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)[..., ::-1]
+            char_codes = build_char_codes(chars)[map_frame_to_ascii(pixels, chars)]
+            stream.write(screen.draw(char_codes, pixels))
+            stream.flush()
+            shown += 1
+            frame_index += 1
+
+            delay = start + frame_index * frame_interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late_frames = int(-delay / frame_interval)
+                for _ in range(late_frames):
+                    if not video.grab():
+                        break
+                    dropped += 1
+                frame_index += late_frames
+    except KeyboardInterrupt:
+        pass
+    finally:
+        video.release()
+        if size is not None:
+            stream.write(f"\x1b[{size[1] + 1};1H")
+        stream.write(RESET_COLOR + SHOW_CURSOR)
+        stream.flush()
+
+    logging.info(f"{shown} frames shown, {dropped} frames dropped")
+    return True
@@ -1,9 +1,34 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
 import unittest
 from unittest.mock import Mock
 import PIL
 import cv2
+import numpy as np
 
 import ascii
+import asciivideo
+import avi
+import batch
+import benchmark
+import cache
+import colortext
+import dither
+import glyphs
+import live
+import palette
+import stats
+import streaming
+import segments
+import server
+import terminal
 import logging
 from PIL import Image
 
@@ -11,6 +36,50 @@ import image
 import video
 
 
+class FakeVideoCapture:
+    """
+    Stand-in for cv2.VideoCapture which plays frames from the list
+    """
+
+    def __init__(self, frames: list, fps: float = 25.0):
+        self.frames = list(frames)
+        self.fps = fps
+        self.position = 0
+        self.decoded = 0
+
+    def read(self):
+        if self.position >= len(self.frames):
+            return False, None
+        self.position += 1
+        self.decoded += 1
+        return True, self.frames[self.position - 1]
+
+    def grab(self):
+        if self.position >= len(self.frames):
+            return False
+        self.position += 1
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        height, width = self.frames[0].shape[:2]
+        return {cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FRAME_HEIGHT: height,
+                cv2.CAP_PROP_FRAME_WIDTH: width, cv2.CAP_PROP_FRAME_COUNT: len(self.frames)}.get(prop, 0)
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+def make_frames(count: int, height: int = 12, width: int = 16) -> list:
+    rng = np.random.default_rng(count)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
 class MyTestCase(unittest.TestCase):
     def test_parse_arguments(self):
         args = ["pic.png", "-od", r"C:\test", "-w", "500", "-m", "bw"]
@@ -38,6 +107,105 @@ class MyTestCase(unittest.TestCase):
             ascii.initial_checkup(ascii.parse_arguments(args))
         self.assertEqual(["ERROR:root:picture file is unsupported or corrupted"], cm.output)
 
+    def test_charset_is_used_in_terminal_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "vid.avi")
+            writer = cv2.VideoWriter(source, cv2.VideoWriter_fourcc(*'MJPG'), 1000.0, (16, 12))
+            for frame in make_frames(2):
+                writer.write(frame)
+            writer.release()
+            stream = io.StringIO()
+            args = ascii.parse_arguments([source, "-m", "t", "-w", "8", "-ch", " #"])
+            with self.assertLogs('root', level='INFO'):
+                self.assertTrue(terminal.play_in_terminal(args, stream))
+        drawn = re.sub(r"\x1b\[[0-9;?]*[A-Za-z]", "", stream.getvalue())
+        self.assertTrue(drawn)
+        self.assertLessEqual(set(drawn), {" ", "#"})
+
+    def test_checkpointed_video_resumes_from_last_segment(self):
+        frames = make_frames(7)
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "vid.avi")
+            open(source, "wb").close()
+            args = ascii.parse_arguments([source, "-m", "v", "-w", "8", "-j", "1", "-np", "-sg", "0.08",
+                                          "-sr", "0", "1"])
+            size = video.resize_video(16, 12, 8)
+            segments.render_segments(FakeVideoCapture(frames), args, 25.0, size)
+            checkpoints = segments.load_checkpoints(os.path.join(directory, "ascii.avi.segments"))
+            self.assertEqual({0: 1, 1: 3}, {index: checkpoint["last_frame"]
+                                            for index, checkpoint in checkpoints.items()})
+
+            args.segment_range = None
+            capture = FakeVideoCapture(frames)
+            segments.render_segments(capture, args, 25.0, size)
+            self.assertEqual(3, capture.decoded)
+            self.assertFalse(os.path.exists(os.path.join(directory, "ascii.avi.segments")))
+            output = cv2.VideoCapture(os.path.join(directory, "ascii.avi"))
+            self.assertEqual(7, int(output.get(cv2.CAP_PROP_FRAME_COUNT)))
+            output.release()
+
+    def test_checkpointed_video_ranges_past_the_end(self):
+        frames = make_frames(7)
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "vid.avi")
+            open(source, "wb").close()
+            size = video.resize_video(16, 12, 8)
+            segment_dir = os.path.join(directory, "ascii.avi.segments")
+            for first, last in ((6, 9), (2, 9), (0, 1)):
+                args = ascii.parse_arguments([source, "-m", "v", "-w", "8", "-j", "1", "-np", "-sg", "0.08",
+                                              "-sr", str(first), str(last)])
+                self.assertTrue(segments.render_segments(FakeVideoCapture(frames), args, 25.0, size))
+                if first == 6:
+                    self.assertEqual({}, segments.load_checkpoints(segment_dir))
+                    # the empty last segment after the end of the video does not stop joining
+                    segments.finish_segment(segment_dir, 5, 2, 0, 25.0, last=True)
+            self.assertFalse(os.path.exists(segment_dir))
+            output = cv2.VideoCapture(os.path.join(directory, "ascii.avi"))
+            self.assertEqual(7, int(output.get(cv2.CAP_PROP_FRAME_COUNT)))
+            output.release()
+
+    def test_avi_frames_are_joined_without_encoding(self):
+        frames = make_frames(5, 48, 64)
+        with tempfile.TemporaryDirectory() as directory:
+            sources = [os.path.join(directory, name) for name in ("a.avi", "b.avi")]
+            for source, part in zip(sources, (frames[:2], frames[2:])):
+                writer = cv2.VideoWriter(source, cv2.VideoWriter_fourcc(*'MJPG'), 25.0, (64, 48))
+                for frame in part:
+                    writer.write(frame)
+                writer.release()
+            chunks = [(source, *chunk) for source in sources for chunk in avi.find_frame_chunks(source)]
+            self.assertEqual(5, len(chunks))
+            output = os.path.join(directory, "joined.avi")
+            avi.write_avi(output, chunks, 25.0, (64, 48))
+
+            decoded = []
+            for path in sources + [output]:
+                capture = cv2.VideoCapture(path)
+                while True:
+                    ret, frame = capture.read()
+                    if ret is not True:
+                        break
+                    decoded.append(frame)
+                capture.release()
+            self.assertEqual(10, len(decoded))
+            self.assertTrue(all(np.array_equal(first, second) for first, second in zip(decoded[:5], decoded[5:])))
+        with self.assertRaises(ValueError):
+            avi.write_avi(output, [(output, 0, avi.MAX_AVI_SIZE)], 25.0, (64, 48))
+
+    def test_conversion_of_several_widths_from_one_decode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "pic.jpg")
+            benchmark.make_synthetic_image((400, 300)).save(path)
+            args = ascii.parse_arguments([path, "-m", "bw", "-ws", "20", "10", "40", "-od", directory])
+            with Image.open(path) as picture:
+                image.convert_image_to_ascii_widths(picture, args)
+            for width in (10, 20, 40):
+                with open(os.path.join(directory, f"ascii_{width}.txt"), encoding="utf8") as file:
+                    lines = file.read().splitlines()
+                with Image.open(path) as picture:
+                    expected = image.Converter(width, char_aspect=args.char_aspect).to_text(picture).splitlines()
+                self.assertEqual((len(expected), len(expected[0])), (len(lines), len(lines[0])))
+
     def test_conversion_to_ascii(self):
         pixel1 = (0, 0, 0)
         pixel2 = (255, 255, 255)
@@ -46,6 +214,315 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual('@', image.map_pixel_to_ascii(pixel2))
         self.assertEqual('+', image.map_pixel_to_ascii(pixel3))
 
+    def test_vectorized_conversion_to_ascii(self):
+        pixels = np.array([[(0, 0, 0), (255, 255, 255)], [(128, 128, 128), (45, 23, 124)]], dtype=np.uint8)
+        char_indices = image.map_frame_to_ascii(pixels, " .:#")
+        self.assertEqual(" #\n: \n", image.assemble_ascii_string(char_indices, " .:#"))
+
+    def test_vectorized_conversion_matches_reference(self):
+        pixels = np.random.default_rng(0).integers(0, 256, (40, 37, 3), dtype=np.uint8)
+        reference = image.convert_pixels_to_ascii(list(map(tuple, pixels.reshape(-1, 3).tolist())), 37)
+        self.assertEqual(reference, image.assemble_ascii_string(image.map_frame_to_ascii(pixels)))
+
+    def test_image_modes_do_not_import_cv2(self):
+        command = "import sys, ascii; ascii.parse_arguments(['pic.png', '-m', 'bw']); print('cv2' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", command], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual("False", result.stdout.strip())
+
+    def test_lookup_table(self):
+        table = image.build_lookup_table(image.ASCII_CHARS)
+        self.assertEqual(256, len(table))
+        self.assertEqual(0, table[0])
+        self.assertEqual(len(image.ASCII_CHARS) - 1, table[255])
+
+    def test_glyph_atlas_rendering_matches_reference(self):
+        pixels = np.random.default_rng(1).integers(0, 256, (9, 13, 3), dtype=np.uint8)
+        ascii_art_string = image.assemble_ascii_string(image.map_frame_to_ascii(pixels))
+        reference = image.draw_colored_image_by_char(ascii_art_string,
+                                                     list(map(tuple, pixels.reshape(-1, 3).tolist())), (13, 9))
+        rendered = image.draw_colored_image(ascii_art_string, pixels, (13, 9))
+        self.assertEqual(reference.size, rendered.size)
+        self.assertTrue(np.array_equal(np.asarray(reference), np.asarray(rendered)))
+
+    def test_converter_is_stable_across_threads(self):
+        picture = Image.fromarray(np.random.default_rng(2).integers(0, 256, (30, 40, 3), dtype=np.uint8))
+        converter = image.Converter(width=20, mode="c")
+        expected = converter.to_text(picture)
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda _: converter.to_text(picture), range(8)))
+        self.assertEqual([expected] * 8, results)
+        self.assertEqual(image.Converter(width=20, mode="bw").to_text(picture),
+                         image.Converter(width=20, mode="bw").to_text(picture))
+        self.assertEqual((15 * 4, 20 * 4, 3), converter.to_array(picture).shape)
+        self.assertEqual((20 * 4, 15 * 4), converter.to_image(picture).size)
+
+    def test_density_selection_orders_characters_by_ink(self):
+        converter = image.Converter(chars="@. #", selection="density")
+        self.assertEqual(" .", converter.chars[:2])
+        self.assertEqual([0, 255], [converter.levels[0], converter.levels[-1]])
+        self.assertEqual(converter.chars[::-1], image.Converter(mode="c", chars="@. #", selection="density").chars)
+
+    def test_dithering_keeps_average_brightness(self):
+        brightness = np.full((32, 48), 100, dtype=np.uint8)
+        levels = np.array([0.0, 255.0])
+        for method in dither.DITHERING_METHODS:
+            indices = dither.dither(brightness, levels, method)
+            self.assertEqual({0, 1}, set(np.unique(indices).tolist()))
+            self.assertAlmostEqual(100 / 255, indices.mean(), delta=0.02)
+
+    def test_floyd_steinberg_dithering_matches_scalar_reference(self):
+        brightness = (np.random.default_rng(4).random((29, 41)) * 255).astype(np.float32)
+        levels = np.array([0.0, 40.0, 90.0, 170.0, 255.0], dtype=np.float32)
+        values = brightness.copy()
+        expected = np.empty(brightness.shape, dtype=np.uint8)
+        height, width = brightness.shape
+        for y in range(height):
+            for x in range(width):
+                index = dither.quantize_to_levels(values[y, x], levels)
+                expected[y, x] = index
+                error = values[y, x] - levels[index]
+                if x + 1 < width:
+                    values[y, x + 1] += error * (7 / 16)
+                if y + 1 < height:
+                    if x > 0:
+                        values[y + 1, x - 1] += error * (3 / 16)
+                    values[y + 1, x] += error * (5 / 16)
+                    if x + 1 < width:
+                        values[y + 1, x + 1] += error * (1 / 16)
+        self.assertTrue(np.array_equal(expected, dither.floyd_steinberg_dither(brightness, levels)))
+
+    def test_structure_selection_follows_shapes(self):
+        converter = image.Converter(width=2, selection="structure")
+        rows, columns = converter.subcells
+        pixels = np.zeros((rows, 2 * columns, 3), dtype=np.uint8)
+        pixels[:, columns:] = 255
+        self.assertEqual((1, 2), converter.map_pixels(pixels).shape)
+        self.assertEqual((1, 2, 3), converter.cell_colors(pixels).shape)
+        dark, bright = converter.map_pixels(pixels)[0]
+        coverage = glyphs.measure_glyph_coverage(converter.chars, image.FONT, 4, 4)
+        self.assertLess(coverage[converter.chars.index(chr(dark))], coverage[converter.chars.index(chr(bright))])
+
+    def test_converter_rejects_invalid_charset(self):
+        self.assertRaises(ValueError, image.Converter, chars="")
+        self.assertRaises(ValueError, image.Converter, chars="░▒▓")
+
+    def test_constructing_batch_output_filename(self):
+        root = os.path.join("pics", "")
+        path = os.path.join("pics", "cats", "cat.jpg")
+        args_parsed = ascii.parse_arguments(["pics", "-m", "bw"])
+        self.assertEqual(os.path.join("pics", "cats", "cat_ascii.txt"),
+                         batch.construct_batch_output_filename(path, root, args_parsed))
+        args_parsed = ascii.parse_arguments(["pics", "-od", "out", "-m", "c"])
+        self.assertEqual(os.path.join("out", "cats", "cat_ascii.png"),
+                         batch.construct_batch_output_filename(path, root, args_parsed))
+
+    def test_animation_converts_every_frame(self):
+        frames = [Image.fromarray(frame) for frame in make_frames(3, 8, 10)]
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "anim.gif")
+            frames[0].save(source, save_all=True, append_images=frames[1:], duration=40, loop=0)
+            for mode, output in (("bw", "ascii.txt"), ("c", "ascii.gif")):
+                args = ascii.parse_arguments([source, "-m", mode, "-od", directory, "-j", "1"])
+                with self.assertLogs('root', level='INFO') as cm:
+                    ascii.initial_checkup(args)
+                self.assertEqual(["INFO:root:animation has converted to ASCII-art: 3 frames"], cm.output)
+                self.assertTrue(os.path.isfile(os.path.join(directory, output)))
+            with open(os.path.join(directory, "ascii.txt"), encoding='utf8') as file:
+                self.assertEqual(3 * 4 + 2, len(file.read().splitlines()))
+            with Image.open(os.path.join(directory, "ascii.gif")) as animation:
+                self.assertEqual(3, animation.n_frames)
+                self.assertEqual((40, 32), animation.size)
+                self.assertTrue(image.is_animated(animation))
+            # stereo photos keep the second view as a frame
+            photo = os.path.join(directory, "photo.mpo")
+            frames[0].save(photo, format="MPO", save_all=True, append_images=frames[1:2])
+            with Image.open(photo) as picture:
+                self.assertEqual(2, picture.n_frames)
+                self.assertFalse(image.is_animated(picture))
+
+    def test_batch_conversion_of_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "in", "sub"))
+            Image.new("RGB", (6, 4), "red").save(os.path.join(directory, "in", "a.png"))
+            Image.new("RGB", (6, 4), "blue").save(os.path.join(directory, "in", "sub", "b.png"))
+            output_dir = os.path.join(directory, "out")
+            args = [os.path.join(directory, "in"), "-od", output_dir, "-m", "bw", "-j", "2"]
+            with self.assertLogs('root', level='INFO') as cm:
+                ascii.initial_checkup(ascii.parse_arguments(args))
+            self.assertTrue(cm.output[-1].startswith("INFO:root:converted 2 of 2 pictures"))
+            with open(os.path.join(output_dir, "sub", "b_ascii.txt"), encoding='utf8') as file:
+                self.assertEqual(2, len(file.read().splitlines()))
+            self.assertTrue(os.path.isfile(os.path.join(output_dir, "a_ascii.txt")))
+
+    def test_batch_converts_every_frame_of_animations(self):
+        frames = [Image.fromarray(frame) for frame in make_frames(3, 8, 10)]
+        with tempfile.TemporaryDirectory() as directory:
+            frames[0].save(os.path.join(directory, "anim.gif"), save_all=True, append_images=frames[1:], duration=40)
+            frames[0].save(os.path.join(directory, "still.png"))
+            for mode in ("bw", "c"):
+                args = [directory, "-od", os.path.join(directory, "out"), "-m", mode, "-j", "2"]
+                with self.assertLogs('root', level='INFO') as cm:
+                    ascii.initial_checkup(ascii.parse_arguments(args))
+                self.assertTrue(cm.output[-1].startswith("INFO:root:converted 2 of 2 pictures"))
+            with open(os.path.join(directory, "out", "anim_ascii.txt"), encoding='utf8') as file:
+                self.assertEqual(3 * 4 + 2, len(file.read().splitlines()))
+            with Image.open(os.path.join(directory, "out", "anim_ascii.gif")) as animation:
+                self.assertEqual(3, animation.n_frames)
+            self.assertTrue(os.path.isfile(os.path.join(directory, "out", "still_ascii.png")))
+
+    def test_batch_skips_outputs_and_survives_broken_pictures(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Image.new("RGB", (6, 4), "red").save(os.path.join(directory, "a.png"))
+            Image.new("RGB", (6, 4), "red").save(os.path.join(directory, "a_ascii.png"))
+            Image.new("RGB", (6, 4), "red").save(os.path.join(directory, "b.png"))
+            Image.new("RGB", (6, 4), "red").save(os.path.join(directory, "b.jpg"))
+            with open(os.path.join(directory, "c.png"), 'wb') as file:
+                file.write(Image.new("RGB", (6, 4)).tobytes() + b"\x89PNG\r\n\x1a\n")
+            with open(os.path.join(directory, "d.png"), 'wb') as file:
+                output = io.BytesIO()
+                Image.new("RGB", (60, 40), "blue").save(output, format="PNG")
+                file.write(output.getvalue()[:100])
+            args = ascii.parse_arguments([directory, "-m", "c", "-j", "1"])
+            self.assertEqual(["a.png", "b.jpg", "b.png", "c.png", "d.png"],
+                             [os.path.basename(path) for path in batch.collect_input_files(args)[1]])
+            with self.assertLogs('root', level='INFO') as cm:
+                batch.convert_batch(args)
+            self.assertTrue(cm.output[-1].startswith("INFO:root:converted 1 of 5 pictures"))
+            self.assertFalse(os.path.exists(os.path.join(directory, "a_ascii_ascii.png")))
+
+    def test_stats_summary(self):
+        collected = stats.Stats()
+        for milliseconds in range(1, 101):
+            collected.record("frame", milliseconds / 1000)
+        with collected.stage("resize"):
+            pass
+        summary = collected.summary()
+        self.assertEqual(100, summary["frame"]["count"])
+        self.assertAlmostEqual(0.051, summary["frame"]["p50"])
+        self.assertAlmostEqual(0.1, summary["frame"]["p99"])
+        self.assertAlmostEqual(0.1, summary["frame"]["max"])
+        self.assertEqual(1, summary["resize"]["count"])
+        self.assertIn("frame", collected.format_text())
+
+    def test_stats_include_stages_of_worker_processes(self):
+        args = ascii.parse_arguments(["vid.avi", "-m", "v", "-w", "8"])
+        for pipeline in (video.convert_frames_in_pool, video.convert_frames_in_shared_memory):
+            stats.STATS.reset()
+            self.assertEqual(4, len(list(pipeline(FakeVideoCapture(make_frames(4)), args, 2))))
+            summary = stats.STATS.summary()
+            self.assertEqual({"frame": 4, "resize": 4, "mapping": 4, "rendering": 4},
+                             {name: summary[name]["count"] for name in ("frame", "resize", "mapping", "rendering")})
+        stats.STATS.reset()
+
+    def test_strip_conversion_matches_whole_image(self):
+        pixels = np.random.default_rng(2).integers(0, 256, (23, 11, 3), dtype=np.uint8)
+        test_image = Image.fromarray(pixels)
+        text = ''.join(streaming.iter_ascii_text(test_image, (11, 23), 5))
+        self.assertEqual(image.assemble_ascii_string(image.map_frame_to_ascii(pixels)), text)
+
+        ascii_art_string = image.assemble_ascii_string(image.map_frame_to_ascii(pixels))
+        expected = np.asarray(image.draw_colored_image(ascii_art_string, pixels, (11, 23)))
+        rendered = np.concatenate(list(streaming.iter_colored_strips(test_image, (11, 23), 4)))
+        self.assertTrue(np.array_equal(expected, rendered))
+
+    def test_strip_conversion_decodes_jpeg_at_reduced_scale(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "pic.jpg")
+            benchmark.make_synthetic_image((400, 300)).save(path)
+            output = os.path.join(directory, "ascii.txt")
+            args = ascii.parse_arguments([path, "-m", "bw", "-w", "40", "-sh", "5"])
+            with Image.open(path) as picture:
+                streaming.convert_image_to_ascii_in_strips(picture, args, output)
+                self.assertEqual((50, 38), picture.size)
+            with Image.open(path) as picture:
+                expected = image.Converter(40, char_aspect=args.char_aspect).to_text(picture).splitlines()
+            with open(output, encoding='utf8') as file:
+                lines = file.read().splitlines()
+            self.assertEqual((len(expected), len(expected[0])), (len(lines), len(lines[0])))
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            ascii.parse_arguments([path, "-m", "bw", "-sh", "0"])
+
+    def test_strip_conversion_reads_uncompressed_pictures_band_by_band(self):
+        pixels = np.random.default_rng(5).integers(0, 256, (301, 203, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ("pic.ppm", "pic.bmp"):
+                path = os.path.join(directory, name)
+                Image.fromarray(pixels).save(path)
+                with Image.open(path) as picture:
+                    expected = np.concatenate(list(streaming.iter_resized_strips(picture.copy(), (40, 30), 7)))
+                with Image.open(path) as picture:
+                    self.assertIsNotNone(streaming.find_raw_rows(picture))
+                    strips = np.concatenate(list(streaming.iter_resized_strips(picture, (40, 30), 7)))
+                    self.assertTrue(picture.tile)
+                self.assertLessEqual(np.abs(expected.astype(np.int16) - strips).max(), 1)
+
+            max_image_pixels = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = 1000
+            try:
+                with self.assertLogs('root', level='INFO') as cm:
+                    ascii.initial_checkup(ascii.parse_arguments([path, "-m", "bw", "-w", "8", "-od", directory]))
+                self.assertEqual(["ERROR:root:picture is too large to convert at once, convert it in strips (-sh)"],
+                                 cm.output)
+                with self.assertLogs('root', level='INFO') as cm:
+                    ascii.initial_checkup(ascii.parse_arguments([path, "-m", "bw", "-w", "8", "-sh", "2",
+                                                                 "-od", directory]))
+                self.assertEqual("INFO:root:image has converted to ASCII-art", cm.output[-1])
+            finally:
+                Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+    def test_strip_png_writer(self):
+        pixels = np.random.default_rng(3).integers(0, 256, (10, 7, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "strips.png")
+            with open(filename, 'wb') as file:
+                writer = streaming.PngStripWriter(file, 7, 10)
+                writer.write_rows(pixels[:4])
+                writer.write_rows(pixels[4:])
+                writer.close()
+            with PIL.Image.open(filename) as written:
+                self.assertTrue(np.array_equal(pixels, np.asarray(written.convert(mode="RGB"))))
+
+    def test_cache_evicts_least_recently_used_entries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            conversion_cache = cache.ConversionCache(directory, disk_limit=10, memory_limit=6)
+            conversion_cache.put("a" * 64, b"aaaa")
+            conversion_cache.put("b" * 64, b"bbbb")
+            self.assertEqual(b"aaaa", conversion_cache.get("a" * 64))
+            conversion_cache.put("c" * 64, b"cccc")
+            self.assertIsNone(conversion_cache.get("b" * 64))
+            self.assertEqual(["a" * 64, "c" * 64], sorted(os.listdir(directory)))
+
+            reopened = cache.ConversionCache(directory, disk_limit=10)
+            self.assertEqual(b"cccc", reopened.get("c" * 64))
+
+    def test_cache_directory_is_shared_by_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = cache.ConversionCache(directory, disk_limit=10, memory_limit=0)
+            second = cache.ConversionCache(directory, disk_limit=10, memory_limit=0)
+            first.put("a" * 64, b"aaaa")
+            self.assertEqual(b"aaaa", second.get("a" * 64))
+            second.put("b" * 64, b"bbbb")
+            second.put("c" * 64, b"cccc")
+            self.assertEqual(["b" * 64, "c" * 64], sorted(os.listdir(directory)))
+            self.assertIsNone(first.get("a" * 64))
+
+    def test_cache_key_depends_on_contents_and_arguments(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "pic.png")
+            Image.new("RGB", (4, 4), "red").save(path)
+            bw_key = cache.make_cache_key(path, ascii.parse_arguments([path, "-m", "bw"]))
+            self.assertEqual(bw_key, cache.make_cache_key(path, ascii.parse_arguments([path, "-m", "bw"])))
+            self.assertNotEqual(bw_key, cache.make_cache_key(path, ascii.parse_arguments([path, "-m", "c"])))
+            self.assertNotEqual(bw_key, cache.make_cache_key(path, ascii.parse_arguments([path, "-m", "bw", "-w", "2"])))
+
+    def test_benchmark_reports_every_stage(self):
+        results = benchmark.run_image_benchmarks({"tiny": (32, 24)}, 16, 1, "numpy")
+        self.assertEqual(["resize", "mapping", "string assembly", "colour rendering", "mapping (ordered)",
+                          "mapping (floyd-steinberg)", "mapping (structure)", "mapping (full size)"],
+                         [result["name"] for result in results])
+        self.assertTrue(all(result["pixels_per_second"] > 0 for result in results))
+
     def test_constructing_txt_output_filename_with_user_input(self):
         args = ["pic.png", "-od", r"C:\test", "-m", "bw"]
         args_parsed = ascii.parse_arguments(args)
@@ -114,6 +591,13 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(1280 * image.JPG_CHAR_SAFE_BOX_WIDTH, new_width)
         self.assertEqual(720 * image.JPG_CHAR_SAFE_BOX_HEIGHT, new_height)
 
+    def test_resizing_video_matches_rendered_frames(self):
+        for width, height in ((5, 46), (7, 3), (1920, 1080)):
+            frame = make_frames(1, height, width)[0]
+            args = ascii.parse_arguments(["vid.avi", "-m", "v", "-w", "100"])
+            rendered = video.convert_frame(frame, args)
+            self.assertEqual(video.resize_video(width, height, 100), (rendered.shape[1], rendered.shape[0]))
+
     def test_resizing_video_empty_width(self):
         width, height = 1920, 1080
         with self.assertLogs('root', level='INFO') as cm:
@@ -178,6 +662,256 @@ class MyTestCase(unittest.TestCase):
         test_image = Image.new("RGB", (1280, 720), "red")
         self.assertEqual((400, 225), image.resize_image(test_image, new_width=400).size)
 
+    def test_video_pipeline_keeps_frame_order(self):
+        args = ascii.parse_arguments(["vid.avi", "-m", "v", "-w", "8"])
+        frames = make_frames(7)
+        serial = [frame.copy() for frame in video.convert_frames_serially(FakeVideoCapture(frames), args)]
+        pipelined = list(video.convert_frames_in_pool(FakeVideoCapture(frames), args, workers=2))
+        self.assertEqual(7, len(pipelined))
+        for expected, actual in zip(serial, pipelined):
+            self.assertTrue(np.array_equal(expected, actual))
+
+        shared = [frame.copy() for frame in video.convert_frames_in_shared_memory(FakeVideoCapture(frames), args,
+                                                                                  workers=2)]
+        self.assertEqual(7, len(shared))
+        for expected, actual in zip(serial, shared):
+            self.assertTrue(np.array_equal(expected, actual))
+
+        # the reader fails on the frame of another size, the error reaches the consumer instead of a hang
+        frames.append(make_frames(1, 14, 16)[0])
+        with self.assertRaises(ValueError):
+            list(video.convert_frames_in_shared_memory(FakeVideoCapture(frames), args, workers=2))
+
+    def test_image_sequence_frames_have_size_of_first_page(self):
+        pages = [Image.new("RGB", size, "red") for size in ((40, 30), (64, 20), (20, 50))]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "pages.tif")
+            pages[0].save(path, save_all=True, append_images=pages[1:])
+            capture = video.open_image_sequence(path)
+            shapes = []
+            while True:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                shapes.append(frame.shape)
+            capture.release()
+        self.assertEqual([(30, 40, 3)] * 3, shapes)
+
+    def test_video_sampling_decodes_only_selected_frames(self):
+        frames = make_frames(30)
+        capture = FakeVideoCapture(frames, fps=10)
+        sampled = video.SampledCapture(capture, start=1.0, end=2.0, every_n=2)
+        selected = []
+        while True:
+            ret, frame = sampled.read()
+            if not ret:
+                break
+            selected.append(frame)
+        self.assertEqual([frames[index] for index in (10, 12, 14, 16, 18)], selected)
+        self.assertEqual(5, capture.decoded)
+        self.assertEqual(5, sampled.get(cv2.CAP_PROP_FPS))
+
+        capture = FakeVideoCapture(frames, fps=10)
+        sampled = video.SampledCapture(capture, fps=2.5)
+        selected = [sampled.read()[1] for _ in range(8)]
+        self.assertEqual([frames[index] for index in range(0, 30, 4)], selected)
+        self.assertEqual((False, None), sampled.read())
+        self.assertEqual(8, capture.decoded)
+
+    def test_jpeg_is_decoded_at_reduced_scale_with_same_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "pic.jpg")
+            benchmark.make_synthetic_image((400, 300)).save(path, quality=95)
+            converter = image.Converter(40)
+            with Image.open(path) as picture:
+                picture.load()
+                expected = np.asarray(image.resize_image(picture, 40), dtype=np.int16)
+            with Image.open(path) as picture:
+                resized = converter.resize(picture)
+                self.assertEqual((50, 38), picture.size)
+            self.assertEqual(expected.shape, np.asarray(resized).shape)
+            self.assertLess(np.abs(expected - np.asarray(resized, dtype=np.int16)).mean(), 4)
+
+            with Image.open(path) as picture:
+                self.assertEqual((40, 15), image.Converter(40, char_aspect=2).resize(picture).size)
+            with Image.open(path) as picture:
+                self.assertEqual((40, 30), image.Converter(40, mode="c", char_aspect=2).resize(picture).size)
+
+    def test_live_width_adapts_to_frame_budget(self):
+        adaptive_width = live.AdaptiveWidth(100, budget=0.01)
+        widths = [adaptive_width.update(0.02) for _ in range(6)]
+        self.assertEqual([100, 100, 80, 80, 80, 64], widths)
+        widths = [adaptive_width.update(0.001) for _ in range(live.GROW_AFTER_FRAMES)]
+        self.assertEqual(80, widths[-1])
+        self.assertEqual(64, widths[-2])
+
+        frames = make_frames(20)
+        args = ascii.parse_arguments(["0", "-m", "l", "-w", "8", "-fr", "1000"])
+        capture = FakeVideoCapture(frames)
+        capture.release = Mock()
+        result = live.run_live(capture, args, show=lambda ascii_frame: False)
+        self.assertEqual(len(frames), result["shown"] + result["dropped"])
+        self.assertGreater(result["shown"], 0)
+        capture.release.assert_called_once()
+
+        capture = FakeVideoCapture(frames)
+        capture.read = Mock(side_effect=[(True, frames[0]), (True, frames[1]), OSError("capture has failed")])
+        with self.assertRaisesRegex(OSError, "capture has failed"):
+            live.run_live(capture, args, show=lambda ascii_frame: False)
+
+    def test_video_raw_format_replays_rendered_frames(self):
+        frames = make_frames(3)
+        with tempfile.TemporaryDirectory() as directory:
+            args = ascii.parse_arguments(["vid.avi", "-m", "v", "-w", "8", "-j", "1", "-vf", "raw", "-od", directory])
+            video.write_raw_video(FakeVideoCapture(frames), args, 25.0)
+            with asciivideo.AsciiVideoReader(os.path.join(directory, "ascii.asv")) as reader:
+                self.assertEqual((3, 8, 25.0), (len(reader), reader.columns, reader.fps))
+                for index in (2, 0):
+                    expected = video.convert_frame(frames[index], args)
+                    self.assertTrue(np.array_equal(expected[..., ::-1], asciivideo.render_frame(reader, index)))
+
+    def test_video_frame_is_rendered_in_bgr_into_reused_buffer(self):
+        args = ascii.parse_arguments(["vid.avi", "-m", "v"])
+        frame = make_frames(1)[0]
+        expected = image.Converter(mode="v").to_array(Image.fromarray(np.ascontiguousarray(frame[..., ::-1])))
+        output = np.empty_like(expected)
+        self.assertIs(output, video.convert_frame(frame, args, out=output))
+        self.assertTrue(np.array_equal(expected[..., ::-1], output))
+
+    def test_video_delta_rendering_without_threshold_matches_full_rendering(self):
+        args = ascii.parse_arguments(["vid.avi", "-m", "v", "-w", "8", "-dt", "0"])
+        frames = make_frames(1) * 2 + make_frames(2)
+        frames[1] = frames[1].copy()
+        frames[1][0, 0] = 255 - frames[1][0, 0]
+        serial = [frame.copy() for frame in video.convert_frames_serially(FakeVideoCapture(frames), args)]
+        with self.assertLogs('root', level='INFO') as cm:
+            delta = [frame.copy() for frame in video.convert_frames_with_delta(FakeVideoCapture(frames), args)]
+        self.assertEqual(4, len(delta))
+        for expected, actual in zip(serial, delta):
+            self.assertTrue(np.array_equal(expected, actual))
+        self.assertRegex(cm.output[-1], r"^INFO:root:\d+\.\d% of cells reused per frame on average$")
+
+    def test_terminal_screen_redraws_only_changed_cells(self):
+        screen = terminal.TerminalScreen(terminal.ANSI_TRUECOLOR)
+        char_codes = np.full((2, 3), ord('#'), dtype=np.uint8)
+        pixels = np.zeros((2, 3, 3), dtype=np.uint8)
+        first = screen.draw(char_codes, pixels)
+        self.assertTrue(first.startswith(terminal.CLEAR_SCREEN + "\x1b[1;1H\x1b[38;2;0;0;0m###"))
+
+        char_codes = char_codes.copy()
+        char_codes[1, 2] = ord('@')
+        pixels = pixels.copy()
+        pixels[1, 2] = (255, 128, 1)
+        self.assertEqual("\x1b[2;3H\x1b[38;2;255;128;1m@", screen.draw(char_codes, pixels))
+        self.assertEqual("", screen.draw(char_codes, pixels))
+
+    def test_server_resizes_jpeg_upload_once(self):
+        picture = benchmark.make_synthetic_image((300, 88))
+        upload = io.BytesIO()
+        picture.save(upload, format="JPEG")
+        upload.seek(0)
+        with Image.open(upload) as jpeg:
+            expected = image.Converter(width=100).to_text(jpeg)
+        self.assertEqual(expected.encode("utf8"), server.convert_upload(upload.getvalue(), "text", 100))
+
+    def test_server_converts_concurrent_uploads(self):
+        picture = Image.fromarray(np.random.default_rng(3).integers(0, 256, (24, 32, 3), dtype=np.uint8))
+        upload = io.BytesIO()
+        picture.save(upload, format="PNG")
+
+        async def post(port: int, target: str, body: bytes) -> tuple:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"POST {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("latin-1") + body)
+            response = await reader.read()
+            writer.close()
+            head, _, data = response.partition(b"\r\n\r\n")
+            return int(head.split()[1]), data
+
+        async def run() -> tuple:
+            conversion_server = server.ConversionServer(workers=2)
+            await conversion_server.start(port=0)
+            try:
+                responses = await asyncio.gather(*(post(conversion_server.port, "/convert?width=16", upload.getvalue())
+                                                   for _ in range(4)),
+                                                 post(conversion_server.port, "/convert?format=ansi&width=16",
+                                                      upload.getvalue()),
+                                                 post(conversion_server.port, "/convert", b"not a picture"))
+                return responses, conversion_server.report()
+            finally:
+                await conversion_server.close()
+
+        responses, report = asyncio.run(run())
+        expected = image.Converter(width=16).to_text(picture).encode("utf8")
+        self.assertEqual([(200, expected)] * 4, responses[:4])
+        self.assertEqual(200, responses[4][0])
+        self.assertEqual(12, responses[4][1].count(terminal.RESET_COLOR.encode("latin-1")))
+        self.assertEqual(415, responses[5][0])
+        self.assertEqual(6, report["counters"]["requests"])
+
+    def test_server_rejects_invalid_requests_and_restarts_workers(self):
+        picture = Image.fromarray(np.random.default_rng(4).integers(0, 256, (24, 32, 3), dtype=np.uint8))
+        upload = io.BytesIO()
+        picture.save(upload, format="PNG")
+
+        async def send(port: int, request: bytes) -> int:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            response = await reader.read()
+            writer.close()
+            return int(response.split()[1])
+
+        def post(target: str, body: bytes) -> bytes:
+            return (f"POST {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n"
+                    f"Connection: close\r\n\r\n").encode("latin-1") + body
+
+        async def run() -> tuple:
+            conversion_server = server.ConversionServer(workers=1)
+            await conversion_server.start(port=0)
+            port = conversion_server.port
+            try:
+                rejected = [await send(port, request) for request in (
+                    b"POST /convert HTTP/1.1\r\nContent-Length: -5\r\n\r\n",
+                    b"GET /" + b"a" * (2 ** 16 + 1024) + b" HTTP/1.1\r\n\r\n",
+                    post("/convert?width=0", upload.getvalue()),
+                    post(f"/convert?width={server.MAX_WIDTH + 1}", upload.getvalue()))]
+                statuses = [await send(port, post("/convert?width=16", upload.getvalue()))]
+                # the worker crashes, the next request fails and the pool is replaced for the rest
+                for process in list(conversion_server.pool._processes.values()):
+                    process.kill()
+                    process.join()
+                for width in (8, 12):
+                    statuses.append(await send(port, post(f"/convert?width={width}", upload.getvalue())))
+                return rejected, statuses, conversion_server.report()
+            finally:
+                await conversion_server.close()
+
+        with self.assertLogs('root', level='ERROR'):
+            rejected, statuses, report = asyncio.run(run())
+        self.assertEqual([400] * 4, rejected)
+        self.assertEqual([200, 500, 200], statuses)
+        self.assertEqual(1, report["counters"]["pool restarts"])
+
+    def test_colored_text_merges_runs_of_same_color(self):
+        char_codes = np.frombuffer(b"ab<&cd", dtype=np.uint8).reshape((1, 6))
+        pixels = np.array([[(255, 0, 0), (255, 0, 0), (250, 2, 0), (0, 0, 255), (0, 0, 255), (0, 0, 255)]],
+                          dtype=np.uint8)
+        self.assertEqual('<span style="color:#ff0000">ab</span><span style="color:#fa0200">&lt;</span>'
+                         '<span style="color:#0000ff">&amp;cd</span>\n',
+                         ''.join(colortext.iter_html_lines(char_codes, pixels)))
+        self.assertEqual('<span style="color:#ff0000">ab&lt;</span><span style="color:#0000ff">&amp;cd</span>\n',
+                         ''.join(colortext.iter_html_lines(char_codes, pixels, levels=8)))
+        self.assertEqual("\x1b[38;2;255;0;0mab<\x1b[38;2;0;0;255m&cd\x1b[0m\n",
+                         ''.join(colortext.iter_ansi_lines(char_codes, pixels, levels=2)))
+        self.assertEqual([0, 85, 170, 255], colortext.quantize_colors(np.array([0, 60, 200, 255]), 4).tolist())
+        for levels in ("1", "257"):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                ascii.parse_arguments(["pic.png", "-m", "c", "-cf", "html", "-cl", levels])
+
+    def test_terminal_256_colors(self):
+        pixels = np.array([[(0, 0, 0), (255, 255, 255), (255, 0, 0)]], dtype=np.uint8)
+        self.assertEqual([[16, 231, 196]], colortext.quantize_to_ansi256(pixels).tolist())
+
     def test_video_random_input(self):
         args = ["notvideo.qwerty", "-m", "v"]
         args_parsed = ascii.parse_arguments(args)
@@ -206,6 +940,26 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(["ERROR:root:video file is an image. " +
                           "Use image mode instead (-m bw or -m c)"], cm.output)
 
+    def test_palette_image_matches_rgb_rendering(self):
+        pixels = make_frames(1, 30, 40)[0]
+        converter = image.Converter(mode="c")
+        ascii_art_string = converter.convert_pixels(pixels)
+        for kind in palette.PALETTES:
+            scene_palette = palette.ScenePalette(kind, 32)
+            converter.draw_indexed(ascii_art_string, pixels, scene_palette)
+            indexed = converter.draw_indexed(ascii_art_string, pixels, scene_palette)
+            self.assertEqual("P", indexed.mode)
+            colors = np.frombuffer(scene_palette.rgb, dtype=np.uint8).reshape((-1, 3))[scene_palette.match(pixels)]
+            char_codes = converter.map_pixels(pixels)
+            expected = glyphs.render_glyphs(converter.atlas, char_codes, colors)
+            self.assertTrue(np.array_equal(expected, np.asarray(indexed.convert(mode="RGB"))))
+
+        scene_palette = palette.ScenePalette(palette.ADAPTIVE, 16, palette.SCENE_CHANGE_ERROR)
+        reds, blues = pixels // 4 + (192, 0, 0), pixels // 4 + (0, 0, 192)
+        for scene in (reds, reds, blues):
+            scene_palette.match(scene.astype(np.uint8))
+        self.assertEqual(2, scene_palette.scenes)
+
     def test_png_instead_of_video(self):
         args = ["pic.png", "-m", "v"]
         args_parsed = ascii.parse_arguments(args)
@@ -1,12 +1,31 @@
 import argparse
+import collections
+import concurrent.futures
 import logging
+import multiprocessing
 import os
+import queue
+import threading
+import time
 
 import cv2
 import numpy as np
-from PIL import Image
+import PIL
+from PIL import Image, ImageSequence
 
-from image import JPG_CHAR_SAFE_BOX_HEIGHT, JPG_CHAR_SAFE_BOX_WIDTH, convert_image_to_ascii
+from asciivideo import AsciiVideoWriter
+from framering import FrameRing, attach_frame_ring
+from glyphs import build_glyph_atlas, render_glyph_cells, render_glyphs
+from image import (ASCII_CHARS, FONT, JPG_CHAR_SAFE_BOX_HEIGHT, JPG_CHAR_SAFE_BOX_WIDTH, build_char_codes,
+                   get_converter, get_converter_for_args, is_animated, map_frame_to_ascii)
+from modes import Backends
+from stats import STATS, run_with_stats, stage
+from terminal import DEFAULT_FPS
+
+# bounds the number of decoded and converted frames held in memory by the pipeline
+FRAMES_IN_FLIGHT_PER_WORKER = 2
+# frames of animations without duration are shown for 100 ms, like browsers do
+DEFAULT_FRAME_DURATION = 100
 
 
 def construct_output_filename(args: argparse) -> str:
@@ -21,13 +40,14 @@ def construct_output_filename(args: argparse) -> str:
     output_file = args.output_dir
     if output_file is None:
         output_file = os.path.dirname(args.image)
-    output_file += os.sep + "ascii.avi"
+    output_file += os.sep + ("ascii.asv" if args.video_format == "raw" else "ascii.avi")
     return output_file
 
 
 def resize_video(width: int, height: int, new_width: int) -> tuple[int, int]:
     """
-    Resizes the video depending on selected width
+    Calculates the size of ASCII-art video frames in pixels depending on selected width,
+    every character is rendered in the safe box, look compute_frame_size
 
     :param width: width of the video
     :param height: height of the video
@@ -37,56 +57,724 @@ def resize_video(width: int, height: int, new_width: int) -> tuple[int, int]:
     if new_width is None:
         logging.info("custom width was not defined. " +
                      "ASCII-art will be the same size as the video")
-        result_height = height * JPG_CHAR_SAFE_BOX_HEIGHT
-        result_width = width * JPG_CHAR_SAFE_BOX_WIDTH
     elif new_width == 0:
         logging.info("user has entered zero width. " +
                      "ASCII-art will be the same size as the video")
-        result_height = height * JPG_CHAR_SAFE_BOX_HEIGHT
-        result_width = width * JPG_CHAR_SAFE_BOX_WIDTH
     elif new_width < 0:
         logging.warning("user has entered width below zero. " +
                         "ASCII-art will be the same size as the video")
-        result_height = height * JPG_CHAR_SAFE_BOX_HEIGHT
-        result_width = width * JPG_CHAR_SAFE_BOX_WIDTH
-    elif new_width > 0:
-        ratio = height / width
-        result_height = int(new_width * ratio) * JPG_CHAR_SAFE_BOX_HEIGHT
-        result_width = new_width * JPG_CHAR_SAFE_BOX_WIDTH
+    columns, rows = compute_frame_size(width, height, new_width)
+    return columns * JPG_CHAR_SAFE_BOX_WIDTH, rows * JPG_CHAR_SAFE_BOX_HEIGHT
+
+
+def compute_frame_size(width: int, height: int, new_width: int, char_aspect: float = 1.0) -> tuple[int, int]:
+    """
+    Calculates the size of the frame in characters, look resize_video
+
+    :param width: width of the video
+    :param height: height of the video
+    :param new_width: new width of the video
+    :param char_aspect: height to width ratio of the character cell, taller cells need fewer rows
+    :return: tuple with number of columns and rows
+    """
+    if new_width is None or new_width <= 0:
+        return width, max(1, int(height / char_aspect))
+    return new_width, max(1, int(new_width * height / width / char_aspect))
+
+
+def resize_frame(frame: np.ndarray, size: tuple) -> np.ndarray:
+    """
+    Resizes decoded frame with cv2, the frame itself
+    is returned when it already has the right size
+
+    :param frame: array of BGR-pixels of the decoded frame
+    :param size: new size of the frame
+    :return: array of BGR-pixels of the resized frame
+    """
+    if size == (frame.shape[1], frame.shape[0]):
+        return frame
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def convert_frame(frame: np.ndarray, args: argparse, out: np.ndarray = None) -> np.ndarray:
+    """
+    Converts decoded video frame into rendered ASCII-art frame.
+    The frame never leaves NumPy: brightness is taken from the RGB view
+    of the BGR frame and glyphs are tinted with BGR colours,
+    so the result goes to cv2 as it is.
+    Runs in the worker processes of the frame pipeline
+
+    :param frame: array of BGR-pixels of the decoded frame
+    :param args: parsed console arguments
+    :param out: array of the rendered frame to reuse, a new one by default
+    :return: array of BGR-pixels of the rendered ASCII-art frame
+    """
+    converter = get_converter_for_args(args)
+    with stage("resize"):
+        pixels = resize_frame(frame, converter.scale_size(compute_frame_size(frame.shape[1], frame.shape[0],
+                                                                             args.width, converter.char_aspect)))
+    if args.backend == Backends.PYTHON.value:
+        with stage("mapping"):
+            ascii_art_string = converter.convert_pixels(pixels[..., ::-1])
+        with stage("rendering"):
+            return converter.draw(ascii_art_string, pixels)
+    with stage("mapping"):
+        char_codes = converter.map_pixels(pixels[..., ::-1])
+    with stage("rendering"):
+        return render_glyphs(converter.atlas, char_codes, converter.cell_colors(pixels), out=out)
+
+
+def convert_frame_to_grid(frame: np.ndarray, args: argparse) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts decoded video frame into the characters and colors of ASCII-art
+    without rendering them, look asciivideo.AsciiVideoWriter.
+    Runs in the worker processes of the frame pipeline
+
+    :param frame: array of BGR-pixels of the decoded frame
+    :param args: parsed console arguments
+    :return: tuple with the array of character indices with shape (rows, columns)
+             and the array of RGB-colors of characters with shape (rows, columns, 3)
+    """
+    converter = get_converter_for_args(args)
+    with stage("resize"):
+        pixels = resize_frame(frame, converter.scale_size(compute_frame_size(frame.shape[1], frame.shape[0],
+                                                                             args.width, converter.char_aspect)))[..., ::-1]
+    with stage("mapping"):
+        return converter.map_to_indices(pixels), np.ascontiguousarray(converter.cell_colors(pixels))
+
+
+def convert_frame_to_text(frame: np.ndarray, args: argparse) -> str:
+    """
+    Converts decoded video frame into ASCII-art string.
+    Runs in the worker processes of the frame pipeline
+
+    :param frame: array of BGR-pixels of the decoded frame
+    :param args: parsed console arguments
+    :return: ASCII-art string
+    """
+    converter = get_converter_for_args(args)
+    with stage("resize"):
+        pixels = resize_frame(frame, converter.scale_size(compute_frame_size(frame.shape[1], frame.shape[0],
+                                                                             args.width, converter.char_aspect)))
+    with stage("mapping"):
+        return converter.convert_pixels(pixels[..., ::-1])
+
+
+class ImageSequenceCapture:
+    """
+    Reads frames of the multi-frame image (animated GIF, WebP, PNG or multi-page TIFF)
+    one by one with the interface of cv2.VideoCapture, so that they go through
+    the frame pipeline of the video mode. Every frame has the size of the first one,
+    pages of multi-page TIFF of other sizes are resized to it
+    """
+
+    def __init__(self, image: Image):
+        self.image = image
+        self.size = image.size
+        self.frames = ImageSequence.Iterator(image)
+        self.fps = 1000 / (image.info.get("duration") or DEFAULT_FRAME_DURATION)
+        self.durations = []
+        self.frame = None
+
+    def grab(self) -> bool:
+        """
+        Moves to the next frame without converting it
+
+        :return: False after the last frame
+        """
+        try:
+            self.frame = next(self.frames)
+        except StopIteration:
+            return False
+        self.durations.append(self.frame.info.get("duration") or DEFAULT_FRAME_DURATION)
+        return True
+
+    def retrieve(self) -> tuple:
+        """
+        :return: tuple with True and array of BGR-pixels of the current frame
+        """
+        frame = self.frame.convert(mode="RGB")
+        if frame.size != self.size:
+            frame = frame.resize(self.size)
+        return True, np.ascontiguousarray(np.asarray(frame)[..., ::-1])
+
+    def read(self) -> tuple:
+        """
+        :return: tuple with True and array of BGR-pixels of the next frame, (False, None) after the last one
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def set(self, prop: int, value: float) -> bool:
+        # frames are read in order, so seeking is done by grabbing
+        return False
+
+    def get(self, prop: int) -> float:
+        return {cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FRAME_WIDTH: self.size[0],
+                cv2.CAP_PROP_FRAME_HEIGHT: self.size[1],
+                cv2.CAP_PROP_FRAME_COUNT: getattr(self.image, "n_frames", 1)}.get(prop, 0)
+
+    def isOpened(self) -> bool:
+        return True
+
+    def release(self):
+        self.image.close()
+
+
+def open_image_sequence(path: str):
+    """
+    :param path: path to the picture
+    :return: ImageSequenceCapture object or None if the file is not a multi-frame picture
+    """
+    try:
+        image = Image.open(path)
+    except (FileNotFoundError, PIL.UnidentifiedImageError, OSError):
+        return None
+    if not is_animated(image):
+        image.close()
+        return None
+    return ImageSequenceCapture(image)
+
+
+class SampledCapture:
+    """
+    Reads only the selected frames of the opened video with the interface of cv2.VideoCapture.
+    The video is sought to the start of the clip, frames which are not selected
+    are grabbed without decoding, so a short clip of a long video costs
+    about the same as the short video
+    """
+
+    def __init__(self, video: cv2.VideoCapture, start: float = None, end: float = None, fps: float = None,
+                 every_n: int = None):
+        """
+        :param video: opened cv2.VideoCapture object
+        :param start: start of the clip in seconds, the beginning of the video by default
+        :param end: end of the clip in seconds, the end of the video by default
+        :param fps: frame rate of the output, the frame rate of the video by default
+        :param every_n: only every n-th frame of the video is converted
+        """
+        self.video = video
+        self.source_fps = video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        self.every_n = every_n or 1
+        self.fps = self.source_fps / self.every_n
+        if fps is not None:
+            self.fps = min(self.fps, fps)
+        self.end = end
+        # index of the next frame and time of the next output frame from the start of the clip
+        self.frame_index = 0
+        self.next_time = 0.0
+        self.start = self.seek(start or 0.0)
+
+    def seek(self, start: float) -> float:
+        """
+        :param start: start of the clip in seconds
+        :return: time of the first frame of the clip
+        """
+        if start <= 0:
+            return 0.0
+        if self.video.set(cv2.CAP_PROP_POS_MSEC, start * 1000):
+            return start
+        # the video can not be sought, frames before the start are grabbed one by one
+        skipped = round(start * self.source_fps)
+        for _ in range(skipped):
+            if not self.video.grab():
+                break
+        return skipped / self.source_fps
+
+    def read(self) -> tuple:
+        """
+        :return: tuple with True and array of pixels of the next selected frame,
+                 (False, None) after the end of the clip
+        """
+        while True:
+            time_from_start = self.frame_index / self.source_fps
+            if self.end is not None and self.start + time_from_start >= self.end:
+                return False, None
+            # half a frame of tolerance keeps rounding errors from dropping frames
+            selected = (self.frame_index % self.every_n == 0
+                        and time_from_start >= self.next_time - 0.5 / self.source_fps)
+            self.frame_index += 1
+            if selected:
+                self.next_time += 1 / self.fps
+                return self.video.read()
+            if not self.video.grab():
+                return False, None
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return self.video.get(prop)
+
+    def isOpened(self) -> bool:
+        return self.video.isOpened()
+
+    def release(self):
+        self.video.release()
+
+
+def is_sampled(args: argparse) -> bool:
+    """
+    :param args: parsed console arguments
+    :return: True if only a part of the frames is converted
+    """
+    return any(value is not None for value in (args.start, args.end, args.fps, args.every_n))
+
+
+class DeltaRenderer:
+    """
+    Renders frames incrementally. Character and colour grids of the previous
+    frame are kept, and only the cells whose colour (and so brightness)
+    changed by more than the threshold are converted and rendered again
+    """
+
+    def __init__(self, threshold: int, chars: str = ASCII_CHARS):
+        self.threshold = threshold
+        self.chars = chars
+        self.atlas = build_glyph_atlas(chars, FONT, JPG_CHAR_SAFE_BOX_WIDTH, JPG_CHAR_SAFE_BOX_HEIGHT)
+        self.char_codes = None
+        self.colors = None
+        self.output = None
+
+    def find_affected_cells(self, changed: np.ndarray) -> np.ndarray:
+        """
+        Glyphs reach into the neighbouring cells, so every cell
+        covered by a changed glyph has to be rendered again
+
+        :param changed: boolean array of changed cells
+        :return: boolean array of cells to render
+        """
+        height, width = changed.shape
+        affected = np.zeros_like(changed)
+        for row_shift in range(self.atlas.first_row, self.atlas.first_row + self.atlas.rows):
+            for column_shift in range(self.atlas.first_column, self.atlas.first_column + self.atlas.columns):
+                affected[max(row_shift, 0):height + min(row_shift, 0),
+                         max(column_shift, 0):width + min(column_shift, 0)] |= \
+                    changed[max(-row_shift, 0):height - max(row_shift, 0),
+                            max(-column_shift, 0):width - max(column_shift, 0)]
+        return affected
+
+    def render(self, pixels: np.ndarray) -> tuple[np.ndarray, float]:
+        """
+        Renders the next frame. The returned array is reused for the next frames
+
+        :param pixels: array of BGR-pixels of the resized frame
+        :return: tuple with the array of BGR-pixels of the rendered frame
+                 and the fraction of cells reused from the previous frame
+        """
+        char_codes = build_char_codes(self.chars)
+        if self.char_codes is None or self.char_codes.shape != pixels.shape[:2]:
+            self.colors = pixels.copy()
+            self.char_codes = char_codes[map_frame_to_ascii(self.colors[..., ::-1], self.chars)]
+            self.output = render_glyphs(self.atlas, self.char_codes, self.colors)
+            return self.output, 0.0
+
+        # the character follows from the colour, so kept cells stay consistent
+        changed = np.abs(pixels.astype(np.int16) - self.colors).max(axis=2) > self.threshold
+        self.colors[changed] = pixels[changed]
+        self.char_codes[changed] = char_codes[map_frame_to_ascii(self.colors[changed][..., ::-1], self.chars)]
+
+        affected = self.find_affected_cells(changed)
+        rows, columns = np.nonzero(affected)
+        if len(rows):
+            height, width = self.char_codes.shape
+            cells = self.output.reshape((height, self.atlas.cell_height, width, self.atlas.cell_width, 3))
+            cells[rows, :, columns] = render_glyph_cells(self.atlas, self.char_codes, self.colors, rows, columns)
+        return self.output, 1 - len(rows) / affected.size
+
+
+def read_frames(video: cv2.VideoCapture, frames: queue.Queue, stop: threading.Event, errors: list):
+    """
+    Reader stage of the frame pipeline: decodes frames into the bounded queue.
+    None is put into the queue after the last frame and after an error as well,
+    the error is left for the consumer to raise, look raise_reader_error
+
+    :param video: opened cv2.VideoCapture object
+    :param frames: bounded queue of decoded frames
+    :param stop: event which is set when the pipeline is stopped early
+    :param errors: list the exception of the reader is appended to
+    """
+    try:
+        while not stop.is_set():
+            with stage("frame decode"):
+                ret, frame = video.read()
+            if ret is not True:
+                break
+            frames.put(frame)
+    except Exception as error:
+        errors.append(error)
+    finally:
+        frames.put(None)
+
 
-    return result_width, result_height
+def raise_reader_error(errors: list):
+    """
+    Raises the exception of the reader thread in the consumer
+
+    :param errors: list of exceptions of the reader thread
+    """
+    if errors:
+        raise errors[0]
+
+
+def convert_frames_serially(video: cv2.VideoCapture, args: argparse, convert=convert_frame):
+    """
+    Decodes and converts frames one by one in the current process
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :param convert: function which converts one frame, look convert_frame
+    :return: generator of converted frames, rendered frames reuse the same array
+    """
+    # numpy backend renders every frame into the array of the first one
+    reuse_output = convert is convert_frame and args.backend != Backends.PYTHON.value
+    ascii_frame = None
+    while True:
+        with stage("frame decode"):
+            ret, frame = video.read()
+        if ret is not True:
+            break
+        with stage("frame"):
+            if reuse_output:
+                ascii_frame = convert_frame(frame, args, out=ascii_frame)
+            else:
+                ascii_frame = convert(frame, args)
+        yield ascii_frame
+
+
+def convert_frames_with_delta(video: cv2.VideoCapture, args: argparse):
+    """
+    Decodes and converts frames one by one, rendering again
+    only the cells that changed since the previous frame
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :return: generator of rendered ASCII-art frames
+    """
+    # cells are converted with linear selection, look Selections
+    chars = get_converter(args.width, args.mode, args.backend, args.charset or ASCII_CHARS).chars
+    renderer = DeltaRenderer(args.delta_threshold, chars)
+    reused_cells = []
+    while True:
+        with stage("frame decode"):
+            ret, frame = video.read()
+        if ret is not True:
+            break
+        with stage("frame"):
+            ascii_frame, reused = renderer.render(
+                resize_frame(frame, compute_frame_size(frame.shape[1], frame.shape[0], args.width)))
+        logging.debug(f"frame {len(reused_cells)}: {reused:.1%} of cells reused")
+        reused_cells.append(reused)
+        yield ascii_frame
+
+    if reused_cells:
+        logging.info(f"{sum(reused_cells) / len(reused_cells):.1%} of cells reused per frame on average")
+
+
+def wait_for_frame(submitted: float, future: concurrent.futures.Future) -> np.ndarray:
+    """
+    Waits for the frame converted in the process pool and records its latency
+    with the stages recorded in the worker process
+
+    :param submitted: time when the frame was submitted to the pool
+    :param future: future of run_with_stats
+    :return: array of pixels of the rendered ASCII-art frame
+    """
+    ascii_frame, durations = future.result()
+    STATS.merge(durations)
+    STATS.record("frame", time.perf_counter() - submitted)
+    return ascii_frame
+
+
+def convert_frames_in_pool(video: cv2.VideoCapture, args: argparse, workers: int, convert=convert_frame):
+    """
+    Decodes frames in the reader thread and converts them in the process pool.
+    Frames are yielded in the original order, the number of decoded frames
+    and frames in flight is bounded, so memory usage does not depend on the video length
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :param workers: number of worker processes
+    :param convert: function which converts one frame, look convert_frame
+    :return: generator of converted frames
+    """
+    max_pending = workers * FRAMES_IN_FLIGHT_PER_WORKER
+    frames = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    errors = []
+    pending = collections.deque()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn")) as pool:
+        reader = threading.Thread(target=read_frames, args=(video, frames, stop, errors), daemon=True)
+        reader.start()
+        try:
+            while True:
+                frame = frames.get()
+                if frame is None:
+                    raise_reader_error(errors)
+                    break
+                pending.append((time.perf_counter(), pool.submit(run_with_stats, convert, frame, args)))
+                # writer stage: results leave the pipeline in the order frames were decoded
+                if len(pending) >= max_pending:
+                    yield wait_for_frame(*pending.popleft())
+            while pending:
+                yield wait_for_frame(*pending.popleft())
+        finally:
+            stop.set()
+            for _, future in pending:
+                future.cancel()
+            while reader.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+
+def convert_frame_in_ring(spec: tuple, slot: int, args: argparse) -> int:
+    """
+    Converts the decoded frame of the slot into the rendered frame of the same slot.
+    Runs in the worker processes of the frame pipeline
+
+    :param spec: description of the ring, look FrameRing.spec
+    :param slot: index of the slot
+    :param args: parsed console arguments
+    :return: index of the slot
+    """
+    ring = attach_frame_ring(*spec)
+    convert_frame(ring.frames[slot], args, out=ring.outputs[slot])
+    return slot
+
+
+def read_frames_into_ring(video: cv2.VideoCapture, ring: FrameRing, free_slots: queue.Queue, frames: queue.Queue,
+                          stop: threading.Event, errors: list):
+    """
+    Decodes frames into free slots of the ring in the reader thread.
+    Waits for a free slot while all of them are in use
+
+    :param video: opened cv2.VideoCapture object
+    :param ring: FrameRing object
+    :param free_slots: queue of indices of free slots, None stops the reader
+    :param frames: queue of indices of slots with decoded frames, None marks the end of the video or an error
+    :param stop: event which stops the reader
+    :param errors: list the exception of the reader is appended to, look read_frames
+    """
+    try:
+        while not stop.is_set():
+            slot = free_slots.get()
+            if slot is None:
+                break
+            with stage("frame decode"):
+                ret, frame = video.read()
+            if ret is not True:
+                break
+            ring.frames[slot] = frame
+            frames.put(slot)
+    except Exception as error:
+        errors.append(error)
+    finally:
+        frames.put(None)
+
+
+def convert_frames_in_shared_memory(video: cv2.VideoCapture, args: argparse, workers: int):
+    """
+    Decodes frames in the reader thread and renders them in the process pool like
+    convert_frames_in_pool, but decoded and rendered frames stay in the slots of the ring
+    in shared memory and only slot indices are sent between processes.
+    The number of slots bounds the frames in flight, so the reader waits for a free slot
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :param workers: number of worker processes
+    :return: generator of rendered frames, every frame is valid until the next one is requested
+    """
+    ret, frame = video.read()
+    if ret is not True:
+        return
+    converter = get_converter_for_args(args)
+    columns, rows = compute_frame_size(frame.shape[1], frame.shape[0], args.width)
+    output_shape = (rows * converter.atlas.cell_height, columns * converter.atlas.cell_width, 3)
+    max_pending = workers * FRAMES_IN_FLIGHT_PER_WORKER
+    # frames in flight, the frame being decoded and the frame held by the consumer
+    ring = FrameRing(max_pending + 2, frame.shape, output_shape)
+    ring.frames[0] = frame
+    frames = queue.Queue()
+    frames.put(0)
+    free_slots = queue.Queue()
+    for slot in range(1, ring.slots):
+        free_slots.put(slot)
+    stop = threading.Event()
+    errors = []
+    pending = collections.deque()
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context("spawn")) as pool:
+            reader = threading.Thread(target=read_frames_into_ring,
+                                      args=(video, ring, free_slots, frames, stop, errors), daemon=True)
+            reader.start()
+            try:
+                while True:
+                    slot = frames.get()
+                    if slot is None:
+                        raise_reader_error(errors)
+                        break
+                    pending.append((time.perf_counter(), pool.submit(run_with_stats, convert_frame_in_ring,
+                                                                      ring.spec, slot, args)))
+                    if len(pending) >= max_pending:
+                        slot = wait_for_frame(*pending.popleft())
+                        yield ring.outputs[slot]
+                        free_slots.put(slot)
+                while pending:
+                    slot = wait_for_frame(*pending.popleft())
+                    yield ring.outputs[slot]
+                    free_slots.put(slot)
+            finally:
+                stop.set()
+                free_slots.put(None)
+                for _, future in pending:
+                    future.cancel()
+                reader.join()
+    finally:
+        ring.close()
+
+
+def show_frame(ascii_frame: np.ndarray) -> bool:
+    """
+    Shows rendered frame in the preview window
+
+    :param ascii_frame: array of pixels of the rendered ASCII-art frame
+    :return: True if user has pressed q to stop the conversion
+    """
+    cv2.imshow('ASCII-art', ascii_frame)
+    key = cv2.waitKey(1)
+    return key == ord("q")
+
+
+def convert_frames(video: cv2.VideoCapture, args: argparse, convert=convert_frame):
+    """
+    Selects the frame pipeline. With more than one worker frames are converted
+    in the process pool while the next ones are being decoded, rendered frames
+    are passed through shared memory, look convert_frames_in_shared_memory. In delta mode
+    every frame depends on the previous one, so frames are converted in one process
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :param convert: function which converts one frame, look convert_frame
+    :return: generator of converted frames
+    """
+    workers = args.workers
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
 
+    if args.delta_threshold is not None and convert is convert_frame:
+        return convert_frames_with_delta(video, args)
+    if workers > 1 and convert is convert_frame and args.backend != Backends.PYTHON.value:
+        return convert_frames_in_shared_memory(video, args, workers)
+    if workers > 1:
+        return convert_frames_in_pool(video, args, workers, convert)
+    return convert_frames_serially(video, args, convert)
 
-def render_ascii_video(video: cv2.VideoCapture, args: argparse):
+
+def write_raw_video(video: cv2.VideoCapture, args: argparse, fps: float):
+    """
+    Converts every frame of the video and writes characters and colors
+    of the frames to the ASCII-art video file, look asciivideo.
+    Frames are not rendered, so there is no preview
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :param fps: frame rate of the video
+    """
+    chars = get_converter_for_args(args).chars
+    grids = convert_frames(video, args, convert_frame_to_grid)
+    output = None
+    try:
+        for char_indices, colors in grids:
+            if output is None:
+                rows, columns = char_indices.shape
+                output = AsciiVideoWriter(construct_output_filename(args), columns, rows, fps, chars)
+            with stage("frame encode"):
+                output.write(char_indices, colors)
+    finally:
+        grids.close()
+        video.release()
+        if output is not None:
+            output.close()
+
+
+def render_ascii_video(video: cv2.VideoCapture, args: argparse) -> bool:
+    """
+    Converts every frame of the video and writes it to the .avi file
+    or to the ASCII-art video file, look convert_frames and write_raw_video.
+    With the segment length the .avi file is written in resumable segments, look segments.render_segments
+
+    :param video: opened cv2.VideoCapture object
+    :param args: parsed console arguments
+    :return: False if the segmented conversion was stopped or has failed
+    """
+    if is_sampled(args):
+        video = SampledCapture(video, args.start, args.end, args.fps, args.every_n)
     fps = video.get(cv2.CAP_PROP_FPS)
-    height = video.get(cv2.CAP_PROP_FRAME_HEIGHT)
-    width = video.get(cv2.CAP_PROP_FRAME_WIDTH)
+    if args.video_format == "raw":
+        write_raw_video(video, args, fps)
+        return True
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
     size = resize_video(width, height, args.width)
+    if args.segment_length is not None:
+        # segments imports the frame pipeline from this module
+        from segments import render_segments
+        return render_segments(video, args, fps, size)
 
+    ascii_frames = convert_frames(video, args)
     output = cv2.VideoWriter(construct_output_filename(args), cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
-    while True:
-        ret, image = video.read()
-        if ret is True:
-            image = Image.fromarray(image)
-            ascii_image = convert_image_to_ascii(image, args, is_video=True)
-
-            output.write(np.array(ascii_image))
-            cv2.imshow('ASCII-art', np.array(ascii_image))
-            key = cv2.waitKey(1)
-            if key == ord("q"):
-                break
-        else:
-            break
-    video.release()
-    output.release()
-    cv2.destroyAllWindows()
+    try:
+        for ascii_frame in ascii_frames:
+            with stage("frame encode"):
+                output.write(ascii_frame)
+            if not args.no_preview:
+                with stage("preview"):
+                    if show_frame(ascii_frame):
+                        break
+    finally:
+        ascii_frames.close()
+        video.release()
+        output.release()
+        if not args.no_preview:
+            cv2.destroyAllWindows()
+    return True
 
 
 def convert_video_to_ascii(args: argparse) -> bool:
     """
-    Converts video into ASCII-art video .avi file
+    Converts video or multi-frame picture into ASCII-art video .avi file
     :param args: parsed console arguments
     """
+    if ((args.start is not None and args.start < 0) or (args.fps is not None and args.fps <= 0)
+            or (args.every_n is not None and args.every_n < 1)):
+        logging.error("start must not be negative, frame rate and every n must be positive")
+        return False
+    if args.end is not None and args.end <= (args.start or 0):
+        logging.error("end of the clip must be after its start")
+        return False
+    if args.segment_length is not None:
+        if args.segment_length <= 0:
+            logging.error("segment length must be positive")
+            return False
+        if is_sampled(args) or args.video_format == "raw":
+            logging.error("segments are written only for every frame of the video in avi format")
+            return False
+    if args.segment_range is not None and (args.segment_length is None or args.segment_range[0] < 0
+                                           or args.segment_range[1] < args.segment_range[0]):
+        logging.error("segment range needs segment length, its first segment must not be negative "
+                      "or after the last one")
+        return False
+
+    sequence = open_image_sequence(args.image)
+    if sequence is not None:
+        return render_ascii_video(sequence, args)
+
     if (
         args.image.endswith(".png")
         or args.image.endswith(".jpg")
@@ -103,5 +791,4 @@ def convert_video_to_ascii(args: argparse) -> bool:
                       "be corrupted")
         return False
 
-    render_ascii_video(video, args)
-    return True
+    return render_ascii_video(video, args)